@@ -0,0 +1,144 @@
+import os
+import random
+from collections import namedtuple
+
+import nix_heuristic_gc.libnixstore_wrapper as libstore
+
+_NIX_BASE32 = "0123456789abcdfghijklmnpqrsvwxyz"
+
+SyntheticPathInfo = namedtuple(
+    "SyntheticPathInfo",
+    ("path", "nar_size", "registration_time", "references"),
+)
+
+
+class SyntheticStore:
+    # stands in for a libstore.Store holding path_count dead paths with
+    # a plausible reference structure, enough to build a GarbageGraph
+    # without needing a real store of that size
+
+    def __init__(
+        self,
+        path_count:int,
+        mean_references:float=4,
+        drv_fraction:float=0.2,
+        invalid_fraction:float=0.01,
+        substitutable_fraction:float=0.5,
+        seed:int=0,
+    ):
+        rng = random.Random(seed)
+
+        self.paths = []
+        for i in range(path_count):
+            hash_part = "".join(rng.choices(_NIX_BASE32, k=32))
+            suffix = ".drv" if rng.random() < drv_fraction else ""
+            self.paths.append(f"{hash_part}-synthetic-{i}{suffix}")
+
+        # paths may only reference paths earlier in the list, so
+        # reversing the list gives a topological ordering
+        self.path_infos = {}
+        self.substitutable = set()
+        for i, path in enumerate(self.paths):
+            if rng.random() < invalid_fraction:
+                continue
+
+            reference_count = min(
+                i,
+                int(rng.expovariate(1 / mean_references)) if mean_references else 0,
+            )
+            self.path_infos[path] = SyntheticPathInfo(
+                path=libstore.StorePath(path),
+                nar_size=rng.randrange(1, 1 << 24),
+                registration_time=1_600_000_000 + i,
+                references={
+                    # favour recent paths as real stores tend to
+                    libstore.StorePath(self.paths[i - 1 - int(rng.expovariate(1e-3)) % i])
+                    for _ in range(reference_count)
+                },
+            )
+            if rng.random() < substitutable_fraction:
+                self.substitutable.add(libstore.StorePath(path))
+
+    def materialize(
+        self,
+        root:str,
+        mean_files:float=16,
+        max_files:int=4096,
+        files_per_dir:int=32,
+        seed:int=0,
+    ) -> int:
+        # create a directory under root for each path containing a
+        # heavy-tailed number of small files with assorted atimes, so
+        # real filesystem walks can be made of it. like real store paths,
+        # most contain a handful of files but a few contain thousands.
+        # returns the total number of files created.
+        rng = random.Random(seed)
+        total_files = 0
+        for path in self.paths:
+            # a pareto distribution with shape 1.5 has a mean of 3
+            file_count = min(
+                max_files,
+                max(1, int(rng.paretovariate(1.5) * mean_files / 3)),
+            )
+            for i in range(file_count):
+                d = os.path.join(root, path, f"d{i // files_per_dir}")
+                if i % files_per_dir == 0:
+                    os.makedirs(d)
+                f = os.path.join(d, f"f{i}")
+                with open(f, "wb") as fh:
+                    fh.write(b"x" * rng.randrange(64))
+                atime = 1_600_000_000 + rng.randrange(10_000_000)
+                os.utime(f, (atime, atime))
+            total_files += file_count
+
+        return total_files
+
+    def collect_garbage(self, action, paths_to_delete=None):
+        return {f"/nix/store/{path}" for path in self.paths}, 0
+
+    def topo_sort_paths(self, store_paths):
+        return sorted(
+            store_paths,
+            key=lambda sp: -int(str(sp).partition("-synthetic-")[2].removesuffix(".drv")),
+        )
+
+    def query_path_info(self, store_path):
+        try:
+            return self.path_infos[str(store_path)]
+        except KeyError:
+            raise RuntimeError(f"path '{store_path}' is not valid") from None
+
+    def query_path_infos(self, store_paths):
+        paths, nar_sizes, registration_times, reference_offsets, references = (
+            [], [], [], [0], [],
+        )
+        for store_path in store_paths:
+            path_info = self.path_infos.get(str(store_path))
+            paths.append(str(store_path))
+            nar_sizes.append(path_info and path_info.nar_size)
+            registration_times.append(path_info and path_info.registration_time)
+            if path_info is not None:
+                references.extend(sorted(str(sp) for sp in path_info.references))
+            reference_offsets.append(len(references))
+
+        return paths, nar_sizes, registration_times, reference_offsets, references
+
+    def query_derivation_outputs(self, store_path):
+        return set()
+
+    def query_substitutable_paths(self, store_paths):
+        return self.substitutable & store_paths
+
+    query_substitutable_paths_interruptible = query_substitutable_paths
+
+    def get_setting(self, name):
+        return None
+
+    def get_uri(self):
+        return "synthetic"
+
+
+def synthetic_path_stat_agg(path):
+    # deterministic stand-in for fs.path_stat_agg
+    h = hash(path)
+    return float(1_600_000_000 + h % 10_000_000), 1 + h % 1000, h % (1 << 24)
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from nix_heuristic_gc.fs import path_stat_agg, py_path_stat_agg, sampled_path_stat_agg
+
+# set NHGC_BENCH_FILES to e.g. 2000000 for a tree resembling a large store
+_FILE_COUNT = int(os.environ.get("NHGC_BENCH_FILES", "100000"))
+_FILES_PER_DIR = 64
+_DIRS_PER_DIR = 8
+
+
+def _make_tree(root, file_count):
+    # a tree of directories, each containing _FILES_PER_DIR files and up to
+    # _DIRS_PER_DIR subdirectories
+    pending_dirs = [root]
+    created = 0
+    while created < file_count:
+        d = pending_dirs.pop(0)
+        for i in range(min(_FILES_PER_DIR, file_count - created)):
+            with open(os.path.join(d, f"f{i}"), "wb") as f:
+                f.write(b"x" * (i % 7))
+        created += _FILES_PER_DIR
+        for i in range(_DIRS_PER_DIR):
+            sub = os.path.join(d, f"d{i}")
+            os.mkdir(sub)
+            pending_dirs.append(sub)
+
+
+@pytest.fixture(scope="module")
+def tree(tmp_path_factory):
+    root = tmp_path_factory.mktemp("tree")
+    _make_tree(str(root), _FILE_COUNT)
+    return str(root)
+
+
+@pytest.mark.parametrize(
+    "stat_agg",
+    (py_path_stat_agg, path_stat_agg),
+    ids=("python", "native"),
+)
+def test_bench_path_stat_agg(benchmark, tree, stat_agg):
+    result = benchmark(stat_agg, tree)
+    assert result[1] > _FILE_COUNT
+
+
+@pytest.mark.parametrize("file_budget", (100, 1000, 10000))
+def test_bench_sampled_path_stat_agg(benchmark, tree, file_budget):
+    (_, inodes, _), exact = benchmark(sampled_path_stat_agg, tree, file_budget)
+    assert inodes > _FILE_COUNT
+    assert not exact
@@ -0,0 +1,112 @@
+import heapq
+import os
+import tracemalloc
+from unittest import mock
+
+import pytest
+from synthetic import SyntheticStore, synthetic_path_stat_agg
+
+from nix_heuristic_gc.graph import GarbageGraph
+from nix_heuristic_gc.quantity import QuantityUnit
+
+# set NHGC_BENCH_PATHS to e.g. 1000000 for a graph resembling a large store
+_PATH_COUNT = int(os.environ.get("NHGC_BENCH_PATHS", "100000"))
+
+
+@pytest.fixture(scope="module")
+def synthetic_store():
+    return SyntheticStore(_PATH_COUNT)
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", new=synthetic_path_stat_agg)
+@pytest.mark.parametrize("columnar", (False, True), ids=("objects", "columnar"))
+def test_bench_graph_build(benchmark, synthetic_store, columnar):
+    def build():
+        tracemalloc.start()
+        try:
+            garbage_graph = GarbageGraph(
+                synthetic_store,
+                QuantityUnit.BYTES,
+                path_info_mode="batch",
+                columnar=columnar,
+            )
+            retained, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        benchmark.extra_info["retained_bytes"] = retained
+        benchmark.extra_info["peak_bytes"] = peak
+        return garbage_graph
+
+    # tracing slows things down, but equally for both cases
+    garbage_graph = benchmark.pedantic(build, rounds=3)
+    assert garbage_graph.graph.num_nodes() == _PATH_COUNT
+
+
+@pytest.fixture(scope="module")
+def sized_synthetic_stores():
+    # keep only one around at a time as the largest are very large
+    stores = {}
+
+    def get(path_count):
+        if path_count not in stores:
+            stores.clear()
+            stores[path_count] = SyntheticStore(path_count)
+        return stores[path_count]
+
+    return get
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", new=synthetic_path_stat_agg)
+@pytest.mark.parametrize("path_count", (10_000, 100_000, 1_000_000))
+@pytest.mark.parametrize("topo_sort", (True, False), ids=("topo_sorted", "unsorted"))
+def test_bench_graph_build_topo_sort(benchmark, sized_synthetic_stores, path_count, topo_sort):
+    # note SyntheticStore's topo_sort_paths is only a cheap imitation of
+    # the real thing, so this understates the saving
+    synthetic_store = sized_synthetic_stores(path_count)
+
+    garbage_graph = benchmark.pedantic(
+        lambda: GarbageGraph(
+            synthetic_store,
+            QuantityUnit.BYTES,
+            path_info_mode="batch",
+            topo_sort=topo_sort,
+        ),
+        rounds=1,
+    )
+    assert garbage_graph.graph.num_nodes() == path_count
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", new=synthetic_path_stat_agg)
+@pytest.mark.parametrize("columnar", (False, True), ids=("objects", "columnar"))
+def test_bench_score_all(benchmark, synthetic_store, columnar):
+    garbage_graph = GarbageGraph(
+        synthetic_store,
+        QuantityUnit.BYTES,
+        path_info_mode="batch",
+        penalize_invalid=1e6,
+        penalize_drvs=1e5,
+        penalize_substitutable=1e5,
+        penalize_inodes=1e6,
+        penalize_size=1e-3,
+        columnar=columnar,
+    )
+    idxs = list(garbage_graph.graph.node_indices())
+    # ensure stats & substitutability are already known
+    garbage_graph._get_heap_tuples(idxs)
+
+    def score_all():
+        heap = garbage_graph._get_heap_tuples(idxs)
+        heapq.heapify(heap)
+        return heap
+
+    assert len(benchmark(score_all)) == len(idxs)
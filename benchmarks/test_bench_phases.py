@@ -0,0 +1,178 @@
+import heapq
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from unittest import mock
+
+import pytest
+from synthetic import SyntheticStore, synthetic_path_stat_agg
+
+from nix_heuristic_gc.graph import GarbageGraph
+from nix_heuristic_gc.metrics import Metrics
+from nix_heuristic_gc.quantity import QuantityUnit
+
+# each phase of GarbageGraph's work timed separately so that a
+# regression can be pinned on one. set NHGC_BENCH_PATHS as for
+# test_bench_graph, NHGC_BENCH_TREE_PATHS for the number of paths
+# materialized on disk for benchmarks doing real filesystem walks.
+_PATH_COUNT = int(os.environ.get("NHGC_BENCH_PATHS", "100000"))
+_TREE_PATH_COUNT = int(os.environ.get("NHGC_BENCH_TREE_PATHS", "2000"))
+
+
+@pytest.fixture(scope="module")
+def synthetic_store():
+    return SyntheticStore(_PATH_COUNT)
+
+
+@pytest.fixture(scope="module")
+def tree_store(tmp_path_factory):
+    synthetic_store = SyntheticStore(_TREE_PATH_COUNT)
+    root = str(tmp_path_factory.mktemp("store"))
+    file_count = synthetic_store.materialize(root)
+    return synthetic_store, root, file_count
+
+
+@pytest.fixture(scope="module")
+def process_pool():
+    with ProcessPoolExecutor(
+        max_workers=4,
+        mp_context=get_context("forkserver"),
+    ) as executor:
+        yield executor
+
+
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@pytest.mark.parametrize("use_process_pool", (False, True), ids=("serial", "process_pool"))
+def test_bench_stat_aggregation(benchmark, tree_store, process_pool, use_process_pool):
+    synthetic_store, root, file_count = tree_store
+
+    def setup():
+        # building the graph will walk the initial candidates, which
+        # aren't walked again
+        with mock.patch("nix_heuristic_gc.graph._nix_store_path", new=root):
+            garbage_graph = GarbageGraph(
+                synthetic_store,
+                QuantityUnit.BYTES,
+                path_info_mode="batch",
+            )
+        idxs = [
+            idx for idx in garbage_graph.graph.node_indices()
+            if garbage_graph.node(idx)._inodes is None
+        ]
+        return (garbage_graph, idxs), {}
+
+    def aggregate(garbage_graph, idxs):
+        with mock.patch("nix_heuristic_gc.graph._nix_store_path", new=root):
+            if use_process_pool:
+                garbage_graph._stat_executor = process_pool
+                garbage_graph._prefill_stat_aggs(idxs)
+            else:
+                for idx in idxs:
+                    garbage_graph.node(idx)._stat_agg()
+
+    benchmark.extra_info["file_count"] = file_count
+    benchmark.pedantic(aggregate, setup=setup, rounds=3)
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", new=synthetic_path_stat_agg)
+@pytest.mark.parametrize("columnar", (False, True), ids=("objects", "columnar"))
+def test_bench_construct_heap(benchmark, synthetic_store, columnar):
+    garbage_graph = GarbageGraph(
+        synthetic_store,
+        QuantityUnit.BYTES,
+        path_info_mode="batch",
+        penalize_invalid=1e6,
+        penalize_drvs=1e5,
+        penalize_inodes=1e6,
+        penalize_size=1e-3,
+        columnar=columnar,
+    )
+    pseudo_root_idxs = [
+        i for i in garbage_graph.graph.node_indices()
+        if garbage_graph.graph.in_degree(i) == 0
+    ]
+
+    def construct_heap():
+        heap = garbage_graph._get_heap_tuples(pseudo_root_idxs)
+        heapq.heapify(heap)
+        return heap
+
+    assert len(benchmark(construct_heap)) == len(pseudo_root_idxs)
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", new=synthetic_path_stat_agg)
+@pytest.mark.parametrize("inherit_max_atime", (False, True), ids=("own_atime", "inherit_atime"))
+@pytest.mark.parametrize("penalize_exceeding_limit", (None, 5e5), ids=("plain", "penalize_exceeding"))
+def test_bench_remove_to_limit(
+    benchmark,
+    synthetic_store,
+    penalize_exceeding_limit,
+    inherit_max_atime,
+):
+    # unlike test_bench_selection, paths reference each other, so most
+    # only become candidates as their referrers are removed
+    limit = sum(
+        path_info.nar_size for path_info in synthetic_store.path_infos.values()
+    ) // 2
+
+    def setup():
+        garbage_graph = GarbageGraph(
+            synthetic_store,
+            QuantityUnit.BYTES,
+            path_info_mode="batch",
+            penalize_size=1e-3,
+            penalize_exceeding_limit=penalize_exceeding_limit,
+            inherit_max_atime=inherit_max_atime,
+            columnar=True,
+        )
+        # walks aren't what's being measured here
+        for idx in garbage_graph.graph.node_indices():
+            garbage_graph.node(idx)._stat_agg()
+        return (garbage_graph,), {}
+
+    benchmark.pedantic(
+        lambda garbage_graph: garbage_graph.remove_to_limit(limit),
+        setup=setup,
+        rounds=3,
+    )
+
+
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+def test_bench_phase_breakdown(benchmark, tree_store):
+    # a whole run against a materialized store, reporting the time spent
+    # in each of its phases
+    synthetic_store, root, file_count = tree_store
+    limit = sum(
+        path_info.nar_size for path_info in synthetic_store.path_infos.values()
+    ) // 2
+
+    def run():
+        metrics = Metrics()
+        with mock.patch("nix_heuristic_gc.graph._nix_store_path", new=root):
+            garbage_graph = GarbageGraph(
+                synthetic_store,
+                QuantityUnit.BYTES,
+                path_info_mode="batch",
+                penalize_substitutable=1e5,
+                penalize_exceeding_limit=5e5,
+                metrics=metrics,
+            )
+            with metrics.phase("select"):
+                garbage_graph.remove_to_limit(limit)
+        return metrics
+
+    metrics = benchmark.pedantic(run, rounds=1)
+    d = metrics.as_dict()
+    benchmark.extra_info["file_count"] = file_count
+    for name, phase in d["phases"].items():
+        benchmark.extra_info[f"{name}_seconds"] = phase["wall_seconds"]
+    benchmark.extra_info.update(d["counters"])
+    assert d["counters"]["stat_walks"] > 0
@@ -0,0 +1,62 @@
+import os
+from unittest import mock
+
+import pytest
+from synthetic import SyntheticStore, synthetic_path_stat_agg
+
+from nix_heuristic_gc.graph import GarbageGraph
+from nix_heuristic_gc.quantity import QuantityUnit
+
+# set NHGC_BENCH_CANDIDATES lower for a quicker run
+_CANDIDATE_COUNT = int(os.environ.get("NHGC_BENCH_CANDIDATES", "1000000"))
+
+
+def _uniform_atime_path_stat_agg(path):
+    # e.g. a store on a noatime filesystem - scores only differ by their
+    # penalties so limit excess corrections are most disruptive
+    _, inodes, fs_size = synthetic_path_stat_agg(path)
+    return 1_600_000_000.0, inodes, fs_size
+
+
+@pytest.fixture(scope="module")
+def candidates_store():
+    # no references, so every path is a candidate from the outset
+    return SyntheticStore(_CANDIDATE_COUNT, mean_references=0)
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@pytest.mark.parametrize(
+    "path_stat_agg",
+    (synthetic_path_stat_agg, _uniform_atime_path_stat_agg),
+    ids=("random_atime", "uniform_atime"),
+)
+@pytest.mark.parametrize("limit_fraction", (1e-4, 0.01, 0.5))
+def test_bench_remove_to_limit_penalize_exceeding(
+    benchmark,
+    candidates_store,
+    path_stat_agg,
+    limit_fraction,
+):
+    total_size = sum(
+        path_info.nar_size for path_info in candidates_store.path_infos.values()
+    )
+
+    def setup():
+        with mock.patch("nix_heuristic_gc.graph.path_stat_agg", new=path_stat_agg):
+            garbage_graph = GarbageGraph(
+                candidates_store,
+                QuantityUnit.BYTES,
+                path_info_mode="batch",
+                penalize_size=1e-3,
+                penalize_exceeding_limit=5e5,
+                columnar=True,
+            )
+        return (garbage_graph, int(total_size * limit_fraction)), {}
+
+    benchmark.pedantic(
+        lambda garbage_graph, limit: garbage_graph.remove_to_limit(limit),
+        setup=setup,
+        rounds=1,
+    )
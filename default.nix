@@ -16,12 +16,14 @@
       pythonPackages.pybind11
       pythonPackages.setuptools
       pythonPackages.rustworkx
+      pythonPackages.numpy
       nixComponents.nix-store
       nixComponents.nix-main
       pkgs.boost
     ] ++ pkgs.lib.optionals forTest [
       pythonPackages.pytest
     ] ++ pkgs.lib.optionals forDev [
+      pythonPackages.pytest-benchmark
       pythonPackages.ipython
       pythonPackages.matplotlib
       pkgs.less
@@ -50,6 +52,7 @@
     propagatedBuildInputs = [
       pythonPackages.humanfriendly
       pythonPackages.rustworkx
+      pythonPackages.numpy
     ];
 
     checkInputs = [
@@ -1,14 +1,27 @@
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
 import logging
+from multiprocessing import get_context
 from os.path import join as path_join
+from time import time
 from typing import Literal, Optional
 
-from humanfriendly import format_size
+from humanfriendly import format_size, format_timespan
 
 import nix_heuristic_gc.libnixstore_wrapper as libstore
+from nix_heuristic_gc.cache import default_cache_dir, ensure_cache_dir
+from nix_heuristic_gc.daemon import watch_watermarks
+from nix_heuristic_gc.deletion import delete_chunked
 from nix_heuristic_gc.graph import GarbageGraph
+from nix_heuristic_gc.graph_snapshot import GraphSnapshot
+from nix_heuristic_gc.metrics import Metrics
 from nix_heuristic_gc.naive_executor import NaiveExecutor
-from nix_heuristic_gc.quantity import Quantity
+from nix_heuristic_gc.plan import plan_reclaim, write_plan
+from nix_heuristic_gc.prefetch import StatPrefetcher
+from nix_heuristic_gc.quantity import Quantity, QuantityUnit
+from nix_heuristic_gc.recency import AccessLogIndex
+from nix_heuristic_gc.stat_cache import StatCache
+from nix_heuristic_gc.substitutable_cache import SubstitutableCache
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +40,7 @@ def _unfriendly_weight(
 
 
 def nix_heuristic_gc(
-    limit:Quantity,
+    limit:Optional[Quantity]=None,
     penalize_invalid:int=5,
     penalize_substitutable:int=0,
     penalize_drvs:int=0,
@@ -39,8 +52,55 @@ def nix_heuristic_gc(
     collect_drvs:bool|Literal["only"]=True,
     inherit_atime:bool=False,
     threads:Optional[int]=None,
+    path_info_mode:Literal["serial", "async", "batch", "db"]="serial",
+    topo_sort:bool=True,
+    use_graph_snapshot:bool=False,
+    graph_snapshot_max_age:float=86400,
+    use_stat_cache:bool=False,
+    stat_cache_max_age:float=86400,
+    use_substitutable_cache:bool=False,
+    substitutable_cache_ttl:float=86400,
+    prefetch_substitutable:bool=False,
+    cache_dir:Optional[str]=None,
+    stat_workers:Optional[int]=None,
+    stat_prefetch_threads:int=0,
+    stat_file_budget:Optional[int]=None,
+    access_log:Optional[str]=None,
+    hardlink_aware:bool=False,
+    condense_cycles:bool=False,
+    columnar:bool=False,
+    defer_stats:bool=False,
+    removal_batch_size:int=1,
+    delete_chunk_size:Optional[int]=None,
+    daemon:bool=False,
+    low_watermark:Optional[Quantity]=None,
+    high_watermark:Optional[Quantity]=None,
+    check_interval:float=30,
+    refresh_interval:float=3600,
+    metrics_file:Optional[str]=None,
+    metrics_format:Optional[Literal["json", "prometheus"]]=None,
+    plan_limits:Optional[list[Quantity]]=None,
+    plan_output:str="-",
+    plan_format:Optional[Literal["json", "csv"]]=None,
     dry_run:bool=True,
 ):
+    if plan_limits:
+        if daemon or limit is not None:
+            raise ValueError("plan_limits can't be combined with limit or daemon mode")
+        if len({q.unit for q in plan_limits}) != 1:
+            raise ValueError("plan_limits must all be specified in the same units")
+        limit_unit = plan_limits[0].unit
+    elif daemon:
+        if low_watermark is None or high_watermark is None:
+            raise ValueError("daemon mode requires low_watermark and high_watermark")
+        if limit is not None:
+            raise ValueError("limit makes no sense in daemon mode")
+        limit_unit = high_watermark.unit
+    elif limit is None:
+        raise ValueError("limit must be specified unless in daemon mode")
+    else:
+        limit_unit = limit.unit
+
     store = libstore.Store()
 
     if (threads or 0) < 0:
@@ -50,52 +110,267 @@ def nix_heuristic_gc(
     else:
         executor = ThreadPoolExecutor(max_workers=threads)
 
-    garbage_graph = GarbageGraph(
-        store=store,
-        limit_unit=limit.unit,
-        executor=executor,
-        inherit_max_atime=inherit_atime,
-        penalize_substitutable=_unfriendly_weight(penalize_substitutable, 1e5),
-        penalize_drvs=_unfriendly_weight(penalize_drvs, 1e5),
-        penalize_inodes=_unfriendly_weight(penalize_inodes, 1e6),
-        penalize_size=_unfriendly_weight(penalize_size, 1e-3),
-        penalize_exceeding_limit=_unfriendly_weight(penalize_exceeding_limit, 5e5),
-        penalize_invalid=_unfriendly_weight(penalize_invalid, 1e6),
-        collect_invalid=collect_invalid,
-        collect_substitutable=collect_substitutable,
-        collect_drvs=collect_drvs,
-    )
-
-    if garbage_graph.very_invalid_paths:
-        logger.info(
-            "Unable to handle invalid paths %s - use standard nix tools to "
-            "remove these.",
-            garbage_graph.very_invalid_paths,
-        )
-
-    logger.info("selecting store paths for removal")
-    logger.debug("using limit of %s", limit)
-    to_reclaim = garbage_graph.remove_to_limit(limit.value)
-
-    logger.info(
-        "%(maybe_not)srequesting deletion of %(count)s store paths, total size %(size)s, %(inodes)s inodes",
-        {
-            "maybe_not": "(not) " if dry_run else "",
-            "count": len(to_reclaim),
-            "size": format_size(sum(spn.size for spn in to_reclaim), binary=True),
-            "inodes": sum(spn.inodes for spn in to_reclaim),
-        },
-    )
-
-    if dry_run:
-        nix_store_path = libstore.get_nix_store_path()
-        for spn in to_reclaim:
-            print(path_join(nix_store_path, spn.path))
-    else:
-        _, bytes_freed = store.collect_garbage(
-            action=libstore.GCAction.GCDeleteSpecific,
-            paths_to_delete={
-                libstore.StorePath(spn.path) for spn in to_reclaim
-            },
-        )
-        logger.info("freed %(size)s", {"size": format_size(bytes_freed, binary=True)})
+    if (stat_workers or 0) < 0:
+        raise ValueError("Negative values for stat_workers argument make no sense")
+
+    if stat_prefetch_threads < 0:
+        raise ValueError("Negative values for stat_prefetch_threads argument make no sense")
+
+    if removal_batch_size < 1:
+        raise ValueError("removal_batch_size must be at least 1")
+    if removal_batch_size > 1 and hardlink_aware:
+        raise ValueError("hardlink_aware can't be used with a removal_batch_size above 1")
+
+    if delete_chunk_size is not None and delete_chunk_size < 1:
+        raise ValueError("delete_chunk_size must be at least 1")
+
+    # shared between graphs so totals accumulate in daemon mode
+    metrics = Metrics()
+
+    with ExitStack() as exit_stack:
+        stat_executor = None
+        if stat_workers:
+            # forking a process that has initialized libnix isn't a great idea
+            stat_executor = exit_stack.enter_context(ProcessPoolExecutor(
+                max_workers=stat_workers,
+                mp_context=get_context("forkserver"),
+            ))
+
+        stat_prefetcher = None
+        if stat_prefetch_threads:
+            stat_prefetcher = exit_stack.enter_context(StatPrefetcher(
+                max_workers=stat_prefetch_threads,
+            ))
+
+        stat_cache = None
+        if use_stat_cache:
+            stat_cache = exit_stack.enter_context(StatCache(
+                path_join(
+                    ensure_cache_dir(cache_dir or default_cache_dir()),
+                    "stat-cache.sqlite",
+                ),
+                libstore.get_nix_store_path(),
+                max_age=stat_cache_max_age,
+            ))
+
+        substitutable_cache = None
+        if use_substitutable_cache:
+            substitutable_cache = exit_stack.enter_context(SubstitutableCache(
+                path_join(
+                    ensure_cache_dir(cache_dir or default_cache_dir()),
+                    "substitutable-cache.sqlite",
+                ),
+                context=store.get_uri(),
+                ttl=substitutable_cache_ttl,
+            ))
+
+        graph_snapshot = None
+        if use_graph_snapshot:
+            graph_snapshot = exit_stack.enter_context(GraphSnapshot(
+                path_join(
+                    ensure_cache_dir(cache_dir or default_cache_dir()),
+                    "graph-snapshot.sqlite",
+                ),
+                context=store.get_uri(),
+                max_age=graph_snapshot_max_age,
+            ))
+
+        access_log_index = None
+        if access_log is not None:
+            access_log_index = exit_stack.enter_context(AccessLogIndex(
+                path_join(
+                    ensure_cache_dir(cache_dir or default_cache_dir()),
+                    "access-log-index.sqlite",
+                ),
+                access_log,
+                libstore.get_nix_store_path(),
+            ))
+
+        def build_graph():
+            if access_log_index is not None:
+                access_log_index.update()
+
+            garbage_graph = GarbageGraph(
+                store=store,
+                limit_unit=limit_unit,
+                executor=executor,
+                inherit_max_atime=inherit_atime,
+                penalize_substitutable=_unfriendly_weight(penalize_substitutable, 1e5),
+                penalize_drvs=_unfriendly_weight(penalize_drvs, 1e5),
+                penalize_inodes=_unfriendly_weight(penalize_inodes, 1e6),
+                penalize_size=_unfriendly_weight(penalize_size, 1e-3),
+                penalize_exceeding_limit=_unfriendly_weight(penalize_exceeding_limit, 5e5),
+                penalize_invalid=_unfriendly_weight(penalize_invalid, 1e6),
+                collect_invalid=collect_invalid,
+                collect_substitutable=collect_substitutable,
+                collect_drvs=collect_drvs,
+                path_info_mode=path_info_mode,
+                topo_sort=topo_sort,
+                graph_snapshot=graph_snapshot,
+                stat_cache=stat_cache,
+                stat_executor=stat_executor,
+                stat_prefetcher=stat_prefetcher,
+                stat_file_budget=stat_file_budget,
+                recency_source=access_log_index,
+                hardlink_aware=hardlink_aware,
+                condense_cycles=condense_cycles,
+                substitutable_cache=substitutable_cache,
+                prefetch_substitutable=prefetch_substitutable,
+                columnar=columnar,
+                metrics=metrics,
+                defer_stats=defer_stats,
+            )
+
+            if stat_cache is not None:
+                stat_cache.prune(known_present=garbage_graph.path_index_mapping)
+
+            if garbage_graph.very_invalid_paths:
+                logger.info(
+                    "Unable to handle invalid paths %s - use standard nix tools to "
+                    "remove these.",
+                    garbage_graph.very_invalid_paths,
+                )
+
+            if daemon:
+                # a long-running process shouldn't wait until exit to
+                # save its caches
+                for cache in (stat_cache, substitutable_cache, graph_snapshot, access_log_index):
+                    if cache is not None:
+                        cache.save()
+
+            return garbage_graph
+
+        def reclaim(garbage_graph, limit):
+            try:
+                _reclaim(garbage_graph, limit)
+            finally:
+                if metrics_file is not None:
+                    metrics.write(metrics_file, metrics_format)
+
+        def _reclaim(garbage_graph, limit):
+            logger.info("selecting store paths for removal")
+            logger.debug("using limit of %s", limit)
+
+            if delete_chunk_size and not dry_run:
+                # delete paths as they are selected
+                def on_chunk_deleted(chunk):
+                    if stat_cache is not None:
+                        stat_cache.evict(spn.path for spn in chunk)
+
+                with metrics.phase("select_and_delete"):
+                    paths_deleted, bytes_freed = delete_chunked(
+                        store,
+                        garbage_graph.iter_remove_to_limit(
+                            limit.value,
+                            batch_size=removal_batch_size,
+                        ),
+                        delete_chunk_size,
+                        max_bytes_freed=limit.value if limit.unit == QuantityUnit.BYTES else None,
+                        on_chunk_deleted=on_chunk_deleted,
+                    )
+                metrics.count("paths_deleted", paths_deleted)
+                metrics.count("bytes_freed", bytes_freed)
+                logger.info(
+                    "deleted %(count)s store paths, freed %(size)s",
+                    {
+                        "count": paths_deleted,
+                        "size": format_size(bytes_freed, binary=True),
+                    },
+                )
+                return
+
+            with metrics.phase("select"):
+                to_reclaim = garbage_graph.remove_to_limit(
+                    limit.value,
+                    batch_size=removal_batch_size,
+                )
+
+            summary = {
+                "maybe_not": "(not) " if dry_run else "",
+                "count": len(to_reclaim),
+                # with hardlink_aware, what will actually be freed
+                "size": format_size(sum(spn.freed_size for spn in to_reclaim), binary=True),
+            }
+            # paths may not have been walked, e.g. when using a recency
+            # source, and it isn't worth walking them just to report this
+            if all(spn._inodes is not None for spn in to_reclaim):
+                logger.info(
+                    "%(maybe_not)srequesting deletion of %(count)s store paths, total size %(size)s, %(inodes)s inodes",
+                    {**summary, "inodes": sum(spn.freed_inodes for spn in to_reclaim)},
+                )
+            else:
+                logger.info(
+                    "%(maybe_not)srequesting deletion of %(count)s store paths, total size %(size)s",
+                    summary,
+                )
+
+            if dry_run:
+                nix_store_path = libstore.get_nix_store_path()
+                for spn in to_reclaim:
+                    print(path_join(nix_store_path, spn.path))
+            else:
+                with metrics.phase("delete"):
+                    _, bytes_freed = store.collect_garbage(
+                        action=libstore.GCAction.GCDeleteSpecific,
+                        paths_to_delete={
+                            libstore.StorePath(spn.path) for spn in to_reclaim
+                        },
+                    )
+                metrics.count("paths_deleted", len(to_reclaim))
+                metrics.count("bytes_freed", bytes_freed)
+                logger.info("freed %(size)s", {"size": format_size(bytes_freed, binary=True)})
+
+                if stat_cache is not None:
+                    stat_cache.evict(spn.path for spn in to_reclaim)
+
+        if plan_limits:
+            garbage_graph = build_graph()
+            with metrics.phase("plan"):
+                plan = plan_reclaim(
+                    garbage_graph,
+                    [q.value for q in plan_limits],
+                    batch_size=removal_batch_size,
+                )
+            del garbage_graph
+
+            def format_limit(value):
+                if limit_unit == QuantityUnit.BYTES:
+                    return format_size(value, binary=True)
+                return f"{value} inodes"
+
+            now = time()
+            for limit_value in plan.limits:
+                point = plan.thresholds.get(limit_value)
+                if point is None:
+                    logger.info(
+                        "limit %(limit)s not reachable",
+                        {"limit": format_limit(limit_value)},
+                    )
+                    continue
+                logger.info(
+                    "limit %(limit)s: %(count)s store paths, total size %(size)s, "
+                    "%(inodes)s inodes, none accessed in the last %(age)s",
+                    {
+                        "limit": format_limit(limit_value),
+                        "count": point.paths,
+                        "size": format_size(point.bytes, binary=True),
+                        "inodes": point.inodes,
+                        "age": format_timespan(max(0, now - point.atime_boundary)),
+                    },
+                )
+
+            write_plan(plan, plan_output, plan_format)
+            if metrics_file is not None:
+                metrics.write(metrics_file, metrics_format)
+        elif daemon:
+            watch_watermarks(
+                build_graph,
+                reclaim,
+                libstore.get_nix_store_path(),
+                low_watermark,
+                high_watermark,
+                check_interval=check_interval,
+                refresh_interval=refresh_interval,
+            )
+        else:
+            reclaim(build_graph(), limit)
@@ -113,7 +113,8 @@ def main():
             "binary cache",
             "--penalize-substitutable",
             "Disabled by default, this can slow down the path selection process for "
-            "large collections due to the mass querying of binary cache(s)",
+            "large collections due to the mass querying of binary cache(s) - "
+            "see --substitutable-cache and --prefetch-substitutable",
         ),
         "substitutable paths",
     )
@@ -184,6 +185,281 @@ def main():
         "also limited by store settings' max-connections value - for best "
         "results increase that to a sensible value (perhaps via NIX_REMOTE?).",
     )
+    parser.add_argument(
+        "--stat-workers",
+        type=int,
+        metavar="N",
+        help="Number of worker processes to distribute the initial gathering of "
+        "filesystem stats for candidate paths between. By default this is done "
+        "by --threads threads.",
+    )
+    parser.add_argument(
+        "--stat-prefetch-threads",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Number of background threads to use for speculatively gathering "
+        "filesystem stats of paths likely to become candidates for deletion "
+        "soon, so that path selection spends less time waiting on the "
+        "filesystem. 0 disables prefetching. Default %(default)s.",
+    )
+    parser.add_argument(
+        "--stat-file-budget",
+        type=int,
+        metavar="N",
+        help="Examine at most N files of each path when gathering filesystem "
+        "stats, estimating the atime of paths containing more files from a "
+        "sample spread across their directories. Much quicker for very large "
+        "paths, but may choose a path despite one of its unsampled files "
+        "having been used recently. Can't be used with --stat-cache. By "
+        "default every file is examined.",
+    )
+    parser.add_argument(
+        "--access-log",
+        metavar="PATH",
+        help="Judge how recently valid paths were used from the access log "
+        "at PATH rather than from their files' atimes, so they need not be "
+        "walked unless their inode counts are needed. The log consists of "
+        "lines '<unix timestamp> <path>', where path is a store path or any "
+        "file within one, and is aggregated into an index in --cache-dir. A "
+        "path's registration also counts as a use.",
+    )
+    parser.add_argument(
+        "--hardlink-aware",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Account for files shared between paths through hard links (as "
+        "created by nix-store --optimise) when measuring how much deleting "
+        "paths would free, so the limit reflects the space actually "
+        "reclaimed. Every path considered for deletion has to be walked. "
+        "Can't be used with --stat-cache, --stat-file-budget or a "
+        "--removal-batch-size above 1. Disabled by default.",
+    )
+    parser.add_argument(
+        "--condense-cycles",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Treat each set of paths referencing each other in a loop (as "
+        "created by keep-derivations and keep-outputs both being enabled) as "
+        "a single unit with the combined size and inode count and the most "
+        "recent atime of its members, so that such paths can be selected and "
+        "deleted together instead of being left for regular nix gc commands. "
+        "Disabled by default.",
+    )
+    parser.add_argument(
+        "--path-info-mode",
+        choices=("serial", "async", "batch", "db"),
+        default="serial",
+        help="How to query store path information while building the graph. "
+        "'async' keeps a window of requests in flight at once, which can be "
+        "much faster when talking to a nix daemon, as long as the store "
+        "settings' max-connections value is raised to allow it. 'batch' queries paths in large batches "
+        "without any per-path python overhead, distributing batches between "
+        "--threads threads. 'db' reads all path information directly from a "
+        "local store's database in a handful of queries, falling back to "
+        "'batch' for other store types. Default %(default)s.",
+    )
+    parser.add_argument(
+        "--topo-sort",
+        default=True,
+        action=argparse.BooleanOptionalAction,
+        help="Topologically sort paths before querying their information. This "
+        "isn't needed to build the graph correctly, but determines how ties "
+        "between equally-scored paths are broken. Disabling it allows graph "
+        "building to start much sooner for large collections. Enabled by "
+        "default.",
+    )
+    parser.add_argument(
+        "--stat-cache",
+        dest="use_stat_cache",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Keep a persistent cache of each store path's inode count and size "
+        "(which never change), so that paths only need walking in full once "
+        "every --stat-cache-max-age seconds. In between, atimes are refreshed "
+        "by only examining the files that were most recently accessed when the "
+        "path was last walked.",
+    )
+    parser.add_argument(
+        "--stat-cache-max-age",
+        type=float,
+        default=86400,
+        metavar="SECONDS",
+        help="Maximum age of a stat cache entry before its path is walked in "
+        "full again. Default %(default)s.",
+    )
+    parser.add_argument(
+        "--graph-snapshot",
+        dest="use_graph_snapshot",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Keep a persistent snapshot of the information of dead store "
+        "paths, so that subsequent runs only need to query paths that have "
+        "become garbage since. Combine with --stat-cache to also avoid "
+        "re-walking unchanged paths. Not used with --path-info-mode db.",
+    )
+    parser.add_argument(
+        "--graph-snapshot-max-age",
+        type=float,
+        default=86400,
+        metavar="SECONDS",
+        help="Maximum age of a graph snapshot entry before its path is queried "
+        "again. Default %(default)s.",
+    )
+    parser.add_argument(
+        "--substitutable-cache",
+        dest="use_substitutable_cache",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Keep a persistent cache of whether store paths are substitutable "
+        "from a binary cache, so that they only need querying once every "
+        "--substitutable-cache-ttl seconds.",
+    )
+    parser.add_argument(
+        "--substitutable-cache-ttl",
+        type=float,
+        default=86400,
+        metavar="SECONDS",
+        help="Maximum age of a substitutable cache entry before its path is "
+        "queried again. Default %(default)s.",
+    )
+    parser.add_argument(
+        "--prefetch-substitutable",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="When substitutability is needed, query it for every path up "
+        "front in concurrent batches (distributed between --threads threads) "
+        "rather than for each path as it becomes a candidate for deletion. "
+        "Most useful for large deletions.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="Directory to keep persistent caches in. Default "
+        "$XDG_CACHE_HOME/nix-heuristic-gc.",
+    )
+    parser.add_argument(
+        "--columnar",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Store per-path information in compact arrays rather than as "
+        "individual python objects, greatly reducing memory usage and graph "
+        "building time for very large collections.",
+    )
+    parser.add_argument(
+        "--defer-stats",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Rather than walking every path eligible for deletion to find "
+        "its atime, estimate a lower bound of its score from the atime it "
+        "inherits from its referrers and its nar size, and only walk it when "
+        "it looks like the best remaining choice. Paths with nothing to "
+        "inherit are still always walked. Only useful with "
+        "--inherit-atime.",
+    )
+    parser.add_argument(
+        "--removal-batch-size",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Remove up to N selected paths from consideration at a time, "
+        "which can be much faster when selecting very many small paths. Only "
+        "the first path of each batch is guaranteed to be the best choice - "
+        "the rest are the next-best paths still fitting within the limit, "
+        "which aren't compared against paths that the batch's removal makes "
+        "eligible. Default %(default)s.",
+    )
+    parser.add_argument(
+        "--delete-chunk-size",
+        type=int,
+        metavar="N",
+        help="Request deletion of selected paths in chunks of N paths while "
+        "selection continues, rather than all at once after selection has "
+        "finished. This frees space sooner, reports progress as it goes and "
+        "stops early if the space actually freed reaches a limit specified in "
+        "bytes. By default paths are deleted in a single request.",
+    )
+    parser.add_argument(
+        "--daemon",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Rather than collecting a fixed amount of garbage, keep running, "
+        "watching the free space (or inodes) of the store's filesystem and "
+        "collecting garbage whenever it falls below --low-watermark until it "
+        "reaches --high-watermark. The graph of garbage paths is kept ready "
+        "and refreshed in the background. limit must not be specified.",
+    )
+    parser.add_argument(
+        "--low-watermark",
+        type=parse_quantity,
+        metavar="QUANTITY",
+        help="In --daemon mode, amount of free space below which to start "
+        "collecting garbage, specified in the same way as limit.",
+    )
+    parser.add_argument(
+        "--high-watermark",
+        type=parse_quantity,
+        metavar="QUANTITY",
+        help="In --daemon mode, amount of free space to aim for when "
+        "collecting garbage, specified in the same units as --low-watermark.",
+    )
+    parser.add_argument(
+        "--check-interval",
+        type=float,
+        default=30,
+        metavar="SECONDS",
+        help="In --daemon mode, how often to check free space. Default "
+        "%(default)s.",
+    )
+    parser.add_argument(
+        "--refresh-interval",
+        type=float,
+        default=3600,
+        metavar="SECONDS",
+        help="In --daemon mode, how often to rebuild the graph of garbage "
+        "paths in the background, which is also done after each collection. "
+        "Default %(default)s.",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar="PATH",
+        help="Write the time spent in each phase of the run, counts of "
+        "expensive operations and peak memory usage to PATH after each "
+        "collection. Suitable for node-exporter's textfile collector if "
+        "written in prometheus format.",
+    )
+    parser.add_argument(
+        "--metrics-format",
+        choices=("json", "prometheus"),
+        help="Format of --metrics-file. By default prometheus if PATH ends "
+        "in '.prom', otherwise json.",
+    )
+    parser.add_argument(
+        "--plan",
+        dest="plan_limits",
+        type=parse_quantity,
+        action="append",
+        metavar="QUANTITY",
+        help="Rather than collecting garbage, report how much would be "
+        "collected at each of the limits given by repeating this option, "
+        "specified in the same way as limit. The graph of garbage paths is "
+        "only built once and the whole curve of paths selected up to the "
+        "largest limit is written to --plan-output. limit must not be "
+        "specified.",
+    )
+    parser.add_argument(
+        "--plan-output",
+        default="-",
+        metavar="PATH",
+        help="Where to write the curve of paths selected by --plan. Default "
+        "stdout.",
+    )
+    parser.add_argument(
+        "--plan-format",
+        choices=("json", "csv"),
+        help="Format of --plan-output. By default csv if PATH ends in '.csv', "
+        "otherwise json.",
+    )
     parser.add_argument(
         "--version",
         action="version",
@@ -196,6 +472,7 @@ def main():
 
     parser.add_argument(
         "limit",
+        nargs="?",
         help="Amount of garbage to collect, specified either in units of bytes "
         "(with optional multiplier prefix) or in units of 'I' (uppercase) - the "
         "number of inodes to be freed. Numbers with no units are assumed to be "
@@ -205,7 +482,31 @@ def main():
 
     parsed = vars(parser.parse_args())
 
-    parsed["limit"] = parse_quantity(parsed["limit"])
+    if parsed["plan_limits"]:
+        if parsed["limit"] is not None or parsed["daemon"]:
+            parser.error("limit and --daemon cannot be specified with --plan")
+    elif parsed["daemon"]:
+        if parsed["limit"] is not None:
+            parser.error("limit cannot be specified with --daemon")
+        if parsed["low_watermark"] is None or parsed["high_watermark"] is None:
+            parser.error("--daemon requires --low-watermark and --high-watermark")
+    elif parsed["limit"] is None:
+        parser.error("limit is required unless using --daemon")
+    else:
+        parsed["limit"] = parse_quantity(parsed["limit"])
+
+    if parsed["stat_file_budget"] is not None:
+        if parsed["stat_file_budget"] < 1:
+            parser.error("--stat-file-budget must be at least 1")
+        if parsed["use_stat_cache"]:
+            parser.error("--stat-file-budget can't be used with --stat-cache")
+
+    if parsed["hardlink_aware"] and (
+        parsed["use_stat_cache"] or parsed["stat_file_budget"] is not None
+    ):
+        parser.error("--hardlink-aware can't be used with --stat-cache or --stat-file-budget")
+    if parsed["hardlink_aware"] and parsed["removal_batch_size"] > 1:
+        parser.error("--hardlink-aware can't be used with a --removal-batch-size above 1")
 
     loglevel = parsed.pop("loglevel", None)
     if loglevel is None:
@@ -0,0 +1,15 @@
+from os import environ, makedirs
+from os.path import expanduser
+from os.path import join as path_join
+
+
+def default_cache_dir() -> str:
+    return path_join(
+        environ.get("XDG_CACHE_HOME") or expanduser("~/.cache"),
+        "nix-heuristic-gc",
+    )
+
+
+def ensure_cache_dir(cache_dir:str) -> str:
+    makedirs(cache_dir, mode=0o700, exist_ok=True)
+    return cache_dir
@@ -0,0 +1,149 @@
+import math
+from typing import Optional
+
+import numpy as np
+
+
+class NodeColumns:
+    # per-node values are held in parallel typed arrays indexed by row,
+    # None being represented by -1 for integer columns and nan for float
+    # columns
+
+    # validity is implied by nar_size being present so needs no flag
+    FLAG_DRV = 1
+    FLAG_SUBSTITUTABLE_KNOWN = 2
+    FLAG_SUBSTITUTABLE = 4
+    FLAG_ATIME_SAMPLED = 8
+
+    _INT_COLUMNS = ("nar_size", "registration_time", "inodes", "fs_size")
+    _FLOAT_COLUMNS = ("max_atime", "inherited_max_atime")
+
+    def __init__(self, capacity:int=1024):
+        capacity = max(capacity, 1)
+        self.num_rows = 0
+        self.paths = []
+        for name in self._INT_COLUMNS:
+            setattr(self, name, np.full(capacity, -1, dtype=np.int64))
+        for name in self._FLOAT_COLUMNS:
+            setattr(self, name, np.full(capacity, np.nan, dtype=np.float64))
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+
+    def reserve(self, capacity:int):
+        extra = capacity - len(self.flags)
+        if extra <= 0:
+            return
+
+        for name in self._INT_COLUMNS:
+            setattr(self, name, np.concatenate((
+                getattr(self, name),
+                np.full(extra, -1, dtype=np.int64),
+            )))
+        for name in self._FLOAT_COLUMNS:
+            setattr(self, name, np.concatenate((
+                getattr(self, name),
+                np.full(extra, np.nan, dtype=np.float64),
+            )))
+        self.flags = np.concatenate((self.flags, np.zeros(extra, dtype=np.uint8)))
+
+    def append(
+        self,
+        path:str,
+        nar_size:Optional[int],
+        registration_time:Optional[int],
+    ) -> int:
+        row = self.num_rows
+        if row == len(self.flags):
+            self.reserve(2 * row)
+
+        self.paths.append(path)
+        if nar_size is not None:
+            self.nar_size[row] = nar_size
+        if registration_time is not None:
+            self.registration_time[row] = registration_time
+        if path.endswith(".drv"):
+            self.flags[row] = self.FLAG_DRV
+        self.num_rows += 1
+        return row
+
+
+def _int_column_property(name:str):
+    def fget(self):
+        value = getattr(self._columns, name)[self._row]
+        return None if value < 0 else int(value)
+
+    def fset(self, value):
+        getattr(self._columns, name)[self._row] = -1 if value is None else value
+
+    return property(fget, fset)
+
+
+def _float_column_property(name:str):
+    def fget(self):
+        value = getattr(self._columns, name)[self._row]
+        return None if math.isnan(value) else float(value)
+
+    def fset(self, value):
+        getattr(self._columns, name)[self._row] = math.nan if value is None else value
+
+    return property(fget, fset)
+
+
+def make_node_view_class(columns:NodeColumns) -> type:
+    # returns a class presenting the same attributes as
+    # GarbageGraph.BaseStorePathNode, but which is only a thin view
+    # of a row of columns, holding no per-node state of its own
+    # beyond its row number. views are cheap to create and can be
+    # discarded freely.
+
+    class ColumnarStorePathNode:
+        __slots__ = ("_row",)
+
+        _columns = columns
+
+        def __init__(self, row:int):
+            self._row = row
+
+        def __repr__(self):
+            return f"{type(self).__name__}(path={self.path!r}, nar_size={self.nar_size!r})"
+
+        @property
+        def path(self):
+            return columns.paths[self._row]
+
+        nar_size = _int_column_property("nar_size")
+        registration_time = _int_column_property("registration_time")
+        _inodes = _int_column_property("inodes")
+        _fs_size = _int_column_property("fs_size")
+        _max_atime = _float_column_property("max_atime")
+        _inherited_max_atime = _float_column_property("inherited_max_atime")
+
+        @property
+        def _substitutable(self):
+            flags = columns.flags[self._row]
+            if not flags & NodeColumns.FLAG_SUBSTITUTABLE_KNOWN:
+                return None
+            return bool(flags & NodeColumns.FLAG_SUBSTITUTABLE)
+
+        @_substitutable.setter
+        def _substitutable(self, value):
+            flags = columns.flags[self._row] & (
+                NodeColumns.FLAG_DRV | NodeColumns.FLAG_ATIME_SAMPLED
+            )
+            if value is not None:
+                flags |= NodeColumns.FLAG_SUBSTITUTABLE_KNOWN
+                if value:
+                    flags |= NodeColumns.FLAG_SUBSTITUTABLE
+            columns.flags[self._row] = flags
+
+        @property
+        def _atime_sampled(self):
+            return bool(columns.flags[self._row] & NodeColumns.FLAG_ATIME_SAMPLED)
+
+        @_atime_sampled.setter
+        def _atime_sampled(self, value):
+            if value:
+                columns.flags[self._row] |= NodeColumns.FLAG_ATIME_SAMPLED
+            else:
+                columns.flags[self._row] &= ~NodeColumns.FLAG_ATIME_SAMPLED & 0xff
+
+    return ColumnarStorePathNode
@@ -0,0 +1,122 @@
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Event
+from time import monotonic
+from typing import Callable, Optional
+
+from humanfriendly import format_size
+
+from nix_heuristic_gc.graph import GarbageGraph
+from nix_heuristic_gc.quantity import Quantity, QuantityUnit
+
+logger = logging.getLogger(__name__)
+
+
+def free_quantity(path:str, unit:QuantityUnit) -> int:
+    # amount of unit available to unprivileged users on the filesystem
+    # containing path
+    st = os.statvfs(path)
+    if unit == QuantityUnit.BYTES:
+        return st.f_bavail * st.f_frsize
+    elif unit == QuantityUnit.INODES:
+        return st.f_favail
+    else:
+        raise ValueError(f"Don't know how to measure {unit!r}")
+
+
+def _format_quantity(value:int, unit:QuantityUnit) -> str:
+    if unit == QuantityUnit.BYTES:
+        return format_size(value, binary=True)
+    return f"{value} inodes"
+
+
+def watch_watermarks(
+    build_graph:Callable[[], GarbageGraph],
+    reclaim:Callable[[GarbageGraph, Quantity], None],
+    store_dir:str,
+    low_watermark:Quantity,
+    high_watermark:Quantity,
+    check_interval:float=30,
+    refresh_interval:float=3600,
+    stop_event:Optional[Event]=None,
+):
+    # keeps a warm GarbageGraph from build_graph, checking the free space
+    # (or inodes) of store_dir's filesystem every check_interval seconds.
+    # when it drops below low_watermark, reclaim is immediately asked to
+    # collect enough to get back up to high_watermark.
+    #
+    # the graph is rebuilt in a background thread every refresh_interval
+    # seconds and after each collection, the existing graph being used in
+    # the meantime. an out of date graph may fail to choose paths that
+    # have died since it was built, but nix will refuse to delete any
+    # that have come back to life. runs until stop_event is set.
+    if low_watermark.unit != high_watermark.unit:
+        raise ValueError("Watermarks must be specified in the same units")
+    if low_watermark.value > high_watermark.value:
+        raise ValueError("Low watermark must not be above high watermark")
+
+    unit = high_watermark.unit
+    stop_event = stop_event or Event()
+
+    logger.info("building initial graph")
+    garbage_graph = build_graph()
+    built_at = monotonic()
+    refresh_future:Optional[Future] = None
+    # set once garbage_graph has been collected from, as it may not have
+    # anything useful left in it
+    collected_from = False
+    # set if a collection happened while a refresh was in progress, which
+    # may then include deleted paths
+    refresh_outdated = False
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="refresh") as refresh_executor:
+        while not stop_event.is_set():
+            if refresh_future is not None and refresh_future.done():
+                try:
+                    refreshed_graph = refresh_future.result()
+                except Exception:
+                    logger.exception("failed to refresh graph, keeping previous one")
+                else:
+                    if refresh_outdated:
+                        logger.debug("discarding outdated graph refresh")
+                    else:
+                        garbage_graph = refreshed_graph
+                        collected_from = False
+                        logger.info("refreshed graph")
+                    del refreshed_graph
+                refresh_future = None
+                refresh_outdated = False
+
+            free = free_quantity(store_dir, unit)
+            if free < low_watermark.value and collected_from:
+                logger.debug("free space still below low watermark, awaiting graph refresh")
+            elif free < low_watermark.value:
+                logger.info(
+                    "free %(free)s below low watermark %(low)s, collecting %(amount)s",
+                    {
+                        "free": _format_quantity(free, unit),
+                        "low": _format_quantity(low_watermark.value, unit),
+                        "amount": _format_quantity(high_watermark.value - free, unit),
+                    },
+                )
+                try:
+                    reclaim(garbage_graph, Quantity(high_watermark.value - free, unit))
+                except Exception:
+                    logger.exception("failed to reclaim space, will retry with a refreshed graph")
+                # even a failed collection may have removed paths from the
+                # graph or deleted them from the store
+                collected_from = True
+                refresh_outdated = refresh_future is not None
+
+            if refresh_future is None and (
+                collected_from or monotonic() - built_at >= refresh_interval
+            ):
+                logger.debug("refreshing graph in background")
+                refresh_future = refresh_executor.submit(build_graph)
+                built_at = monotonic()
+
+            stop_event.wait(check_interval)
+
+        if refresh_future is not None:
+            refresh_future.cancel()
@@ -0,0 +1,86 @@
+import sqlite3
+from os.path import join as path_join
+from typing import Iterable, Optional
+from urllib.parse import quote
+
+import nix_heuristic_gc.libnixstore_wrapper as libstore
+from nix_heuristic_gc.path_info import PathInfoTuple
+
+
+def local_store_db_path(store:libstore.Store) -> Optional[str]:
+    # daemon & remote stores have to be asked via libstore - even if we
+    # were able to read their database it may not be the one in use
+    if store.get_uri().partition("?")[0] != "local":
+        return None
+
+    state_dir = store.get_setting("state")
+    if not state_dir:
+        return None
+
+    return path_join(state_dir, "db", "db.sqlite")
+
+
+def query_path_infos_db(
+    db_path:str,
+    store_dir:str,
+    store_paths:Iterable[libstore.StorePath],
+) -> tuple[list[PathInfoTuple], dict[str, tuple[str, ...]]]:
+    store_dir = store_dir.rstrip("/") + "/"
+    str_paths = [str(store_path) for store_path in store_paths]
+
+    conn = sqlite3.connect(f"file:{quote(db_path)}?mode=ro", uri=True)
+    try:
+        conn.execute("CREATE TEMP TABLE DeadPaths (path TEXT NOT NULL)")
+        # DeadPaths rowids will be 1-based indexes into str_paths
+        conn.executemany(
+            "INSERT INTO temp.DeadPaths (path) VALUES (?)",
+            ((store_dir + p,) for p in str_paths),
+        )
+        conn.execute(
+            "CREATE TEMP TABLE DeadValidPaths AS "
+            "SELECT d.rowid AS idx, v.id AS id, v.narSize AS narSize, "
+            "v.registrationTime AS registrationTime "
+            "FROM temp.DeadPaths d JOIN ValidPaths v ON v.path = d.path"
+        )
+
+        nar_sizes = [None] * len(str_paths)
+        registration_times = [None] * len(str_paths)
+        id_idx_mapping = {}
+        for idx, id_, nar_size, registration_time in conn.execute(
+            "SELECT idx, id, narSize, registrationTime FROM temp.DeadValidPaths",
+        ):
+            nar_sizes[idx-1] = nar_size or 0
+            registration_times[idx-1] = registration_time
+            id_idx_mapping[id_] = idx - 1
+
+        references = [[] for _ in str_paths]
+        for referrer, ref_path in conn.execute(
+            "SELECT r.referrer, v.path FROM Refs r "
+            "JOIN temp.DeadValidPaths d ON d.id = r.referrer "
+            "JOIN ValidPaths v ON v.id = r.reference",
+        ):
+            references[id_idx_mapping[referrer]].append(ref_path[len(store_dir):])
+
+        derivation_outputs = {}
+        for drv, output_path in conn.execute(
+            "SELECT o.drv, o.path FROM DerivationOutputs o "
+            "JOIN temp.DeadValidPaths d ON d.id = o.drv",
+        ):
+            derivation_outputs.setdefault(
+                str_paths[id_idx_mapping[drv]],
+                [],
+            ).append(output_path[len(store_dir):])
+    finally:
+        conn.close()
+
+    return [
+        (
+            str_path,
+            nar_sizes[i],
+            registration_times[i],
+            # match libstore's StorePathSet ordering
+            tuple(sorted(references[i])),
+        ) for i, str_path in enumerate(str_paths)
+    ], {
+        drv: tuple(sorted(outputs)) for drv, outputs in derivation_outputs.items()
+    }
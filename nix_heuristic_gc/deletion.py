@@ -0,0 +1,101 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from itertools import islice
+from typing import Callable, Iterable, Optional
+
+from humanfriendly import format_size
+
+import nix_heuristic_gc.libnixstore_wrapper as libstore
+
+logger = logging.getLogger(__name__)
+
+
+def _delete_chunk(store:libstore.Store, chunk:list) -> int:
+    _, bytes_freed = store.collect_garbage(
+        action=libstore.GCAction.GCDeleteSpecific,
+        paths_to_delete={libstore.StorePath(spn.path) for spn in chunk},
+    )
+    return bytes_freed
+
+
+def delete_chunked(
+    store:libstore.Store,
+    selection:Iterable,
+    chunk_size:int,
+    max_bytes_freed:Optional[int]=None,
+    on_chunk_deleted:Optional[Callable[[list], None]]=None,
+) -> tuple[int, int]:
+    # requests deletion of the store path nodes produced by selection in
+    # chunks of chunk_size, each chunk being deleted in a background
+    # thread while the next is being selected. selection must produce
+    # paths in an order that is safe to delete them in, i.e. referrers
+    # before their references.
+    #
+    # stops consuming selection early once max_bytes_freed bytes have
+    # actually been freed. returns the number of paths deleted and bytes
+    # freed.
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+
+    selection = iter(selection)
+    paths_deleted = 0
+    total_bytes_freed = 0
+    chunk_count = 0
+
+    def finish(chunk, future):
+        nonlocal paths_deleted, total_bytes_freed, chunk_count
+        bytes_freed = future.result()
+        paths_deleted += len(chunk)
+        total_bytes_freed += bytes_freed
+        chunk_count += 1
+        logger.info(
+            "deleted chunk %(chunk)s of %(count)s store paths, freed "
+            "%(size)s, %(total_size)s in total",
+            {
+                "chunk": chunk_count,
+                "count": len(chunk),
+                "size": format_size(bytes_freed, binary=True),
+                "total_size": format_size(total_bytes_freed, binary=True),
+            },
+        )
+        if on_chunk_deleted is not None:
+            on_chunk_deleted(chunk)
+
+    # a single deletion in flight at once is enough to overlap selection
+    # and deletion, and keeps deletions strictly ordered
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="delete")
+    in_flight = None
+    try:
+        while True:
+            chunk = list(islice(selection, chunk_size))
+
+            if in_flight is not None:
+                finish(*in_flight)
+                in_flight = None
+                if max_bytes_freed is not None and total_bytes_freed >= max_bytes_freed:
+                    logger.info("freed enough space, stopping early")
+                    break
+
+            if not chunk:
+                break
+
+            in_flight = chunk, executor.submit(_delete_chunk, store, chunk)
+    except BaseException:
+        if in_flight is not None:
+            # a deletion that has been started can't be abandoned, but we
+            # can at least account for it
+            with suppress(Exception):
+                finish(*in_flight)
+        logger.warning(
+            "interrupted after deleting %(count)s store paths, freeing %(size)s",
+            {
+                "count": paths_deleted,
+                "size": format_size(total_bytes_freed, binary=True),
+            },
+        )
+        raise
+    finally:
+        executor.shutdown(wait=True)
+
+    return paths_deleted, total_bytes_freed
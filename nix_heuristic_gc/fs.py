@@ -1,7 +1,10 @@
 from functools import reduce
 from os import scandir, stat, DirEntry
+from os.path import join as path_join
 from stat import S_ISDIR
 
+import nix_heuristic_gc.libnixstore_wrapper as libstore
+
 
 AggStatTuple = tuple[int,int,int]
 
@@ -37,7 +40,7 @@ def dir_stat_agg(path:str) -> AggStatTuple:
         return 0, 1, 0
 
 
-def path_stat_agg(path:str) -> AggStatTuple:
+def py_path_stat_agg(path:str) -> AggStatTuple:
     try:
         s = stat(path, follow_symlinks=False)
     except PermissionError:
@@ -47,3 +50,102 @@ def path_stat_agg(path:str) -> AggStatTuple:
         return dir_stat_agg(path)
 
     return s.st_atime, 1, s.st_size
+
+
+# a native equivalent of py_path_stat_agg which is able to release the GIL for
+# the duration of the walk
+path_stat_agg = libstore.path_stat_agg
+
+
+# like path_stat_agg, but additionally returns the relative paths of (up
+# to) the hot_count most recently accessed files, which can later be
+# re-examined to cheaply refresh the max atime
+path_stat_agg_hot_files = libstore.path_stat_agg_hot_files
+
+
+# like path_stat_agg, but stat-ing at most file_budget files, which for
+# paths containing very many files is most of the cost of a walk.
+# directories are still all listed, so the inode count is exact, but for
+# larger paths max_atime is only that of a sample spread as evenly as
+# possible across directories and size is extrapolated from the sample.
+# returns the stats and whether they are exact.
+sampled_path_stat_agg = libstore.sampled_path_stat_agg
+
+
+# (st_dev, st_ino, st_nlink, st_size) of a file with more than one link
+SharedFileTuple = tuple[int, int, int, int]
+
+
+# like path_stat_agg, but additionally returns the files which have other
+# hard links, e.g. as a result of nix-store --optimise, so the space
+# actually freed by deleting the path can be determined
+path_stat_agg_links = libstore.path_stat_agg_links
+
+
+def refresh_max_atime(path:str, max_atime:float, hot_files:list[str]) -> float:
+    for rel_path in hot_files:
+        try:
+            s = stat(
+                path if rel_path == "." else path_join(path, rel_path),
+                follow_symlinks=False,
+            )
+        except OSError:
+            continue
+        max_atime = max(max_atime, s.st_atime)
+
+    return max_atime
+
+
+# (index, max_atime, inodes, size, hot_files)
+StatAggRecord = tuple[int, int, int, int, list[str]]
+
+
+def stat_agg_chunk(
+    chunk:list[tuple[int, str]],
+    hot_count:int=0,
+) -> list[StatAggRecord]:
+    # intended to be run in a worker process, so accepts & returns only
+    # compact, cheaply picklable values. hot files are only gathered if
+    # hot_count is nonzero.
+    records = []
+    for index, path in chunk:
+        if hot_count:
+            (max_atime, inodes, size), hot_files = path_stat_agg_hot_files(path, hot_count)
+        else:
+            (max_atime, inodes, size), hot_files = path_stat_agg(path), []
+        records.append((index, max_atime, inodes, size, hot_files))
+
+    return records
+
+
+# (index, max_atime, inodes, size, exact)
+SampledStatAggRecord = tuple[int, int, int, int, bool]
+
+
+def sampled_stat_agg_chunk(
+    chunk:list[tuple[int, str]],
+    file_budget:int,
+) -> list[SampledStatAggRecord]:
+    # as stat_agg_chunk, but using sampled_path_stat_agg
+    records = []
+    for index, path in chunk:
+        (max_atime, inodes, size), exact = sampled_path_stat_agg(path, file_budget)
+        records.append((index, max_atime, inodes, size, exact))
+
+    return records
+
+
+# (index, max_atime, inodes, size, shared_files)
+LinksStatAggRecord = tuple[int, int, int, int, list[SharedFileTuple]]
+
+
+def links_stat_agg_chunk(
+    chunk:list[tuple[int, str]],
+) -> list[LinksStatAggRecord]:
+    # as stat_agg_chunk, but using path_stat_agg_links
+    records = []
+    for index, path in chunk:
+        (max_atime, inodes, size), shared_files = path_stat_agg_links(path)
+        records.append((index, max_atime, inodes, size, shared_files))
+
+    return records
@@ -1,20 +1,48 @@
 from concurrent.futures import Executor
 from dataclasses import dataclass
 import enum
+from functools import partial
 import heapq
 import logging
 from os.path import (
     join as path_join,
     split as path_split,
 )
-from typing import Literal, Optional
+import sqlite3
+from typing import Iterable, Iterator, Literal, Optional
 
+import numpy as np
 import rustworkx as rx
 
 import nix_heuristic_gc.libnixstore_wrapper as libstore
-from nix_heuristic_gc.fs import path_stat_agg
+from nix_heuristic_gc.columns import NodeColumns, make_node_view_class
+from nix_heuristic_gc.db import local_store_db_path, query_path_infos_db
+from nix_heuristic_gc.fs import (
+    AggStatTuple,
+    SharedFileTuple,
+    links_stat_agg_chunk,
+    path_stat_agg,
+    path_stat_agg_links,
+    sampled_path_stat_agg,
+    sampled_stat_agg_chunk,
+    stat_agg_chunk,
+)
+from nix_heuristic_gc.graph_snapshot import GraphSnapshot
+from nix_heuristic_gc.hardlinks import HardlinkIndex
+from nix_heuristic_gc.metrics import Metrics
 from nix_heuristic_gc.naive_executor import NaiveExecutor
-from nix_heuristic_gc.quantity import Quantity, QuantityUnit
+from nix_heuristic_gc.path_info import (
+    PathInfoTuple,
+    default_query_window,
+    query_path_infos_async,
+    query_path_infos_batched,
+    query_path_infos_serial,
+)
+from nix_heuristic_gc.prefetch import StatPrefetcher
+from nix_heuristic_gc.quantity import QuantityUnit
+from nix_heuristic_gc.recency import RecencySource
+from nix_heuristic_gc.stat_cache import StatCache
+from nix_heuristic_gc.substitutable_cache import SubstitutableCache
 
 
 logger = logging.getLogger(__name__)
@@ -23,17 +51,33 @@ _nix_store_path = libstore.get_nix_store_path()
 _gc_keep_derivations = libstore.get_gc_keep_derivations()
 _gc_keep_outputs = libstore.get_gc_keep_outputs()
 
+# below this many nodes, numpy's per-call overhead outweighs the gains of
+# scoring nodes in a single vectorized pass
+_MIN_VECTORIZED_BATCH = 32
+
+# every file, directory or symlink in a nar occupies far more than this
+# many bytes of it, so a valid path can't have more inodes than
+# nar_size / _MIN_NAR_BYTES_PER_INODE (+ 1 for a bare file)
+_MIN_NAR_BYTES_PER_INODE = 128
+
+# number of candidates with deferred stats to walk at a time once one
+# reaches the root of the heap
+_DEFERRED_STAT_BATCH = 64
+
 
 class GarbageGraph:
     @dataclass(slots=True)
     class BaseStorePathNode:
         path: str
         nar_size: Optional[int]
+        registration_time: Optional[int] = None
         _inherited_max_atime:Optional[int] = None
         _max_atime:Optional[int] = None
         _inodes:Optional[int] = None
         _fs_size:Optional[int] = None
         _substitutable:Optional[int] = None
+        # set when _max_atime and _fs_size are only estimates
+        _atime_sampled:bool = False
 
     class EdgeType(enum.Enum):
         REFERENCE = enum.auto()
@@ -57,6 +101,25 @@ class GarbageGraph:
         collect_invalid:bool|Literal["only"]=True,
         collect_substitutable:bool|Literal["only"]=True,
         collect_drvs:bool|Literal["only"]=True,
+        path_info_mode:Literal["serial", "async", "batch", "db"]="serial",
+        path_info_window:Optional[int]=None,
+        path_info_batch_size:int=1024,
+        stat_cache:Optional[StatCache]=None,
+        stat_executor:Optional[Executor]=None,
+        stat_chunk_size:int=64,
+        stat_prefetcher:Optional[StatPrefetcher]=None,
+        substitutable_cache:Optional[SubstitutableCache]=None,
+        prefetch_substitutable:bool=False,
+        substitutable_batch_size:int=256,
+        topo_sort:bool=True,
+        graph_snapshot:Optional[GraphSnapshot]=None,
+        columnar:bool=False,
+        metrics:Optional[Metrics]=None,
+        defer_stats:bool=False,
+        stat_file_budget:Optional[int]=None,
+        recency_source:Optional[RecencySource]=None,
+        hardlink_aware:bool=False,
+        condense_cycles:bool=False,
     ):
         if sum(
             1
@@ -64,40 +127,116 @@ class GarbageGraph:
             if x == "only"
         ) > 1:
             raise TypeError("Cannot specify 'only' for multiple arguments")
+        if defer_stats and any(
+            (w or 0) < 0
+            for w in (penalize_invalid, penalize_substitutable, penalize_drvs, penalize_inodes, penalize_size)
+        ):
+            raise ValueError("defer_stats requires non-negative penalties")
+        if stat_file_budget is not None:
+            if stat_file_budget < 1:
+                raise ValueError("stat_file_budget must be at least 1")
+            if stat_cache is not None:
+                # cache entries are relied upon to be exact
+                raise ValueError("stat_file_budget can't be used with a stat_cache")
+        if hardlink_aware and (stat_cache is not None or stat_file_budget is not None):
+            # neither records which of a path's files are hard links
+            raise ValueError("hardlink_aware can't be used with a stat_cache or stat_file_budget")
 
         self.store = store
         self.penalize_exceeding_limit = penalize_exceeding_limit
         self.inherit_max_atime = inherit_max_atime
+        self.metrics = metrics if metrics is not None else Metrics()
         self._executor = executor
+        self._stat_cache = stat_cache
+        self._stat_executor = stat_executor
+        self._stat_chunk_size = stat_chunk_size
+        self._stat_prefetcher = stat_prefetcher
+        self._stat_file_budget = stat_file_budget
+        # when set, valid paths' max_atime comes from here rather than
+        # their files, and they need only be walked if their inode count
+        # is needed
+        self._recency_source = recency_source
+        self._scoring_needs_inodes = penalize_inodes is not None or (
+            limit_unit == QuantityUnit.INODES and penalize_size is not None
+        )
+        # when set, limit measurements are of what deleting a path would
+        # actually free given the files it shares with other paths through
+        # hard links, every path measured needing to be walked
+        self._hardlinks = HardlinkIndex() if hardlink_aware else None
+        self._substitutable_cache = substitutable_cache
+        self._limit_unit = limit_unit
+        self._penalize_invalid = penalize_invalid
+        self._penalize_substitutable = penalize_substitutable
+        self._penalize_drvs = penalize_drvs
+        self._penalize_inodes = penalize_inodes
+        self._penalize_size = penalize_size
+        self._collect_invalid = collect_invalid
+        self._collect_substitutable = collect_substitutable
+        self._collect_drvs = collect_drvs
+        # scores of heap entries before any correction for limit excess
+        self._base_scores = {}
+        # when penalizing limit excess, candidates found to exceed the
+        # remaining limit are moved from self.heap to self._excess_heap,
+        # which is ordered by score + (limit_measurement * weight / limit).
+        # because every candidate in this heap is corrected by the same
+        # (limit_remaining * weight / limit) this ordering never changes -
+        # except with hardlink_aware, where limit measurements can grow as
+        # other paths sharing files are removed, so it's approximate.
+        self._excess_heap = []
+        self._excess_limit = None
+        self._excess_limit_remaining = None
+        self._pop_from_excess_heap = False
+        # with defer_stats, valid candidates which have inherited a max
+        # atime are initially added to the heap with a lower bound of their
+        # score, derived without walking them from that inherited atime,
+        # which their own max_atime can't be below. only once one reaches
+        # the root of the heap is its actual score determined. idxs of
+        # such candidates:
+        self._defer_stats = defer_stats
+        self._deferred = set()
+        # with condense_cycles, idxs of nodes standing in for a whole
+        # strongly connected component: ComponentNode
+        self._components = {}
 
-        class StorePathNode(self.BaseStorePathNode):
+        if columnar:
+            # node attributes are stored in shared arrays, nodes being
+            # only lightweight views of them created on demand
+            self.columns = NodeColumns()
+            node_base = make_node_view_class(self.columns)
+        else:
+            self.columns = None
+            node_base = self.BaseStorePathNode
+
+        class StorePathNode(node_base):
             __slots__ = ()
 
+            def _stat_agg(_self):
+                self._set_stats(_self, *self._path_stat_agg(_self))
+
+            @property
+            def atime_sampled(_self):
+                # whether max_atime (and fs_size) are only estimated
+                # from a sample of the path's files
+                if _self._inodes is None:
+                    _self._stat_agg()
+                return _self._atime_sampled
+
             @property
             def inodes(_self):
                 if _self._inodes is None:
-                    _self._max_atime, _self._inodes, _self._fs_size = path_stat_agg(path_join(
-                        _nix_store_path,
-                        _self.path,
-                    ))
+                    _self._stat_agg()
                 return _self._inodes
 
             @property
             def fs_size(_self):
                 if _self._fs_size is None:
-                    _self._max_atime, _self._inodes, _self._fs_size = path_stat_agg(path_join(
-                        _nix_store_path,
-                        _self.path,
-                    ))
+                    _self._stat_agg()
                 return _self._fs_size
 
             @property
             def max_atime(_self):
                 if _self._max_atime is None:
-                    _self._max_atime, _self._inodes, _self._fs_size = path_stat_agg(path_join(
-                        _nix_store_path,
-                        _self.path,
-                    ))
+                    _self._stat_agg()
                 if self.inherit_max_atime:
                     return max(_self._max_atime or 0, _self._inherited_max_atime or 0)
                 else:
@@ -106,7 +245,7 @@ class GarbageGraph:
             @property
             def substitutable(_self):
                 if _self._substitutable is None:
-                    _self._substitutable = _self.valid and bool(self.store.query_substitutable_paths(
+                    _self._substitutable = _self.valid and bool(self._query_substitutable_paths(
                         {libstore.StorePath(_self.path)},
                     ))
                 return _self._substitutable
@@ -123,6 +262,21 @@ class GarbageGraph:
             def size(_self):
                 return _self.nar_size if _self.nar_size is not None else _self.fs_size
 
+            @property
+            def freed_size(_self):
+                # what deleting the path would actually free, which with
+                # hardlink_aware is measured from its walked size as that
+                # is what its shared files are accounted against
+                if self._hardlinks is None:
+                    return _self.size
+                return self._hardlinks.marginal_size(_self.path, _self.fs_size)
+
+            @property
+            def freed_inodes(_self):
+                if self._hardlinks is None:
+                    return _self.inodes
+                return self._hardlinks.marginal_inodes(_self.path, _self.inodes)
+
             @property
             def score(_self):
                 s = float(_self.max_atime)
@@ -160,7 +314,7 @@ class GarbageGraph:
             if limit_unit == QuantityUnit.BYTES:
                 @property
                 def limit_measurement(_self):
-                    return _self.size
+                    return _self.freed_size
 
                 @property
                 def inodes_score(_self):
@@ -175,7 +329,7 @@ class GarbageGraph:
             elif limit_unit == QuantityUnit.INODES:
                 @property
                 def limit_measurement(_self):
-                    return _self.inodes
+                    return _self.freed_inodes
 
                 @property
                 def inodes_score(_self):
@@ -190,7 +344,108 @@ class GarbageGraph:
             else:
                 raise ValueError(f"Don't know how to measure {limit_unit!r}")
 
+        class ComponentNode(StorePathNode):
+            # a strongly connected component of the graph, i.e. a set of
+            # paths referencing each other in a loop, condensed to a single
+            # node so that it can be selected and deleted as a unit. it
+            # presents the aggregate of its members' attributes, and is
+            # only ever walked through them.
+            __slots__ = ("members",)
+
+            def __init__(_self, members:list):
+                _self.members = members
+
+            def __repr__(_self):
+                return f"ComponentNode(members={_self.members!r})"
+
+            def _stat_agg(_self):
+                for m in _self.members:
+                    if m._inodes is None:
+                        m._stat_agg()
+
+            @property
+            def path(_self):
+                # identifies the component in logs
+                return _self.members[0].path
+
+            @property
+            def nar_size(_self):
+                nar_sizes = [m.nar_size for m in _self.members]
+                return None if None in nar_sizes else sum(nar_sizes)
+
+            @property
+            def registration_time(_self):
+                # members may have been registered at quite different
+                # times, so stats of components are never deferred
+                return None
+
+            @property
+            def _inodes(_self):
+                inodes = [m._inodes for m in _self.members]
+                return None if None in inodes else sum(inodes)
+
+            @property
+            def _fs_size(_self):
+                fs_sizes = [m._fs_size for m in _self.members]
+                return None if None in fs_sizes else sum(fs_sizes)
+
+            @property
+            def _max_atime(_self):
+                max_atimes = [m._max_atime for m in _self.members]
+                return None if None in max_atimes else max(max_atimes)
+
+            @property
+            def _inherited_max_atime(_self):
+                return max(
+                    (m._inherited_max_atime for m in _self.members if m._inherited_max_atime is not None),
+                    default=None,
+                )
+
+            @_inherited_max_atime.setter
+            def _inherited_max_atime(_self, value):
+                # members are still reported individually once removed
+                for m in _self.members:
+                    m._inherited_max_atime = value
+
+            @property
+            def _atime_sampled(_self):
+                return any(m._atime_sampled for m in _self.members)
+
+            @property
+            def substitutable(_self):
+                return all(m.substitutable for m in _self.members)
+
+            @property
+            def is_drv(_self):
+                return any(m.is_drv for m in _self.members)
+
+            @property
+            def collection_allowed(_self):
+                # none of the members can be deleted without the others
+                return all(m.collection_allowed for m in _self.members)
+
+            @property
+            def freed_size(_self):
+                # measured over the members together, as files shared only
+                # between them are freed by deleting the component
+                if self._hardlinks is None:
+                    return sum(m.freed_size for m in _self.members)
+                return self._hardlinks.marginal_size(
+                    [m.path for m in _self.members],
+                    _self.fs_size,
+                )
+
+            @property
+            def freed_inodes(_self):
+                if self._hardlinks is None:
+                    return sum(m.freed_inodes for m in _self.members)
+                return self._hardlinks.marginal_inodes(
+                    [m.path for m in _self.members],
+                    _self.inodes,
+                )
+
         self.StorePathNode = StorePathNode
+        self.ComponentNode = ComponentNode
 
         global _gc_keep_derivations, _gc_keep_outputs
 
@@ -202,6 +457,7 @@ class GarbageGraph:
             )
 
         logger.info("querying dead paths")
+        self.metrics.begin_phase("query_dead_paths")
         garbage_path_set, _ = self.store.collect_garbage(
             action=libstore.GCAction.GCReturnDead,
         )
@@ -222,205 +478,962 @@ class GarbageGraph:
             )
             if x is not None
         }
-        logger.info("topologically sorting paths")
-        garbage_store_paths_sorted = self.store.topo_sort_paths(garbage_store_path_set)
+        # these intermediate collections are as large as the graph itself,
+        # so are released as soon as they're no longer needed
+        del garbage_path_set
+        if self.columns is not None:
+            self.columns.reserve(len(garbage_store_path_set))
+
+        self.metrics.begin_phase("sort_paths")
+        if topo_sort:
+            logger.info("topologically sorting paths")
+            # referenced paths first
+            garbage_store_paths = self.store.topo_sort_paths(garbage_store_path_set)[::-1]
+        else:
+            # edges are only added once all nodes are present, so the order
+            # is only important for how ties in score are broken. sorting
+            # by name is much quicker than topo_sort_paths and makes those
+            # at least consistent between runs.
+            garbage_store_paths = sorted(garbage_store_path_set, key=str)
+        del garbage_store_path_set
 
         # not (necessarily) a DAG due to DRV_OUTPUT and OUTPUT_DRV edges
         self.graph = rx.PyDiGraph()
+        if self.columns is None:
+            # node lookups are frequent enough for the python-level call
+            # of the node method to be noticeable
+            self.node = self.graph.__getitem__
         self.path_index_mapping = {}
 
         logger.info("building graph")
-        for store_path in reversed(garbage_store_paths_sorted):
-            try:
-                path_info = self.store.query_path_info(store_path)
-                str_path = str(path_info.path)
-                node_data = self.StorePathNode(
-                    str_path,
-                    path_info.nar_size,
-                )
-            except RuntimeError:
-                path_info = None
-                str_path = str(store_path)
-                node_data = self.StorePathNode(
-                    str_path,
-                    None,
+        self.metrics.begin_phase("build_graph")
+        path_infos = None
+        # may get populated by path_info_mode "db"
+        derivation_outputs = None
+
+        all_garbage_store_paths = garbage_store_paths
+        snapshot_path_infos = None
+        if graph_snapshot is not None and path_info_mode == "db":
+            logger.info("graph snapshots are not used with path_info_mode 'db'")
+        elif graph_snapshot is not None:
+            # only paths not already in the snapshot need querying
+            snapshot_path_infos = {}
+            garbage_store_paths = []
+            for store_path in all_garbage_store_paths:
+                path_info = graph_snapshot.get(str(store_path))
+                if path_info is None:
+                    garbage_store_paths.append(store_path)
+                else:
+                    snapshot_path_infos[path_info[0]] = path_info
+            logger.info(
+                "%(count)s of %(total)s paths found in graph snapshot",
+                {
+                    "count": len(snapshot_path_infos),
+                    "total": len(all_garbage_store_paths),
+                },
+            )
+        self.metrics.count("path_info_queries", len(garbage_store_paths))
+
+        if path_info_mode == "db":
+            db_path = local_store_db_path(self.store)
+            if db_path is None:
+                logger.info(
+                    "store is not a local store, falling back to path_info_mode "
+                    "'batch'",
                 )
+                path_info_mode = "batch"
+            else:
+                logger.debug("reading path information from %s", db_path)
+                try:
+                    path_infos, derivation_outputs = query_path_infos_db(
+                        db_path,
+                        self.store.get_setting("store") or "/nix/store",
+                        garbage_store_paths,
+                    )
+                except sqlite3.Error as e:
+                    logger.warning(
+                        "unable to read nix database (%s), falling back to "
+                        "path_info_mode 'batch'",
+                        e,
+                    )
+                    path_info_mode = "batch"
+
+        if path_infos is not None:
+            pass  # already gathered
+        elif path_info_mode == "serial":
+            path_infos = query_path_infos_serial(
+                self.store,
+                garbage_store_paths,
+            )
+        elif path_info_mode == "async":
+            path_infos = query_path_infos_async(
+                self.store,
+                garbage_store_paths,
+                window=path_info_window or default_query_window(self.store),
+            )
+        elif path_info_mode == "batch":
+            path_infos = query_path_infos_batched(
+                self.store,
+                garbage_store_paths,
+                batch_size=path_info_batch_size,
+                executor=self._executor,
+            )
+        else:
+            raise ValueError(f"Unknown path_info_mode {path_info_mode!r}")
 
-            node_index = self.graph.add_node(node_data)
+        if snapshot_path_infos is not None:
+            path_infos = self._merge_snapshot_path_infos(
+                graph_snapshot,
+                snapshot_path_infos,
+                path_infos,
+                all_garbage_store_paths,
+            )
+
+        node_references = []
+        # bound up front as this is run for every path
+        add_graph_node = self.graph.add_node
+        StorePathNode = self.StorePathNode
+        for str_path, nar_size, registration_time, references in path_infos:
+            if self.columns is None:
+                node_index = add_graph_node(StorePathNode(
+                    str_path,
+                    nar_size,
+                    registration_time,
+                ))
+            else:
+                node_index = self._add_column_node(str_path, nar_size, registration_time)
             self.path_index_mapping[str_path] = node_index
+            node_references.append((node_index, references))
+        del path_infos, garbage_store_paths, all_garbage_store_paths, snapshot_path_infos
 
-            if path_info is not None:
-                for ref_sp in path_info.references:
-                    ref_node_index = self.path_index_mapping.get(str(ref_sp))
-                    if ref_node_index == node_index:
-                        logger.debug(
-                            "omitting self-referencing edge from path %s",
-                            str_path,
-                        )
-                    elif ref_node_index is not None:
-                        self.graph.add_edge(
-                            node_index,
-                            ref_node_index,
-                            self.EdgeType.REFERENCE,
-                        )
-                    # else path being referenced is not garbage and we can ignore it
+        # edges are only added once all nodes are present, so no reference
+        # can be missed because of the order nodes were added in
+        for node_index, references in node_references:
+            for ref_str_path in references:
+                ref_node_index = self.path_index_mapping.get(ref_str_path)
+                if ref_node_index == node_index:
+                    logger.debug(
+                        "omitting self-referencing edge from path %s",
+                        self.node(node_index).path,
+                    )
+                elif ref_node_index is not None:
+                    self.graph.add_edge(
+                        node_index,
+                        ref_node_index,
+                        self.EdgeType.REFERENCE,
+                    )
+                # else path being referenced is not garbage and we can ignore it
+        del node_references
 
         # topo_sort_paths doesn't respect these pseudo-references so we need to
         # add these edges on a second pass
         if _gc_keep_derivations or _gc_keep_outputs:
             logger.info("populating output-drv or drv-output edges")
-            for path, idx in self.path_index_mapping.items():
-                if self.graph[idx].valid and path.endswith(".drv"):
-                    try:
-                        for output in self.store.query_derivation_outputs(
-                            libstore.StorePath(path),
-                        ):
-                            output_idx = self.path_index_mapping.get(str(output))
-                            if output_idx is not None and self.graph[output_idx].valid:
-                                if _gc_keep_derivations:
-                                    self.graph.add_edge(
-                                        output_idx,
-                                        idx,
-                                        self.EdgeType.OUTPUT_DRV,
-                                    )
-                                if _gc_keep_outputs:
-                                    self.graph.add_edge(
-                                        idx,
-                                        output_idx,
-                                        self.EdgeType.DRV_OUTPUT,
-                                    )
-                    except libstore.MissingRealisation:
-                        pass
+            self.metrics.begin_phase("drv_output_edges")
+            drv_paths = [
+                path for path, idx in self.path_index_mapping.items()
+                if path.endswith(".drv") and self.node(idx).valid
+            ]
+            if derivation_outputs is not None:
+                drvs_outputs = (derivation_outputs.get(path, ()) for path in drv_paths)
+            else:
+                drvs_outputs = self._executor.map(
+                    self._query_derivation_outputs,
+                    drv_paths,
+                )
+
+            new_edges = []
+            for path, outputs in zip(drv_paths, drvs_outputs):
+                idx = self.path_index_mapping[path]
+                for output in outputs:
+                    output_idx = self.path_index_mapping.get(str(output))
+                    if output_idx is not None and self.node(output_idx).valid:
+                        if _gc_keep_derivations:
+                            new_edges.append(
+                                (output_idx, idx, self.EdgeType.OUTPUT_DRV),
+                            )
+                        if _gc_keep_outputs:
+                            new_edges.append(
+                                (idx, output_idx, self.EdgeType.DRV_OUTPUT),
+                            )
+            self.graph.add_edges_from(new_edges)
+            del new_edges
+
+        if recency_source is not None:
+            logger.info("looking up path recency")
+            self.metrics.begin_phase("lookup_recency")
+            for idx in self.graph.node_indices():
+                spn = self.node(idx)
+                if spn.valid:
+                    spn._max_atime = self._last_used(spn)
 
+        if condense_cycles:
+            logger.info("condensing reference loops")
+            self.metrics.begin_phase("condense_components")
+            self._condense_components()
+
+        self.metrics.begin_phase("gather_candidates")
         logger.debug("gathering nodes for heap")
         pseudo_root_idxs = {
             i for i in self.graph.node_indices() if self.graph.in_degree(i) == 0
         }
-        if penalize_substitutable or collect_substitutable in (False, "only"):
+        if (
+            (penalize_substitutable or collect_substitutable in (False, "only"))
+            and prefetch_substitutable
+        ):
+            # most paths will need to know eventually, and asking in
+            # concurrent batches up front avoids a round trip per path later
+            logger.info("bulk querying path substitutability of all paths")
+            self.metrics.begin_phase("query_substitutable")
+            all_idxs = list(self.graph.node_indices())
+            batches = [
+                all_idxs[i:i+substitutable_batch_size]
+                for i in range(0, len(all_idxs), substitutable_batch_size)
+            ]
+            for batch, substitutable_paths in zip(batches, self._executor.map(
+                lambda batch: self._query_substitutable_paths({
+                    libstore.StorePath(spn.path) for spn in self._member_nodes(batch)
+                    if spn.valid
+                }),
+                batches,
+            )):
+                for spn in self._member_nodes(batch):
+                    spn._substitutable = (
+                        libstore.StorePath(spn.path) in substitutable_paths
+                    )
+        elif penalize_substitutable or collect_substitutable in (False, "only"):
             logger.info("bulk querying path substitutability")
-            substitutable_paths = self.store.query_substitutable_paths_interruptible({
-                libstore.StorePath(self.graph[i].path) for i in pseudo_root_idxs
-                if self.graph[i].valid
-            })
-            for i in pseudo_root_idxs:
-                self.graph[i]._substitutable = (
-                    libstore.StorePath(self.graph[i].path) in substitutable_paths
+            self.metrics.begin_phase("query_substitutable")
+            substitutable_paths = self._query_substitutable_paths({
+                libstore.StorePath(spn.path) for spn in self._member_nodes(pseudo_root_idxs)
+                if spn.valid
+            }, interruptible=True)
+            for spn in self._member_nodes(pseudo_root_idxs):
+                spn._substitutable = (
+                    libstore.StorePath(spn.path) in substitutable_paths
+                )
+
+        if self._stat_executor is not None:
+            logger.info("bulk gathering filesystem stats of pseudo-roots")
+            self.metrics.begin_phase("prefill_stats")
+            self._prefill_stat_aggs(sorted(
+                i for i in pseudo_root_idxs
+                if self.node(i).collection_allowed and not (
+                    self._defer_stats and self._stats_deferrable(self.node(i))
                 )
+            ))
 
         logger.info("constructing heap")
-        self.heap = []
-        # this shouldn't require any locking as long as each task only
-        # references one unique StorePathNode
-        for maybe_heap_tuple in self._executor.map(
-            self._get_maybe_heap_tuple,
-            pseudo_root_idxs,
+        self.metrics.begin_phase("construct_heap")
+        self.heap = self._get_heap_tuples(list(pseudo_root_idxs))
+        heapq.heapify(self.heap)
+        self.metrics.count("heap_pushes", len(self.heap))
+        self._schedule_stat_prefetches()
+        self.metrics.end_phase()
+
+    @staticmethod
+    def _merge_snapshot_path_infos(
+        graph_snapshot:GraphSnapshot,
+        snapshot_path_infos:dict[str, PathInfoTuple],
+        queried_path_infos:Iterable[PathInfoTuple],
+        store_paths:list[libstore.StorePath],
+    ) -> Iterator[PathInfoTuple]:
+        # produces path infos for all of store_paths in order, whether
+        # from snapshot_path_infos or queried_path_infos, updating the
+        # snapshot to cover exactly store_paths
+        queried_path_infos = {
+            path_info[0]: path_info for path_info in queried_path_infos
+        }
+        graph_snapshot.put(queried_path_infos.values())
+        graph_snapshot.retain(str(store_path) for store_path in store_paths)
+
+        for store_path in store_paths:
+            str_path = str(store_path)
+            path_info = snapshot_path_infos.get(str_path)
+            yield queried_path_infos[str_path] if path_info is None else path_info
+
+    def _add_column_node(
+        self,
+        path:str,
+        nar_size:Optional[int],
+        registration_time:Optional[int],
+    ) -> int:
+        # node payloads are left empty, node indexes being used as
+        # column rows. both are allocated sequentially so will match as
+        # long as nodes aren't removed before the graph is complete.
+        node_index = self.graph.add_node(None)
+        row = self.columns.append(path, nar_size, registration_time)
+        assert node_index == row
+        return node_index
+
+    def node(self, idx:int):
+        # in object mode this is replaced by self.graph.__getitem__ itself
+        # once the graph exists, components being stored as the payloads
+        # of their nodes
+        if self._components and idx in self._components:
+            return self._components[idx]
+        return self.StorePathNode(idx)
+
+    def _members(self, spn) -> list:
+        # the nodes of the individual paths spn consists of
+        return spn.members if isinstance(spn, self.ComponentNode) else [spn]
+
+    def _member_nodes(self, idxs:Iterable[int]) -> Iterator:
+        for idx in idxs:
+            yield from self._members(self.node(idx))
+
+    def _condense_components(self):
+        # replaces each strongly connected component of more than one
+        # node - i.e. each set of paths referencing each other in a loop,
+        # usually through DRV_OUTPUT and OUTPUT_DRV edges - with a single
+        # ComponentNode, leaving the graph acyclic. such loops would
+        # otherwise never get a pseudo-root to start removal from. the
+        # component takes over the idx of one of its members, the others
+        # being removed from the graph, though not path_index_mapping.
+        components = paths = 0
+        for component_idxs in rx.strongly_connected_components(self.graph):
+            if len(component_idxs) < 2:
+                continue
+
+            component_idxs = sorted(component_idxs)
+            component_idx_set = set(component_idxs)
+            idx, absorbed_idxs = component_idxs[0], component_idxs[1:]
+            members = [self.node(i) for i in component_idxs]
+
+            # edges within the component go with the absorbed nodes
+            external_edges = []
+            for absorbed_idx in absorbed_idxs:
+                for s, _, edge_type in self.graph.in_edges(absorbed_idx):
+                    if s not in component_idx_set:
+                        external_edges.append((s, idx, edge_type))
+                for _, t, edge_type in self.graph.out_edges(absorbed_idx):
+                    if t not in component_idx_set:
+                        external_edges.append((idx, t, edge_type))
+            self.graph.remove_nodes_from(absorbed_idxs)
+            self.graph.add_edges_from(external_edges)
+
+            self._components[idx] = self.ComponentNode(members)
+            if self.columns is None:
+                self.graph[idx] = self._components[idx]
+            for spn in members:
+                self.path_index_mapping[spn.path] = idx
+            components += 1
+            paths += len(members)
+
+        logger.info(
+            "condensed %(paths)s paths into %(components)s components",
+            {"paths": paths, "components": components},
+        )
+        self.metrics.count("condensed_components", components)
+        self.metrics.count("condensed_paths", paths)
+
+    def _prefill_stat_aggs(self, idxs):
+        # gather filesystem stats for the nodes at idxs in bulk using
+        # self._stat_executor, which is likely a process pool and so
+        # can't touch the nodes themselves
+        # records refer to nodes by their position in spns
+        spns, to_walk = [], []
+        for spn in self._member_nodes(idxs):
+            if not self._needs_walk(spn):
+                continue
+            if (
+                self._stat_cache is not None
+                and spn.valid
+                and self._stat_cache.is_fresh(spn.path, spn.registration_time)
+            ):
+                # cheap enough to do in-process when needed
+                continue
+            to_walk.append((len(spns), path_join(_nix_store_path, spn.path)))
+            spns.append(spn)
+
+        chunks = (
+            to_walk[i:i+self._stat_chunk_size]
+            for i in range(0, len(to_walk), self._stat_chunk_size)
+        )
+        if self._hardlinks is not None:
+            for records in self._stat_executor.map(links_stat_agg_chunk, chunks):
+                for i, max_atime, inodes, fs_size, shared_files in records:
+                    self._count_stat_walk(inodes, fs_size)
+                    self._set_stats(spns[i], (max_atime, inodes, fs_size), False, shared_files)
+            return
+
+        if self._stat_file_budget is not None:
+            for records in self._stat_executor.map(
+                partial(sampled_stat_agg_chunk, file_budget=self._stat_file_budget),
+                chunks,
+            ):
+                for i, max_atime, inodes, fs_size, exact in records:
+                    self._count_stat_walk(inodes, fs_size, exact)
+                    self._set_stats(spns[i], (max_atime, inodes, fs_size), not exact)
+            return
+
+        # hot files are needed if we're to be able to cache the results
+        hot_count = 0 if self._stat_cache is None else self._stat_cache.hot_count
+        for records in self._stat_executor.map(
+            partial(stat_agg_chunk, hot_count=hot_count),
+            chunks,
         ):
-            if maybe_heap_tuple:
-                heapq.heappush(self.heap, maybe_heap_tuple)
+            for i, max_atime, inodes, fs_size, hot_files in records:
+                self._count_stat_walk(inodes, fs_size)
+                spn = spns[i]
+                self._set_stats(spn, (max_atime, inodes, fs_size), False)
+                if self._stat_cache is not None and spn.valid:
+                    self._stat_cache.put(
+                        spn.path,
+                        spn.registration_time,
+                        (max_atime, inodes, fs_size),
+                        hot_files,
+                    )
+
+    def _schedule_stat_prefetches(self):
+        # request stats of paths that removal of one of the leading heap
+        # candidates would turn into candidates themselves. the first
+        # entries of the heap's list aren't strictly the lowest scoring
+        # candidates, but are a cheap approximation.
+        if self._stat_prefetcher is None:
+            return
+
+        # results are keyed by path, so a prefetcher can be shared between
+        # graphs
+        for _, idx in self.heap[:self._stat_prefetcher.lookahead]:
+            if idx in self._deferred:
+                spn = self.node(idx)
+                if spn.path not in self._stat_prefetcher:
+                    self._stat_prefetcher.prefetch(spn.path, self._path_stat_agg, spn)
+            for _, ref_idx, _ in self.graph.out_edges(idx):
+                if self.graph.in_degree(ref_idx) != 1:
+                    continue
+                for ref_spn in self._members(self.node(ref_idx)):
+                    if self._needs_walk(ref_spn) and ref_spn.path not in self._stat_prefetcher:
+                        self._stat_prefetcher.prefetch(ref_spn.path, self._path_stat_agg, ref_spn)
+
+    def _take_prefetched_stats(self, idxs:list[int]):
+        for spn in self._member_nodes(idxs):
+            if spn._inodes is None:
+                result = self._stat_prefetcher.take(spn.path)
+                if result is not None:
+                    self._set_stats(spn, *result)
+
+    def _query_derivation_outputs(self, drv_path:str):
+        try:
+            return self.store.query_derivation_outputs(libstore.StorePath(drv_path))
+        except libstore.MissingRealisation:
+            return ()
+
+    def _query_substitutable_paths(
+        self,
+        store_paths:set[libstore.StorePath],
+        interruptible:bool=False,
+    ) -> set[libstore.StorePath]:
+        query_func = (
+            self.store.query_substitutable_paths_interruptible
+            if interruptible else self.store.query_substitutable_paths
+        )
+        def counted_query_func(store_paths):
+            self.metrics.count("substitutable_queries")
+            self.metrics.count("substitutable_paths_queried", len(store_paths))
+            return query_func(store_paths)
+
+        if self._substitutable_cache is None:
+            return counted_query_func(store_paths)
+
+        return self._substitutable_cache.query_substitutable_paths(
+            store_paths,
+            counted_query_func,
+        )
+
+    def _needs_walk(self, spn) -> bool:
+        return spn._inodes is None and (
+            self._recency_source is None
+            or not spn.valid
+            or self._scoring_needs_inodes
+            or self._hardlinks is not None
+        )
+
+    def _set_stats(
+        self,
+        spn,
+        stat_agg:AggStatTuple,
+        atime_sampled:bool,
+        shared_files:Optional[list[SharedFileTuple]]=None,
+    ):
+        # shared_files are registered here rather than when walking, as
+        # walks may have been done on behalf of a different graph sharing
+        # a StatPrefetcher
+        max_atime, spn._inodes, spn._fs_size = stat_agg
+        if self._recency_source is None or not spn.valid:
+            spn._max_atime, spn._atime_sampled = max_atime, atime_sampled
+        if self._hardlinks is not None and shared_files is not None:
+            self.metrics.count("hardlinked_files", len(shared_files))
+            self._hardlinks.add(spn.path, shared_files)
+
+    def _last_used(self, spn) -> float:
+        # registration (by building or substituting the path) counts as
+        # a use
+        return float(max(
+            self._recency_source.last_used(spn.path) or 0,
+            spn.registration_time or 0,
+        ))
+
+    def _count_stat_walk(self, inodes:int, fs_size:int, exact:bool=True):
+        self.metrics.count("stat_walks")
+        self.metrics.count("stat_walk_inodes", inodes)
+        self.metrics.count("stat_walk_bytes", fs_size)
+        if not exact:
+            self.metrics.count("sampled_stat_walks")
+
+    def _path_stat_agg(
+        self,
+        spn,
+    ) -> tuple[AggStatTuple, bool, Optional[list[SharedFileTuple]]]:
+        # returns spn's stats, whether they were only estimated from a
+        # sample of its files and, with hardlink_aware, its shared files.
+        # may be run in a StatPrefetcher's threads, so mustn't modify
+        # the graph - the result is applied by _set_stats.
+        if self._stat_cache is not None and spn.valid:
+            self.metrics.count("stat_cache_lookups")
+            return self._stat_cache.path_stat_agg(spn.path, spn.registration_time), False, None
+
+        shared_files = None
+        if self._hardlinks is not None:
+            stat_agg, shared_files = path_stat_agg_links(path_join(_nix_store_path, spn.path))
+            exact = True
+        elif self._stat_file_budget is not None:
+            stat_agg, exact = sampled_path_stat_agg(
+                path_join(_nix_store_path, spn.path),
+                self._stat_file_budget,
+            )
+        else:
+            stat_agg, exact = path_stat_agg(path_join(_nix_store_path, spn.path)), True
+        self._count_stat_walk(stat_agg[1], stat_agg[2], exact)
+        return stat_agg, not exact, shared_files
 
     def _get_maybe_heap_tuple(self, ref_idx):
-        if self.graph[ref_idx].collection_allowed:
-            return self.graph[ref_idx].score, ref_idx
+        if self.node(ref_idx).collection_allowed:
+            return self.node(ref_idx).score, ref_idx
 
         return None
 
-    def remove_heap_root(self):
-        if not self.heap:
-            raise self.HeapEmptyError()
+    def _stats_deferrable(self, spn) -> bool:
+        # nothing about a path's own files bounds their atimes - it may be
+        # an empty directory with no atime at all, or hold hard links to
+        # files last accessed long before it was registered - so without
+        # an inherited atime to fall back on there's no useful bound
+        return (
+            self._needs_walk(spn)
+            and spn.registration_time is not None
+            and self.inherit_max_atime
+            and spn._inherited_max_atime is not None
+            and not (
+                self._stat_cache is not None
+                and self._stat_cache.is_fresh(spn.path, spn.registration_time)
+            )
+        )
 
-        idx = heapq.heappop(self.heap)[-1]
-        node_data = self.graph[idx]
-        ref_idxs = frozenset((t for _, t, _ in self.graph.out_edges(idx)))
-        self.graph.remove_node(idx)
-        del self.path_index_mapping[node_data.path]
+    def _score_lower_bound(self, spn) -> float:
+        # mirrors StorePathNode.score for a valid node with unknown
+        # filesystem stats, substituting the lowest possible atime and
+        # the worst possible inode count
+        s = float(spn._inherited_max_atime)
+        if self._penalize_drvs is not None and spn.is_drv:
+            s -= self._penalize_drvs
+        if self._penalize_substitutable is not None and spn.substitutable:
+            s -= self._penalize_substitutable
 
-        if self.inherit_max_atime:
-            # ensure our direct references inherit our max_atime
-            # before we go (a path's atime is irrelevant until its
-            # referrers have been deleted so this should be the
-            # only place we need to propagate atimes)
-            for ref_idx in ref_idxs:
-                ref_spn = self.graph[ref_idx]
-                ref_spn._inherited_max_atime = max(
-                    node_data.max_atime or 0,
-                    ref_spn._inherited_max_atime or 0,
-                )
+        if self._penalize_inodes is not None or self._penalize_size is not None:
+            max_inodes = spn.nar_size // _MIN_NAR_BYTES_PER_INODE + 1
+            if self._limit_unit == QuantityUnit.BYTES:
+                max_inodes_score = max_inodes / (spn.nar_size+1)
+                max_size_score = spn.nar_size
+            else:
+                # a path has at least one inode
+                max_inodes_score = max_inodes
+                max_size_score = spn.nar_size / 2
+
+            if self._penalize_inodes is not None:
+                s -= self._penalize_inodes * max_inodes_score
+            if self._penalize_size is not None:
+                s -= self._penalize_size * max_size_score
+
+        return s
+
+    def _get_maybe_deferred_heap_tuple(self, idx):
+        spn = self.node(idx)
+        if spn.collection_allowed:
+            return self._score_lower_bound(spn), idx
+
+        return None
+
+    def _get_heap_tuples(self, idxs:list[int]) -> list[tuple[float, int]]:
+        if not self._defer_stats:
+            return self._get_actual_heap_tuples(idxs)
+
+        deferrable_idxs, actual_idxs = [], []
+        for idx in idxs:
+            if self._stats_deferrable(self.node(idx)):
+                deferrable_idxs.append(idx)
+            else:
+                actual_idxs.append(idx)
+
+        deferred_tuples = [
+            maybe_heap_tuple
+            for maybe_heap_tuple in self._executor.map(
+                self._get_maybe_deferred_heap_tuple,
+                deferrable_idxs,
+            ) if maybe_heap_tuple
+        ]
+        self._deferred.update(idx for _, idx in deferred_tuples)
+        self._base_scores.update((idx, score) for score, idx in deferred_tuples)
+        self.metrics.count("deferred_stats", len(deferred_tuples))
+
+        return deferred_tuples + self._get_actual_heap_tuples(actual_idxs)
+
+    def _resolve_heap_root(self):
+        # ensures the root of the heap holds an actual score rather than a
+        # lower bound, walking deferred candidates from the top of the heap
+        # a batch at a time until it does. actual scores are never below
+        # their bounds, so the root is then truly the lowest scoring
+        # candidate.
+        while self.heap and self.heap[0][-1] in self._deferred:
+            batch_idxs = []
+            while (
+                self.heap
+                and self.heap[0][-1] in self._deferred
+                and len(batch_idxs) < _DEFERRED_STAT_BATCH
+            ):
+                idx = heapq.heappop(self.heap)[-1]
+                self._deferred.discard(idx)
+                batch_idxs.append(idx)
+
+            if self._stat_prefetcher is not None:
+                self._take_prefetched_stats(batch_idxs)
+            if self._stat_executor is not None:
+                self._prefill_stat_aggs(batch_idxs)
+            self.metrics.count("deferred_stats_resolved", len(batch_idxs))
+            for heap_tuple in self._get_actual_heap_tuples(batch_idxs):
+                heapq.heappush(self.heap, heap_tuple)
+
+    def _get_actual_heap_tuples(self, idxs:list[int]) -> list[tuple[float, int]]:
+        heap_tuples = []
+        if self.columns is not None and len(idxs) >= _MIN_VECTORIZED_BATCH:
+            # components aren't represented in the columns
+            row_idxs = [idx for idx in idxs if idx not in self._components]
+            if row_idxs:
+                heap_tuples = self._get_heap_tuples_vectorized(row_idxs)
+            idxs = [idx for idx in idxs if idx in self._components]
 
-        # this shouldn't require any locking as long as each task only
-        # references one unique StorePathNode
-        for maybe_heap_tuple in self._executor.map(
-            self._get_maybe_heap_tuple,
-            (ref_idx for ref_idx in ref_idxs if self.graph.in_degree(ref_idx) == 0),
+        if idxs:
+            # this shouldn't require any locking as long as each task only
+            # references one unique StorePathNode
+            heap_tuples += [
+                maybe_heap_tuple
+                for maybe_heap_tuple in self._executor.map(
+                    self._get_maybe_heap_tuple,
+                    idxs,
+                ) if maybe_heap_tuple
+            ]
+
+        self._base_scores.update((idx, score) for score, idx in heap_tuples)
+        return heap_tuples
+
+    def _get_heap_tuples_vectorized(self, idxs:list[int]) -> list[tuple[float, int]]:
+        # equivalent to _get_maybe_heap_tuple for each of idxs, but
+        # operating on whole columns at once. all arithmetic is performed
+        # in the same order and precision as StorePathNode.score so results
+        # are identical.
+        columns = self.columns
+        rows = np.array(idxs, dtype=np.intp)
+
+        if self._penalize_substitutable is not None or self._collect_substitutable in (False, "only"):
+            unknown_rows = rows[
+                (columns.flags[rows] & NodeColumns.FLAG_SUBSTITUTABLE_KNOWN) == 0
+            ]
+            if len(unknown_rows):
+                substitutable_paths = self._query_substitutable_paths({
+                    libstore.StorePath(columns.paths[row])
+                    for row in unknown_rows[columns.nar_size[unknown_rows] >= 0].tolist()
+                })
+                for row in unknown_rows.tolist():
+                    self.node(row)._substitutable = (
+                        libstore.StorePath(columns.paths[row]) in substitutable_paths
+                    )
+
+        valid = columns.nar_size[rows] >= 0
+        flags = columns.flags[rows]
+        is_drv = (flags & NodeColumns.FLAG_DRV) != 0
+        substitutable = (flags & NodeColumns.FLAG_SUBSTITUTABLE) != 0
+
+        allowed = np.ones(len(rows), dtype=bool)
+        for collect, mask in (
+            (self._collect_invalid, ~valid),
+            (self._collect_substitutable, substitutable),
+            (self._collect_drvs, is_drv),
         ):
-            if maybe_heap_tuple:
-                heapq.heappush(self.heap, maybe_heap_tuple)
+            if not collect:
+                allowed &= ~mask
+            elif collect == "only":
+                allowed &= mask
+
+        rows = rows[allowed]
+        valid = valid[allowed]
+        is_drv = is_drv[allowed]
+        substitutable = substitutable[allowed]
+
+        # fill in any missing filesystem stats
+        needs_walk = columns.inodes[rows] < 0
+        if (
+            self._recency_source is not None
+            and not self._scoring_needs_inodes
+            and self._hardlinks is None
+        ):
+            needs_walk &= ~valid
+        for _ in self._executor.map(
+            lambda row: self.StorePathNode(row)._stat_agg(),
+            rows[needs_walk].tolist(),
+        ):
+            pass
+
+        if self.inherit_max_atime:
+            scores = np.maximum(
+                np.nan_to_num(columns.max_atime[rows], nan=0.0),
+                np.nan_to_num(columns.inherited_max_atime[rows], nan=0.0),
+            )
+        else:
+            scores = columns.max_atime[rows]
+
+        if self._penalize_invalid is not None:
+            scores[~valid] -= self._penalize_invalid
+        if self._penalize_drvs is not None:
+            scores[is_drv] -= self._penalize_drvs
+        if self._penalize_substitutable is not None:
+            scores[substitutable] -= self._penalize_substitutable
+
+        if self._penalize_inodes is not None or self._penalize_size is not None:
+            inodes = columns.inodes[rows]
+            size = np.where(valid, columns.nar_size[rows], columns.fs_size[rows])
+            if self._limit_unit == QuantityUnit.BYTES:
+                inodes_score = inodes / (size+1)
+                size_score = size
+            else:
+                inodes_score = inodes
+                size_score = size / (inodes+1)
+
+            if self._penalize_inodes is not None:
+                scores -= self._penalize_inodes * inodes_score
+            if self._penalize_size is not None:
+                scores -= self._penalize_size * size_score
+
+        return list(zip(scores.tolist(), rows.tolist()))
+
+    def _pop_heap_root(self) -> int:
+        return self._pop_heap_root_scored()[1]
+
+    def _pop_heap_root_scored(self) -> tuple[float, int]:
+        # also returns the base score the candidate was chosen with
+        if self._pop_from_excess_heap:
+            idx = heapq.heappop(self._excess_heap)[-1]
+            self._pop_from_excess_heap = False
+        else:
+            self._resolve_heap_root()
+            if not self.heap:
+                raise self.HeapEmptyError()
+            idx = heapq.heappop(self.heap)[-1]
+
+        self.metrics.count("heap_pops")
+        return self._base_scores.pop(idx), idx
+
+    def _remove_nodes(self, idxs:list[int]) -> list:
+        # removes the already-popped heap candidates idxs from the graph,
+        # pushing any of their references left without referrers on to
+        # the heap. candidates can't reference each other (they would
+        # not have been candidates) so can be removed in any order.
+        # returns the nodes of the individual paths removed, components
+        # being expanded into their members.
+        nodes_data = [self.node(idx) for idx in idxs]
+        ref_idxs = set()
+        for idx, node_data in zip(idxs, nodes_data):
+            node_ref_idxs = {t for _, t, _ in self.graph.out_edges(idx)}
+            ref_idxs |= node_ref_idxs
+
+            if self.inherit_max_atime:
+                # ensure our direct references inherit our max_atime
+                # before we go (a path's atime is irrelevant until its
+                # referrers have been deleted so this should be the
+                # only place we need to propagate atimes)
+                max_atime = node_data.max_atime or 0
+                for ref_idx in node_ref_idxs:
+                    ref_spn = self.node(ref_idx)
+                    ref_spn._inherited_max_atime = max(
+                        max_atime,
+                        ref_spn._inherited_max_atime or 0,
+                    )
+
+        if len(idxs) == 1:
+            self.graph.remove_node(idxs[0])
+        else:
+            self.graph.remove_nodes_from(idxs)
+        nodes_data = [
+            member for node_data in nodes_data for member in self._members(node_data)
+        ]
+        for node_data in nodes_data:
+            del self.path_index_mapping[node_data.path]
+            if self._hardlinks is not None:
+                # fixes what node_data's limit_measurement reports, and
+                # lets paths sharing its files claim them
+                self._hardlinks.remove(node_data.path)
 
-        return node_data
+        freed_idxs = [
+            ref_idx for ref_idx in ref_idxs if self.graph.in_degree(ref_idx) == 0
+        ]
+        if self._stat_prefetcher is not None:
+            self._take_prefetched_stats(freed_idxs)
+
+        heap_tuples = self._get_heap_tuples(freed_idxs)
+        for heap_tuple in heap_tuples:
+            heapq.heappush(self.heap, heap_tuple)
+        self.metrics.count("heap_pushes", len(heap_tuples))
+        self.metrics.count("nodes_removed", len(idxs))
+
+        self._schedule_stat_prefetches()
+        return nodes_data
+
+    def remove_heap_root(self):
+        return self._remove_nodes([self._pop_heap_root()])[0]
 
     def correct_heap_root_for_limit_excess(
         self,
         limit:int,
         limit_removed:int,
     ):
-        if not self.heap:
-            raise self.HeapEmptyError()
-
+        # arranges for the next remove_heap_root to remove the candidate
+        # with the lowest score once corrected for limit excess
         if self.penalize_exceeding_limit is None:
             raise TypeError("This makes no sense to do without penalize_exceeding_limit")
 
+        self._pop_from_excess_heap = False
         limit_remaining = limit - limit_removed
 
-        for _ in range(len(self.heap) + 1):  # +1 for when all candidates over limit
-            candidate_heapscore, candidate_idx = self.heap[0]
-            candidate_spn = self.graph[candidate_idx]
-            if candidate_spn.limit_measurement <= limit_remaining:
-                # this entry needs no score correction
-                return
+        if limit != self._excess_limit or limit_remaining > self._excess_limit_remaining:
+            # the excess heap's ordering or membership is no longer valid.
+            # return its candidates to the main heap to be re-examined.
+            for _, idx in self._excess_heap:
+                heapq.heappush(self.heap, (self._base_scores[idx], idx))
+            self._excess_heap = []
+            self._excess_limit = limit
+        self._excess_limit_remaining = limit_remaining
 
-            corrected_score = candidate_spn.score + (
-                (candidate_spn.limit_measurement - limit_remaining)
+        def excess_heap_root_corrected():
+            excess_idx = self._excess_heap[0][-1]
+            return self._base_scores[excess_idx] + (
+                (self.node(excess_idx).limit_measurement - limit_remaining)
                 * self.penalize_exceeding_limit / limit
-            )
-            if candidate_heapscore == corrected_score:
-                # score in heap is up to date and the next
-                # pop should yield the lowest scoring entry
-                return
-
-            # candidate hadn't had its score corrected for this
-            # value of limit_remaining. pop and push back into
-            # the heap with its updated score. if it's still the
-            # lowest scoring entry it will get picked straight out
-            # again on the next iteration.
-            # this works because we can only ever increase a candidate's
-            # score when correcting it - we know that correcting any
-            # heap entry other than the root couldn't make it lower than
-            # the root's score.
-            logger.debug(
-                "correcting score of %(path)s from %(prev_score)s to %(new_score)s",
-                {
-                    "path": candidate_spn.path,
-                    "prev_score": candidate_heapscore,
-                    "new_score": corrected_score,
-                },
-            )
-            heapq.heappushpop(self.heap, (corrected_score, candidate_idx))
-        else:
-            raise AssertionError(
-                "Performed correction shuffle more times than there are "
-                "items in heap + 1. This should not be possible."
-            )
+            ), excess_idx
+
+        # a candidate exceeding limit_remaining always will, as it only
+        # ever decreases. candidates are only examined once they reach
+        # the root of the heap - until then they can't have a lower
+        # corrected score than the root.
+        excess_root = self._excess_heap and excess_heap_root_corrected()
+        self._resolve_heap_root()
+        while self.heap and not (excess_root and excess_root < self.heap[0]):
+            score, idx = self.heap[0]
+            limit_measurement = self.node(idx).limit_measurement
+            if limit_measurement <= limit_remaining:
+                break
+
+            heapq.heappop(self.heap)
+            self.metrics.count("excess_heap_pushes")
+            heapq.heappush(self._excess_heap, (
+                score + (limit_measurement * self.penalize_exceeding_limit / limit),
+                idx,
+            ))
+            excess_root = excess_heap_root_corrected()
+            self._resolve_heap_root()
+
+        if not excess_root:
+            if not self.heap:
+                raise self.HeapEmptyError()
+            return
+
+        if self.heap and self.heap[0] < excess_root:
+            return
+
+        logger.debug(
+            "choosing %(path)s despite exceeding limit, corrected score %(score)s",
+            {
+                "path": self.node(excess_root[-1]).path,
+                "score": excess_root[0],
+            },
+        )
+        self.metrics.count("limit_excess_selections")
+        self._pop_from_excess_heap = True
+
+    def remove_to_limit(self, limit:int, batch_size:int=1) -> list:
+        return list(self.iter_remove_to_limit(limit, batch_size=batch_size))
+
+    def iter_remove_to_limit(self, limit:int, batch_size:int=1, with_scores:bool=False):
+        # as remove_to_limit, but yielding each node as soon as it has
+        # been chosen. with_scores yields (node, score) pairs instead,
+        # score being what the node was chosen with - reading a node's
+        # score property again may require walking it.
+        #
+        # with a batch_size above 1, up to batch_size candidates are
+        # removed from the graph at a time. only the first of each batch is
+        # chosen exactly as it would be one-at-a-time - the rest are
+        # further heap roots fitting within the remaining limit, which
+        # don't get to compete with any referrers freed by the batch.
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        if batch_size > 1 and self._hardlinks is not None:
+            # removing one of a batch can change how much its siblings
+            # would free, which were measured before any were removed
+            raise ValueError("hardlink_aware can't be used with a batch_size above 1")
 
-    def remove_to_limit(self, limit:int):
-        removed_node_data = []
         limit_removed = 0
 
         try:
             while limit_removed < limit:
                 if self.penalize_exceeding_limit is not None:
                     self.correct_heap_root_for_limit_excess(limit, limit_removed)
-                node_data = self.remove_heap_root()
-                limit_removed += node_data.limit_measurement
-                removed_node_data.append(node_data)
+                score, idx = self._pop_heap_root_scored()
+                batch_idxs, batch_scores = [idx], [score]
+                batch_removed = self.node(idx).limit_measurement
+
+                while len(batch_idxs) < batch_size and self.heap:
+                    if self.penalize_exceeding_limit is not None:
+                        self.correct_heap_root_for_limit_excess(
+                            limit,
+                            limit_removed + batch_removed,
+                        )
+                        if self._pop_from_excess_heap:
+                            # best candidate doesn't fit - leave it to
+                            # be chosen on its own
+                            break
+
+                    self._resolve_heap_root()
+                    if not self.heap:
+                        break
+                    limit_measurement = self.node(self.heap[0][-1]).limit_measurement
+                    if limit_removed + batch_removed + limit_measurement > limit:
+                        break
+
+                    score, idx = self._pop_heap_root_scored()
+                    batch_idxs.append(idx)
+                    batch_scores.append(score)
+                    batch_removed += limit_measurement
+
+                limit_removed += batch_removed
+                if not with_scores:
+                    yield from self._remove_nodes(batch_idxs)
+                    continue
+
+                # members of components share their component's score
+                member_scores = [
+                    score
+                    for idx, score in zip(batch_idxs, batch_scores)
+                    for _ in self._members(self.node(idx))
+                ]
+                yield from zip(self._remove_nodes(batch_idxs), member_scores)
         except self.HeapEmptyError:
             logger.warning("ran out of qualifying zero-reference paths to remove")
             if self.graph.num_nodes():
@@ -439,7 +1452,5 @@ class GarbageGraph:
                 )
                 logger.debug(
                     "first encountered cycle: %s",
-                    [str(self.graph[i].path) for i in rx.digraph_find_cycle(self.graph)],
+                    [str(self.node(u).path) for u, _ in rx.digraph_find_cycle(self.graph)],
                 )
-
-        return removed_node_data
@@ -0,0 +1,148 @@
+import logging
+import sqlite3
+from threading import Lock
+from time import time
+from typing import Iterable, Optional
+
+from nix_heuristic_gc.path_info import PathInfoTuple
+
+logger = logging.getLogger(__name__)
+
+
+class GraphSnapshot:
+    # a valid store path's nar size and references never change, so the
+    # path information of dead paths gathered by one run can be reused by
+    # the next, which then only needs to query paths that have died since.
+    # entries are trusted for at most max_age seconds, mostly to catch
+    # paths that have been deleted and re-registered in the meantime.
+    # invalid paths are never remembered as they may since have become
+    # valid.
+    #
+    # entries are keyed by a caller-supplied context string (e.g. the
+    # store URI) as well as path so snapshots of different stores can't
+    # get mixed up.
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS PathInfo (
+            context          TEXT NOT NULL,
+            path             TEXT NOT NULL,
+            narSize          INTEGER NOT NULL,
+            registrationTime INTEGER,
+            refs             TEXT NOT NULL,
+            queryTimestamp   REAL NOT NULL,
+            PRIMARY KEY (context, path)
+        )
+    """
+
+    def __init__(
+        self,
+        db_path:str,
+        context:str="",
+        max_age:float=86400,
+    ):
+        self.db_path = db_path
+        self.context = context
+        self.max_age = max_age
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = Lock()
+        self._dirty = set()
+        self._evicted = set()
+
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute(self._SCHEMA)
+            # path: (nar_size, registration_time, references, query_timestamp)
+            self._entries = {
+                path: (nar_size, registration_time, refs, query_timestamp)
+                for path, nar_size, registration_time, refs, query_timestamp in conn.execute(
+                    "SELECT path, narSize, registrationTime, refs, queryTimestamp "
+                    "FROM PathInfo WHERE context = ?",
+                    (context,),
+                )
+            }
+            conn.commit()
+        finally:
+            conn.close()
+
+        logger.debug("loaded %s graph snapshot entries from %s", len(self._entries), db_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.save()
+        logger.debug(
+            "graph snapshot hits: %(hits)s, misses: %(misses)s",
+            {"hits": self.hits, "misses": self.misses},
+        )
+
+    def get(self, path:str) -> Optional[PathInfoTuple]:
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or time() - entry[3] >= self.max_age:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        nar_size, registration_time, refs, _ = entry
+        return (
+            path,
+            nar_size,
+            registration_time,
+            tuple(refs.split("\0")) if refs else (),
+        )
+
+    def put(self, path_infos:Iterable[PathInfoTuple]):
+        now = time()
+        with self._lock:
+            for path, nar_size, registration_time, references in path_infos:
+                if nar_size is None:
+                    continue
+                self._entries[path] = (
+                    nar_size,
+                    registration_time,
+                    "\0".join(references),
+                    now,
+                )
+                self._dirty.add(path)
+                self._evicted.discard(path)
+
+    def retain(self, paths:Iterable[str]):
+        # forget all entries other than those for paths
+        paths = frozenset(paths)
+        with self._lock:
+            for path in [p for p in self._entries if p not in paths]:
+                del self._entries[path]
+                self._dirty.discard(path)
+                self._evicted.add(path)
+
+    def save(self):
+        with self._lock:
+            dirty = {p: self._entries[p] for p in self._dirty}
+            evicted = list(self._evicted)
+            self._dirty.clear()
+            self._evicted.clear()
+
+        logger.debug(
+            "saving %s updated and %s evicted graph snapshot entries",
+            len(dirty),
+            len(evicted),
+        )
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                conn.executemany(
+                    "DELETE FROM PathInfo WHERE context = ? AND path = ?",
+                    ((self.context, p) for p in evicted),
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO PathInfo (context, path, narSize, "
+                    "registrationTime, refs, queryTimestamp) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    ((self.context, p, *entry) for p, entry in dirty.items()),
+                )
+        finally:
+            conn.close()
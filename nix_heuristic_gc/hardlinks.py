@@ -0,0 +1,101 @@
+from collections import Counter
+from threading import Lock
+from typing import Iterable, Union
+
+from nix_heuristic_gc.fs import SharedFileTuple
+
+
+class HardlinkIndex:
+    # tracks files hard linked between store paths, as done by
+    # nix-store --optimise, so that the space deleting a path would
+    # *actually* free can be determined. a shared file is only freed
+    # once all of its links have been deleted - except for its link in
+    # /nix/store/.links, which nix's garbage collector removes itself
+    # once it's the only one left. so for files with more than one link,
+    # one of them is assumed to be in .links.
+    #
+    # paths are registered as they are walked, and removed as they are
+    # chosen for deletion, at which point their links no longer count
+    # towards keeping files alive and what they would free is fixed.
+    #
+    # what several paths deleted together would free can also be
+    # measured, including files shared only between those paths.
+
+    def __init__(self):
+        self._lock = Lock()
+        # path: {(dev, ino): number of links to it in path}
+        self._paths = {}
+        # (dev, ino): [links remaining outside .links, size]. a file's
+        # entry is dropped once none remain, though registered paths may
+        # still link to it if it had more links than nlink suggested (e.g.
+        # no .links entry), in which case it's treated as unshared.
+        self._files = {}
+        # path: _shared result at the time path was removed
+        self._removed = {}
+
+    def add(self, path:str, shared_files:Iterable[SharedFileTuple]):
+        counts = Counter()
+        with self._lock:
+            if path in self._paths or path in self._removed:
+                return
+            for dev, ino, nlink, size in shared_files:
+                key = dev, ino
+                counts[key] += 1
+                if key not in self._files:
+                    self._files[key] = [nlink - 1, size]
+            self._paths[path] = dict(counts)
+
+    def remove(self, path:str):
+        shared = self._shared((path,))
+        with self._lock:
+            self._removed[path] = shared
+            for key, count in self._paths.pop(path, {}).items():
+                entry = self._files.get(key)
+                if entry is None:
+                    continue
+                entry[0] -= count
+                if entry[0] <= 0:
+                    del self._files[key]
+
+    def _shared(self, paths:Iterable[str]) -> tuple[int, int, int, int]:
+        # returns (bytes, links) of paths' shared files as counted by
+        # their walks, and (bytes, files) that deleting paths together
+        # would free
+        shared_bytes = shared_links = freed_bytes = freed_files = 0
+        counts = Counter()
+        with self._lock:
+            for path in paths:
+                removed = self._removed.get(path)
+                if removed is not None:
+                    shared_bytes += removed[0]
+                    shared_links += removed[1]
+                    freed_bytes += removed[2]
+                    freed_files += removed[3]
+                else:
+                    counts.update(self._paths.get(path, {}))
+            for key, count in counts.items():
+                entry = self._files.get(key)
+                if entry is None:
+                    continue
+                remaining, size = entry
+                shared_bytes += size * count
+                shared_links += count
+                if remaining <= count:
+                    freed_bytes += size
+                    freed_files += 1
+
+        return shared_bytes, shared_links, freed_bytes, freed_files
+
+    def marginal_size(self, paths:Union[str, Iterable[str]], size:int) -> int:
+        # the number of bytes deleting paths (or a single path), of total
+        # walked size, would free given the paths currently registered
+        if isinstance(paths, str):
+            paths = (paths,)
+        shared_bytes, _, freed_bytes, _ = self._shared(paths)
+        return max(0, size - shared_bytes) + freed_bytes
+
+    def marginal_inodes(self, paths:Union[str, Iterable[str]], inodes:int) -> int:
+        if isinstance(paths, str):
+            paths = (paths,)
+        _, shared_links, _, freed_files = self._shared(paths)
+        return max(0, inodes - shared_links) + freed_files
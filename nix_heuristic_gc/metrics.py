@@ -0,0 +1,145 @@
+import json
+import logging
+import os
+import resource
+import sys
+from collections import defaultdict
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile
+from threading import Lock, local
+from time import perf_counter, process_time
+from typing import Literal, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    # accumulates wall & (whole process) cpu time spent in named phases
+    # and named counters, all of which may be updated from any thread.
+    # phases of the same name are accumulated rather than replaced, so
+    # repeated runs in one process (e.g. in daemon mode) report totals.
+    #
+    # phases can either be delimited using the phase() context manager or,
+    # for long sequences of steps, begin_phase() which ends any phase
+    # previously begun by the same thread.
+
+    _PROMETHEUS_PREFIX = "nix_heuristic_gc"
+
+    def __init__(self):
+        self._lock = Lock()
+        # name: [wall_seconds, cpu_seconds, count]
+        self._phases = {}
+        self._counters = defaultdict(int)
+        self._current = local()
+
+    def _record_phase(self, name:str, wall_start:float, cpu_start:float):
+        wall, cpu = perf_counter() - wall_start, process_time() - cpu_start
+        with self._lock:
+            totals = self._phases.setdefault(name, [0.0, 0.0, 0])
+            totals[0] += wall
+            totals[1] += cpu
+            totals[2] += 1
+        logger.debug(
+            "phase %(name)s took %(wall).3fs (%(cpu).3fs cpu)",
+            {"name": name, "wall": wall, "cpu": cpu},
+        )
+
+    @contextmanager
+    def phase(self, name:str):
+        wall_start, cpu_start = perf_counter(), process_time()
+        try:
+            yield
+        finally:
+            self._record_phase(name, wall_start, cpu_start)
+
+    def begin_phase(self, name:str):
+        self.end_phase()
+        self._current.phase = name, perf_counter(), process_time()
+
+    def end_phase(self):
+        current = getattr(self._current, "phase", None)
+        if current is not None:
+            self._current.phase = None
+            self._record_phase(*current)
+
+    def count(self, name:str, n:int=1):
+        with self._lock:
+            self._counters[name] += n
+
+    @staticmethod
+    def peak_rss_bytes() -> int:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # reported in bytes on macos, kilobytes elsewhere
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "phases": {
+                    name: {
+                        "wall_seconds": wall,
+                        "cpu_seconds": cpu,
+                        "count": count,
+                    } for name, (wall, cpu, count) in self._phases.items()
+                },
+                "counters": dict(self._counters),
+                "peak_rss_bytes": self.peak_rss_bytes(),
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=2, sort_keys=True) + "\n"
+
+    def to_prometheus(self) -> str:
+        # in the text exposition format understood by node-exporter's
+        # textfile collector
+        d = self.as_dict()
+        p = self._PROMETHEUS_PREFIX
+        lines = []
+
+        for metric, key, help_text in (
+            ("phase_wall_seconds", "wall_seconds", "Wall time spent in each phase"),
+            ("phase_cpu_seconds", "cpu_seconds", "Process cpu time spent in each phase"),
+            ("phase_runs", "count", "Number of times each phase has run"),
+        ):
+            lines.append(f"# HELP {p}_{metric} {help_text}.")
+            lines.append(f"# TYPE {p}_{metric} gauge")
+            for name, phase in sorted(d["phases"].items()):
+                lines.append(f'{p}_{metric}{{phase="{name}"}} {phase[key]}')
+
+        for name, value in sorted(d["counters"].items()):
+            lines.append(f"# TYPE {p}_{name}_total counter")
+            lines.append(f"{p}_{name}_total {value}")
+
+        lines.append(f"# HELP {p}_peak_rss_bytes Peak resident set size.")
+        lines.append(f"# TYPE {p}_peak_rss_bytes gauge")
+        lines.append(f"{p}_peak_rss_bytes {d['peak_rss_bytes']}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(
+        self,
+        path:str,
+        fmt:Optional[Literal["json", "prometheus"]]=None,
+    ):
+        # fmt defaults to prometheus for paths ending .prom (as expected
+        # by node-exporter), json otherwise. written atomically so readers
+        # never see a partial file.
+        if fmt is None:
+            fmt = "prometheus" if path.endswith(".prom") else "json"
+
+        if fmt == "json":
+            content = self.to_json()
+        elif fmt == "prometheus":
+            content = self.to_prometheus()
+        else:
+            raise ValueError(f"Unknown metrics format {fmt!r}")
+
+        with NamedTemporaryFile(
+            "w",
+            dir=os.path.dirname(os.path.abspath(path)),
+            prefix=".metrics-",
+            delete=False,
+        ) as f:
+            f.write(content)
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, path)
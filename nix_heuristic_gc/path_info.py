@@ -0,0 +1,155 @@
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from os import cpu_count
+from typing import Iterable, Iterator, Optional
+
+import nix_heuristic_gc.libnixstore_wrapper as libstore
+
+logger = logging.getLogger(__name__)
+
+# beyond this, the store is likely to be the limit however many requests
+# are in flight
+_MAX_DEFAULT_QUERY_WINDOW = 32
+
+# path, nar_size, registration_time, references - nar_size and
+# registration_time being None for invalid paths
+PathInfoTuple = tuple[str, Optional[int], Optional[int], tuple[str, ...]]
+
+
+def _path_info_tuple(
+    store_path:libstore.StorePath,
+    path_info:Optional[libstore.ValidPathInfo],
+) -> PathInfoTuple:
+    if path_info is None:
+        return str(store_path), None, None, ()
+
+    return (
+        str(path_info.path),
+        path_info.nar_size,
+        path_info.registration_time,
+        tuple(str(ref_sp) for ref_sp in path_info.references),
+    )
+
+
+def default_query_window(store:libstore.Store) -> int:
+    window = min(cpu_count() or 1, _MAX_DEFAULT_QUERY_WINDOW)
+
+    # a daemon store only serves as many requests at once as it has
+    # connections, of which nix defaults to just one
+    max_connections = store.get_setting("max-connections")
+    if max_connections is not None and int(max_connections) < window:
+        logger.info(
+            "store max-connections of %(max_connections)s limits async path info "
+            "queries - consider raising it to %(window)s",
+            {"max_connections": max_connections, "window": window},
+        )
+
+    return window
+
+
+def query_path_infos_serial(
+    store:libstore.Store,
+    store_paths:Iterable[libstore.StorePath],
+) -> Iterator[PathInfoTuple]:
+    for store_path in store_paths:
+        try:
+            path_info = store.query_path_info(store_path)
+        except RuntimeError:
+            path_info = None
+
+        yield _path_info_tuple(store_path, path_info)
+
+
+def _batched(iterable:Iterable, n:int) -> Iterator[list]:
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, n))
+        if not batch:
+            return
+        yield batch
+
+
+def query_path_infos_batched(
+    store:libstore.Store,
+    store_paths:Iterable[libstore.StorePath],
+    batch_size:int,
+    executor:Executor,
+) -> Iterator[PathInfoTuple]:
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+
+    # each batch releases the GIL for its entire duration, so a threaded
+    # executor is able to have as many batches in flight as it has threads
+    for (
+        paths,
+        nar_sizes,
+        registration_times,
+        reference_offsets,
+        references,
+    ) in executor.map(store.query_path_infos, _batched(store_paths, batch_size)):
+        for i, path in enumerate(paths):
+            yield (
+                path,
+                nar_sizes[i],
+                registration_times[i],
+                tuple(references[reference_offsets[i]:reference_offsets[i+1]]),
+            )
+
+
+def query_path_infos_async(
+    store:libstore.Store,
+    store_paths:Iterable[libstore.StorePath],
+    window:int,
+) -> Iterator[PathInfoTuple]:
+    if window < 1:
+        raise ValueError("window must be at least 1")
+
+    loop = asyncio.new_event_loop()
+    # for most stores query_path_info_async blocks for the duration of
+    # the request before resolving its future, so requests are issued
+    # from a pool of threads - the threads continuing to make progress
+    # while the consumer is busy with results we've already yielded
+    pool = ThreadPoolExecutor(max_workers=window)
+    in_flight = deque()
+
+    async def query(store_path):
+        try:
+            path_info_future = await loop.run_in_executor(
+                pool,
+                partial(store.query_path_info_async, store_path, loop=loop),
+            )
+            path_info = await path_info_future
+        except RuntimeError:
+            path_info = None
+
+        return _path_info_tuple(store_path, path_info)
+
+    try:
+        store_paths_iter = iter(store_paths)
+        in_flight.extend(
+            loop.create_task(query(store_path))
+            for store_path in islice(store_paths_iter, window)
+        )
+        while in_flight:
+            # yield results strictly in request order so that consumers
+            # behave identically to the serial case
+            path_info_tuple = loop.run_until_complete(in_flight.popleft())
+            in_flight.extend(
+                loop.create_task(query(store_path))
+                for store_path in islice(store_paths_iter, 1)
+            )
+            yield path_info_tuple
+    finally:
+        # we may be getting closed early
+        for task in in_flight:
+            task.cancel()
+        if in_flight:
+            loop.run_until_complete(
+                asyncio.gather(*in_flight, return_exceptions=True),
+            )
+        pool.shutdown(cancel_futures=True)
+        loop.close()
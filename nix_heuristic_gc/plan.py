@@ -0,0 +1,142 @@
+import csv
+import json
+import sys
+from collections import deque
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass, field, fields
+from typing import Iterable, Literal, Optional
+
+from nix_heuristic_gc.graph import GarbageGraph
+
+
+@dataclass(slots=True)
+class CurvePoint:
+    path: str
+    # cumulative totals including this path
+    paths: int
+    bytes: int
+    # None from the first path that hadn't been walked, e.g. when using
+    # a recency source, as walking paths just to report this isn't worth it
+    inodes: Optional[int]
+    score: float
+    max_atime: float
+    # newest max_atime of any path removed so far
+    atime_boundary: float
+
+
+@dataclass(slots=True)
+class ReclaimPlan:
+    curve: list[CurvePoint] = field(default_factory=list)
+    # limit: point at which it was reached. limits that weren't reached
+    # before running out of candidates are absent.
+    thresholds: dict[int, CurvePoint] = field(default_factory=dict)
+    limits: list[int] = field(default_factory=list)
+
+
+def plan_reclaim(
+    garbage_graph:GarbageGraph,
+    limits:Iterable[int],
+    batch_size:int=1,
+) -> ReclaimPlan:
+    # performs the selection remove_to_limit would for the largest of
+    # limits, recording the cumulative effect of each removal along the
+    # way and where each of the smaller limits would have been reached.
+    # this consumes garbage_graph.
+    #
+    # the thresholds for smaller limits exactly match what
+    # remove_to_limit would choose for them, except when using
+    # penalize_exceeding_limit or a batch_size above 1, both of which
+    # make choices dependent on the limit.
+    limits = sorted(set(limits))
+    if not limits:
+        raise ValueError("At least one limit is required")
+
+    plan = ReclaimPlan(limits=limits)
+    pending_limits = deque(limits)
+    bytes_ = inodes = limit_removed = 0
+    atime_boundary = None
+
+    for paths, (spn, score) in enumerate(
+        garbage_graph.iter_remove_to_limit(
+            limits[-1],
+            batch_size=batch_size,
+            with_scores=True,
+        ),
+        start=1,
+    ):
+        max_atime = spn.max_atime or 0
+        atime_boundary = max_atime if atime_boundary is None else max(atime_boundary, max_atime)
+        bytes_ += spn.freed_size
+        if inodes is not None:
+            inodes = None if spn._inodes is None else inodes + spn.freed_inodes
+        limit_removed += spn.limit_measurement
+
+        point = CurvePoint(
+            path=spn.path,
+            paths=paths,
+            bytes=bytes_,
+            inodes=inodes,
+            score=score,
+            max_atime=max_atime,
+            atime_boundary=atime_boundary,
+        )
+        plan.curve.append(point)
+        while pending_limits and limit_removed >= pending_limits[0]:
+            plan.thresholds[pending_limits.popleft()] = point
+
+    return plan
+
+
+def plan_as_dict(plan:ReclaimPlan) -> dict:
+    thresholds = []
+    for limit in plan.limits:
+        # unreached limits report the most that could be reclaimed
+        point = plan.thresholds.get(limit) or (plan.curve[-1] if plan.curve else None)
+        thresholds.append({
+            "limit": limit,
+            "reached": limit in plan.thresholds,
+            **(asdict(point) if point is not None else {}),
+        })
+
+    return {
+        "thresholds": thresholds,
+        "curve": [asdict(point) for point in plan.curve],
+    }
+
+
+def _write_csv(plan:ReclaimPlan, f):
+    # the curve, with each point at which limits are reached marked
+    thresholds_at = {}
+    for limit, point in plan.thresholds.items():
+        thresholds_at.setdefault(id(point), []).append(str(limit))
+
+    writer = csv.writer(f)
+    field_names = [fld.name for fld in fields(CurvePoint)]
+    writer.writerow([*field_names, "thresholds"])
+    for point in plan.curve:
+        writer.writerow([
+            *(getattr(point, name) for name in field_names),
+            " ".join(thresholds_at.get(id(point), ())),
+        ])
+
+
+def write_plan(
+    plan:ReclaimPlan,
+    path:str="-",
+    fmt:Optional[Literal["json", "csv"]]=None,
+):
+    # path "-" writes to stdout. fmt defaults to csv for paths ending
+    # .csv, json otherwise.
+    if fmt is None:
+        fmt = "csv" if path.endswith(".csv") else "json"
+    if fmt not in ("json", "csv"):
+        raise ValueError(f"Unknown plan format {fmt!r}")
+
+    with (
+        nullcontext(sys.stdout) if path == "-" else open(path, "w", newline="")
+    ) as f:
+        if fmt == "csv":
+            _write_csv(plan, f)
+        else:
+            json.dump(plan_as_dict(plan), f, indent=2)
+            f.write("\n")
@@ -0,0 +1,116 @@
+import logging
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StatPrefetcher:
+    # speculatively performs (filesystem stat) work that is expected to be
+    # needed soon in a pool of max_workers background threads, so that by
+    # the time it is needed the result is (hopefully) already available.
+    #
+    # at most max_pending results, finished or not, are held at once - if
+    # more are requested the oldest are discarded to make room. results
+    # are keyed by an arbitrary hashable key, and should be claimed using
+    # take(). lookahead is a hint to users of how many of their most likely
+    # candidates to request work for. may be used from multiple threads.
+
+    def __init__(
+        self,
+        max_workers:int=4,
+        lookahead:int=16,
+        max_pending:int=1024,
+    ):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        if max_pending < 1:
+            raise ValueError("max_pending must be at least 1")
+
+        self.lookahead = lookahead
+        self.max_pending = max_pending
+
+        # results that were ready when claimed
+        self.hits = 0
+        # results that had to be waited for when claimed
+        self.waits = 0
+        # requested results that had not been prefetched
+        self.misses = 0
+        # prefetched results that were discarded before being claimed
+        self.discarded = 0
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="stat-prefetch",
+        )
+        # guards _pending and the counters above
+        self._lock = Lock()
+        # relies on dict ordering to find the oldest
+        self._pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            self._pending.clear()
+        logger.debug(
+            "stat prefetch hits: %(hits)s, waits: %(waits)s, misses: "
+            "%(misses)s, discarded: %(discarded)s, hit rate: %(hit_rate).3f",
+            {
+                "hits": self.hits,
+                "waits": self.waits,
+                "misses": self.misses,
+                "discarded": self.discarded,
+                "hit_rate": self.hit_rate,
+            },
+        )
+
+    @property
+    def hit_rate(self) -> float:
+        claimed = self.hits + self.waits + self.misses
+        return self.hits / claimed if claimed else 0.0
+
+    def __contains__(self, key:Hashable) -> bool:
+        with self._lock:
+            return key in self._pending
+
+    def prefetch(self, key:Hashable, func:Callable, *args):
+        with self._lock:
+            if key in self._pending:
+                return
+
+            while len(self._pending) >= self.max_pending:
+                oldest_key = next(iter(self._pending))
+                self._pending.pop(oldest_key).cancel()
+                self.discarded += 1
+
+            self._pending[key] = self._executor.submit(func, *args)
+
+    def take(self, key:Hashable) -> Optional[Any]:
+        # returns the result of the prefetch for key, waiting for it if
+        # necessary, or None if there is none. any exception raised by the
+        # prefetch is re-raised.
+        with self._lock:
+            future = self._pending.pop(key, None)
+            if future is None:
+                self.misses += 1
+                return None
+
+            if future.done():
+                self.hits += 1
+            else:
+                self.waits += 1
+
+        # not waited for under the lock, so other threads can carry on
+        # prefetching meanwhile
+        try:
+            return future.result()
+        except CancelledError:
+            # lost a race with shutdown
+            return None
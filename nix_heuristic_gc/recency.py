@@ -0,0 +1,184 @@
+import logging
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from os.path import basename
+from threading import Lock
+from time import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RecencySource(ABC):
+    # a source of the time each store path was last used, as an
+    # alternative to walking paths for their files' atimes. last_used
+    # returns None for paths it knows nothing about.
+
+    @abstractmethod
+    def last_used(self, path:str) -> Optional[float]:
+        pass
+
+
+def record_access(log_path:str, path:str, when:Optional[float]=None):
+    # appends an entry to an access log, e.g. from a wrapper around
+    # program execution. each entry is written with a single O_APPEND
+    # write, so many processes can safely record to the same log.
+    line = f"{time() if when is None else when:.0f} {path}\n".encode()
+    fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+class AccessLogIndex(RecencySource):
+    # the last time each store path was used according to an append-only
+    # access log, a file of lines "<unix timestamp> <path>", where path
+    # may be a store path or any file within one, and needn't be
+    # normalized. paths outside store_dir are ignored.
+    #
+    # the log is aggregated into a per-path index persisted in db_path
+    # along with how much of the log has been consumed, so each update
+    # only needs to read entries appended since. a log that has been
+    # replaced or truncated (e.g. rotated) is read from the start again.
+
+    _SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS LastUsed (
+            path     TEXT PRIMARY KEY NOT NULL,
+            lastUsed REAL NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS LogPosition (
+            logPath TEXT PRIMARY KEY NOT NULL,
+            inode   INTEGER NOT NULL,
+            offset  INTEGER NOT NULL
+        )
+        """,
+    )
+
+    def __init__(
+        self,
+        db_path:str,
+        log_path:str,
+        store_dir:str,
+    ):
+        self.db_path = db_path
+        self.log_path = os.path.abspath(log_path)
+        self.store_dir = store_dir.rstrip("/") + "/"
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = Lock()
+        self._dirty = set()
+
+        conn = sqlite3.connect(db_path)
+        try:
+            for schema in self._SCHEMA:
+                conn.execute(schema)
+            self._last_used = dict(conn.execute("SELECT path, lastUsed FROM LastUsed"))
+            self._log_inode, self._log_offset = conn.execute(
+                "SELECT inode, offset FROM LogPosition WHERE logPath = ?",
+                (self.log_path,),
+            ).fetchone() or (None, 0)
+            conn.commit()
+        finally:
+            conn.close()
+
+        logger.debug("loaded %s access log index entries from %s", len(self._last_used), db_path)
+        self.update()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.save()
+        logger.debug(
+            "access log index hits: %(hits)s, misses: %(misses)s",
+            {"hits": self.hits, "misses": self.misses},
+        )
+
+    def _store_path_name(self, path:str) -> Optional[str]:
+        if path.startswith(self.store_dir):
+            path = path[len(self.store_dir):]
+        elif path.startswith("/"):
+            return None
+        return path.partition("/")[0] or None
+
+    def update(self):
+        # reads any entries appended to the log since the last update
+        try:
+            with open(self.log_path, "rb") as f:
+                count = self._read_log(f)
+        except FileNotFoundError:
+            logger.debug("access log %s doesn't exist (yet)", self.log_path)
+            return
+
+        logger.debug("read %s new access log entries", count)
+
+    def _read_log(self, f) -> int:
+        # returns the number of entries read
+        st = os.fstat(f.fileno())
+        with self._lock:
+            if st.st_ino != self._log_inode or st.st_size < self._log_offset:
+                logger.info("access log %s has been replaced, reading from start", self.log_path)
+                self._log_inode, self._log_offset = st.st_ino, 0
+
+            f.seek(self._log_offset)
+            data = f.read()
+            # a partially written final line is left for next time
+            data = data[:data.rfind(b"\n") + 1]
+
+            count = 0
+            for line in data.splitlines():
+                timestamp, _, path = line.decode(errors="replace").partition(" ")
+                try:
+                    timestamp = float(timestamp)
+                except ValueError:
+                    continue
+                name = self._store_path_name(path.strip())
+                if name is None:
+                    continue
+                if timestamp > self._last_used.get(name, float("-inf")):
+                    self._last_used[name] = timestamp
+                    self._dirty.add(name)
+                count += 1
+
+            self._log_offset += len(data)
+
+        return count
+
+    def last_used(self, path:str) -> Optional[float]:
+        with self._lock:
+            last_used = self._last_used.get(basename(path))
+            if last_used is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return last_used
+
+    def save(self):
+        with self._lock:
+            dirty = {p: self._last_used[p] for p in self._dirty}
+            self._dirty.clear()
+            log_inode, log_offset = self._log_inode, self._log_offset
+
+        logger.debug("saving %s updated access log index entries", len(dirty))
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO LastUsed (path, lastUsed) VALUES (?, ?)",
+                    dirty.items(),
+                )
+                if log_inode is not None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO LogPosition (logPath, inode, offset) "
+                        "VALUES (?, ?, ?)",
+                        (self.log_path, log_inode, log_offset),
+                    )
+        finally:
+            conn.close()
@@ -0,0 +1,195 @@
+import logging
+import sqlite3
+from os.path import join as path_join
+from os.path import lexists
+from threading import Lock
+from time import time
+from typing import Iterable
+
+from nix_heuristic_gc.fs import (
+    AggStatTuple,
+    path_stat_agg_hot_files,
+    refresh_max_atime,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class StatCache:
+    # a store path's contents are immutable, so its inode count & size
+    # never change once registered and only need walking once. the max
+    # atime however does change, so between full walks (at most max_age
+    # seconds apart) it is refreshed by stat-ing only the handful of files
+    # found to be the most recently accessed last time the path was walked.
+    #
+    # entries are keyed by (path, registration_time) so that a path which
+    # has been deleted and re-registered since isn't mistaken for the old
+    # one.
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS StatAgg (
+            path             TEXT PRIMARY KEY NOT NULL,
+            registrationTime INTEGER NOT NULL,
+            inodes           INTEGER NOT NULL,
+            fsSize           INTEGER NOT NULL,
+            maxAtime         REAL NOT NULL,
+            walkTimestamp    REAL NOT NULL,
+            hotFiles         TEXT NOT NULL
+        )
+    """
+
+    def __init__(
+        self,
+        db_path:str,
+        store_dir:str,
+        max_age:float=86400,
+        hot_count:int=8,
+    ):
+        self.db_path = db_path
+        self.store_dir = store_dir
+        self.max_age = max_age
+        self.hot_count = hot_count
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = Lock()
+        self._dirty = set()
+        self._evicted = set()
+
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute(self._SCHEMA)
+            # path: (registration_time, inodes, fs_size, max_atime, walk_timestamp, hot_files)
+            self._entries = {
+                path: (registration_time, inodes, fs_size, max_atime, walk_timestamp, hot_files)
+                for (
+                    path,
+                    registration_time,
+                    inodes,
+                    fs_size,
+                    max_atime,
+                    walk_timestamp,
+                    hot_files,
+                ) in conn.execute(
+                    "SELECT path, registrationTime, inodes, fsSize, maxAtime, "
+                    "walkTimestamp, hotFiles FROM StatAgg",
+                )
+            }
+            conn.commit()
+        finally:
+            conn.close()
+
+        logger.debug("loaded %s stat cache entries from %s", len(self._entries), db_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.save()
+        logger.debug(
+            "stat cache hits: %(hits)s, misses: %(misses)s",
+            {"hits": self.hits, "misses": self.misses},
+        )
+
+    def _fresh_entry(self, path:str, registration_time:int):
+        with self._lock:
+            entry = self._entries.get(path)
+
+        if (
+            entry is not None
+            and entry[0] == registration_time
+            and time() - entry[4] < self.max_age
+        ):
+            return entry
+
+        return None
+
+    def is_fresh(self, path:str, registration_time:int) -> bool:
+        return self._fresh_entry(path, registration_time) is not None
+
+    def put(
+        self,
+        path:str,
+        registration_time:int,
+        stat_agg:AggStatTuple,
+        hot_files:list[str],
+    ):
+        max_atime, inodes, fs_size = stat_agg
+        with self._lock:
+            self.misses += 1
+            self._entries[path] = (
+                registration_time,
+                inodes,
+                fs_size,
+                max_atime,
+                time(),
+                "\0".join(hot_files),
+            )
+            self._dirty.add(path)
+            self._evicted.discard(path)
+
+    def path_stat_agg(self, path:str, registration_time:int) -> AggStatTuple:
+        full_path = path_join(self.store_dir, path)
+
+        entry = self._fresh_entry(path, registration_time)
+        if entry is not None:
+            _, inodes, fs_size, max_atime, _, hot_files = entry
+            with self._lock:
+                self.hits += 1
+            max_atime = refresh_max_atime(
+                full_path,
+                max_atime,
+                hot_files.split("\0") if hot_files else [],
+            )
+            return max_atime, inodes, fs_size
+
+        stat_agg, hot_files = path_stat_agg_hot_files(full_path, self.hot_count)
+        self.put(path, registration_time, stat_agg, hot_files)
+        return stat_agg
+
+    def evict(self, paths:Iterable[str]):
+        with self._lock:
+            for path in paths:
+                if self._entries.pop(path, None) is not None:
+                    self._evicted.add(path)
+                self._dirty.discard(path)
+
+    def prune(self, known_present:Iterable[str]=()):
+        # evict entries for paths which no longer exist in the store.
+        # paths in known_present needn't be checked
+        known_present = frozenset(known_present)
+        with self._lock:
+            candidates = [p for p in self._entries if p not in known_present]
+
+        self.evict(
+            p for p in candidates if not lexists(path_join(self.store_dir, p))
+        )
+
+    def save(self):
+        with self._lock:
+            dirty = {p: self._entries[p] for p in self._dirty}
+            evicted = list(self._evicted)
+            self._dirty.clear()
+            self._evicted.clear()
+
+        logger.debug(
+            "saving %s updated and %s evicted stat cache entries",
+            len(dirty),
+            len(evicted),
+        )
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                conn.executemany(
+                    "DELETE FROM StatAgg WHERE path = ?",
+                    ((p,) for p in evicted),
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO StatAgg (path, registrationTime, "
+                    "inodes, fsSize, maxAtime, walkTimestamp, hotFiles) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    ((p, *entry) for p, entry in dirty.items()),
+                )
+        finally:
+            conn.close()
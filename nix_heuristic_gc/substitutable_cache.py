@@ -0,0 +1,143 @@
+import logging
+import sqlite3
+from threading import Lock
+from time import time
+from typing import Callable, Iterable
+
+import nix_heuristic_gc.libnixstore_wrapper as libstore
+
+logger = logging.getLogger(__name__)
+
+
+class SubstitutableCache:
+    # whether a store path is available from a binary cache is slow to
+    # find out but changes only rarely, so answers are remembered for up
+    # to ttl seconds.
+    #
+    # answers depend on which substituters are being asked, so entries
+    # are also keyed by a caller-supplied context string (e.g. the store
+    # URI) - answers given in one context aren't used in another. changes
+    # to the substituter configuration itself aren't noticed until the
+    # affected entries expire.
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS Substitutable (
+            context        TEXT NOT NULL,
+            path           TEXT NOT NULL,
+            substitutable  INTEGER NOT NULL,
+            queryTimestamp REAL NOT NULL,
+            PRIMARY KEY (context, path)
+        )
+    """
+
+    def __init__(
+        self,
+        db_path:str,
+        context:str="",
+        ttl:float=86400,
+    ):
+        self.db_path = db_path
+        self.context = context
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = Lock()
+        self._dirty = set()
+
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute(self._SCHEMA)
+            # expired entries are of no use to anyone
+            conn.execute(
+                "DELETE FROM Substitutable WHERE queryTimestamp < ?",
+                (time() - ttl,),
+            )
+            # path: (substitutable, query_timestamp)
+            self._entries = {
+                path: (bool(substitutable), query_timestamp)
+                for path, substitutable, query_timestamp in conn.execute(
+                    "SELECT path, substitutable, queryTimestamp FROM Substitutable "
+                    "WHERE context = ?",
+                    (context,),
+                )
+            }
+            conn.commit()
+        finally:
+            conn.close()
+
+        logger.debug(
+            "loaded %s substitutable cache entries from %s",
+            len(self._entries),
+            db_path,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.save()
+        logger.debug(
+            "substitutable cache hits: %(hits)s, misses: %(misses)s",
+            {"hits": self.hits, "misses": self.misses},
+        )
+
+    def query_substitutable_paths(
+        self,
+        store_paths:set[libstore.StorePath],
+        query_func:Callable[[set[libstore.StorePath]], set[libstore.StorePath]],
+    ) -> set[libstore.StorePath]:
+        # returns the members of store_paths which are substitutable,
+        # using query_func (e.g. Store.query_substitutable_paths) to ask
+        # about any which aren't freshly cached
+        now = time()
+        substitutable_paths = set()
+        to_query = set()
+        with self._lock:
+            for store_path in store_paths:
+                entry = self._entries.get(str(store_path))
+                if entry is not None and now - entry[1] < self.ttl:
+                    if entry[0]:
+                        substitutable_paths.add(store_path)
+                else:
+                    to_query.add(store_path)
+            self.hits += len(store_paths) - len(to_query)
+            self.misses += len(to_query)
+
+        if to_query:
+            queried_substitutable_paths = query_func(to_query)
+            substitutable_paths |= queried_substitutable_paths
+            self.put(
+                (str(store_path), store_path in queried_substitutable_paths)
+                for store_path in to_query
+            )
+
+        return substitutable_paths
+
+    def put(self, answers:Iterable[tuple[str, bool]]):
+        now = time()
+        with self._lock:
+            for path, substitutable in answers:
+                self._entries[path] = (substitutable, now)
+                self._dirty.add(path)
+
+    def save(self):
+        with self._lock:
+            dirty = {p: self._entries[p] for p in self._dirty}
+            self._dirty.clear()
+
+        logger.debug("saving %s updated substitutable cache entries", len(dirty))
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO Substitutable (context, path, "
+                    "substitutable, queryTimestamp) VALUES (?, ?, ?, ?)",
+                    (
+                        (self.context, p, int(substitutable), query_timestamp)
+                        for p, (substitutable, query_timestamp) in dirty.items()
+                    ),
+                )
+        finally:
+            conn.close()
@@ -47,6 +47,11 @@ setup(
     long_description="",
     packages=["nix_heuristic_gc"],
     ext_modules=ext_modules,
+    install_requires=[
+        "humanfriendly",
+        "numpy",
+        "rustworkx",
+    ],
     extras_require={},
     cmdclass={"build_ext": build_ext},
     entry_points={
@@ -1,6 +1,23 @@
+#include <dirent.h>
+#include <fcntl.h>
 #include <signal.h>
+#include <sys/stat.h>
+#include <sys/sysmacros.h>
+#include <unistd.h>
 
+#include <algorithm>
+#include <cerrno>
+#include <cstring>
+#include <functional>
+#include <memory>
+#include <iterator>
+#include <optional>
+#include <random>
+#include <string>
 #include <system_error>
+#include <tuple>
+#include <utility>
+#include <vector>
 
 #include <pybind11/operators.h>
 #include <pybind11/pybind11.h>
@@ -33,7 +50,483 @@
 #define STRINGIFY(x) #x
 #define MACRO_STRINGIFY(x) STRINGIFY(x)
 
+namespace py = pybind11;
+
 namespace nhgc {
+    // a handle to a python object that may be copied and destroyed from
+    // threads that don't hold the GIL, acquiring it only to finally release
+    // the object
+    class GilSafeObject {
+        std::shared_ptr<py::object> obj;
+
+    public:
+        explicit GilSafeObject(py::object o) : obj(
+            new py::object(std::move(o)),
+            [](py::object* p){
+                py::gil_scoped_acquire acquire;
+                delete p;
+            }
+        ) {}
+
+        py::object& operator*() const {
+            return *obj;
+        }
+    };
+
+    // an error encountered while walking a directory tree, to be converted
+    // to a python OSError once we hold the GIL again
+    struct WalkError {
+        int err;
+        std::string path;
+    };
+
+    struct StatAgg {
+        double max_atime = 0;
+        uint64_t inodes = 1;
+        uint64_t size = 0;
+    };
+
+    // identifies the inode of a file and how many links it has
+    struct FileLinks {
+        uint64_t dev;
+        uint64_t ino;
+        uint64_t nlink;
+    };
+
+    // (dev, ino, nlink, size) of a file with more than one link, e.g. as a
+    // result of nix-store --optimise, for nix_heuristic_gc.hardlinks
+    using SharedFile = std::tuple<uint64_t, uint64_t, uint64_t, uint64_t>;
+
+    // the hot_count most recently accessed files of a walk, for
+    // nix_heuristic_gc.stat_cache
+    class HotFiles {
+        size_t count;
+        // length of the walked path, so paths can be made relative to it
+        size_t root_len;
+        // a min-heap of (atime, relative path)
+        std::vector<std::pair<double, std::string>> heap;
+
+    public:
+        HotFiles(size_t count, size_t root_len) : count(count), root_len(root_len) {}
+
+        void offer(double atime, const std::string& dir_path, const char* name) {
+            if (heap.size() >= count && (!count || atime <= heap.front().first)) {
+                return;
+            }
+
+            std::string rel_path = dir_path.size() > root_len
+                ? dir_path.substr(root_len + 1) + "/" + name
+                : std::string(name);
+            if (heap.size() >= count) {
+                std::pop_heap(heap.begin(), heap.end(), std::greater<>());
+                heap.back() = {atime, std::move(rel_path)};
+            } else {
+                heap.emplace_back(atime, std::move(rel_path));
+            }
+            std::push_heap(heap.begin(), heap.end(), std::greater<>());
+        }
+
+        // most recently accessed first
+        std::vector<std::string> take_sorted() {
+            std::sort(heap.begin(), heap.end(), std::greater<>());
+            std::vector<std::string> rel_paths;
+            rel_paths.reserve(heap.size());
+            for (auto& [_, rel_path] : heap) {
+                rel_paths.push_back(std::move(rel_path));
+            }
+            heap.clear();
+            return rel_paths;
+        }
+    };
+
+    struct DirCloser {
+        void operator()(DIR* dir) const {
+            closedir(dir);
+        }
+    };
+
+    struct FdGuard {
+        int fd;
+
+        ~FdGuard() {
+            close(fd);
+        }
+    };
+
+    inline bool is_permission_error(int err) {
+        // the errnos python maps to PermissionError
+        return err == EACCES || err == EPERM;
+    }
+
+    // lstat name relative to dirfd, only requesting the fields we need -
+    // links only being filled if given. returns an errno value, 0 on
+    // success
+    inline int stat_at(
+        int dirfd,
+        const char* name,
+        bool& is_dir,
+        double& atime,
+        uint64_t& size,
+        FileLinks* links = nullptr
+    ) {
+#ifdef __linux__
+        struct statx stx;
+        if (statx(
+            dirfd,
+            name,
+            AT_SYMLINK_NOFOLLOW | AT_NO_AUTOMOUNT,
+            STATX_TYPE | STATX_ATIME | STATX_SIZE | (links ? STATX_INO | STATX_NLINK : 0),
+            &stx
+        )) {
+            return errno;
+        }
+        is_dir = S_ISDIR(stx.stx_mode);
+        // calculated the same way as python's st_atime
+        atime = static_cast<double>(stx.stx_atime.tv_sec) + stx.stx_atime.tv_nsec * 1e-9;
+        size = stx.stx_size;
+        if (links) {
+            // as python's st_dev
+            links->dev = makedev(stx.stx_dev_major, stx.stx_dev_minor);
+            links->ino = stx.stx_ino;
+            links->nlink = stx.stx_nlink;
+        }
+#else
+        struct stat st;
+        if (fstatat(dirfd, name, &st, AT_SYMLINK_NOFOLLOW)) {
+            return errno;
+        }
+        is_dir = S_ISDIR(st.st_mode);
+#ifdef __APPLE__
+        atime = static_cast<double>(st.st_atimespec.tv_sec) + st.st_atimespec.tv_nsec * 1e-9;
+#else
+        atime = static_cast<double>(st.st_atim.tv_sec) + st.st_atim.tv_nsec * 1e-9;
+#endif
+        size = st.st_size;
+        if (links) {
+            links->dev = st.st_dev;
+            links->ino = st.st_ino;
+            links->nlink = st.st_nlink;
+        }
+#endif
+        return 0;
+    }
+
+    // a native equivalent of nix_heuristic_gc.fs.dir_stat_agg, which must
+    // keep its semantics. if hot is given, files are additionally offered
+    // to it, and if shared is given, files with more than one link are
+    // additionally appended to it.
+    StatAgg dir_stat_agg(
+        int parent_fd,
+        const char* name,
+        const std::string& path,
+        HotFiles* hot = nullptr,
+        std::vector<SharedFile>* shared = nullptr
+    ) {
+        StatAgg agg;
+
+        int fd = openat(parent_fd, name, O_RDONLY | O_DIRECTORY | O_NOFOLLOW | O_CLOEXEC);
+        if (fd < 0) {
+            if (is_permission_error(errno)) {
+                return agg;
+            }
+            throw WalkError{errno, path};
+        }
+        DIR* dir = fdopendir(fd);
+        if (!dir) {
+            int err = errno;
+            close(fd);
+            throw WalkError{err, path};
+        }
+        std::unique_ptr<DIR, DirCloser> dir_guard(dir);
+
+        while (true) {
+            errno = 0;
+            struct dirent* entry = readdir(dir);
+            if (!entry) {
+                if (errno) {
+                    throw WalkError{errno, path};
+                }
+                break;
+            }
+            if (!strcmp(entry->d_name, ".") || !strcmp(entry->d_name, "..")) {
+                continue;
+            }
+
+            bool is_dir = entry->d_type == DT_DIR;
+            bool have_stat = false;
+            double atime = 0;
+            uint64_t size = 0;
+            FileLinks links;
+            FileLinks* maybe_links = shared ? &links : nullptr;
+
+            if (entry->d_type == DT_UNKNOWN) {
+                if (int err = stat_at(fd, entry->d_name, is_dir, atime, size, maybe_links)) {
+                    if (!is_permission_error(err)) {
+                        throw WalkError{err, path + "/" + entry->d_name};
+                    }
+                    agg.inodes += 1;
+                    continue;
+                }
+                have_stat = true;
+            }
+
+            if (is_dir) {
+                // we are not interested in the atime of directories
+                // themselves because we ourselves affect them by
+                // walking them
+                auto sub_agg = dir_stat_agg(fd, entry->d_name, path + "/" + entry->d_name, hot, shared);
+                agg.max_atime = std::max(agg.max_atime, sub_agg.max_atime);
+                agg.inodes += sub_agg.inodes;
+                agg.size += sub_agg.size;
+                continue;
+            }
+
+            if (!have_stat) {
+                if (int err = stat_at(fd, entry->d_name, is_dir, atime, size, maybe_links)) {
+                    if (!is_permission_error(err)) {
+                        throw WalkError{err, path + "/" + entry->d_name};
+                    }
+                    agg.inodes += 1;
+                    continue;
+                }
+            }
+            agg.max_atime = std::max(agg.max_atime, atime);
+            agg.inodes += 1;
+            agg.size += size;
+            if (hot) {
+                hot->offer(atime, path, entry->d_name);
+            }
+            if (shared && links.nlink > 1) {
+                shared->emplace_back(links.dev, links.ino, links.nlink, size);
+            }
+        }
+
+        return agg;
+    }
+
+    StatAgg path_stat_agg(
+        const std::string& path,
+        HotFiles* hot = nullptr,
+        std::vector<SharedFile>* shared = nullptr
+    ) {
+        StatAgg agg;
+        bool is_dir;
+        FileLinks links;
+
+        if (int err = stat_at(
+            AT_FDCWD,
+            path.c_str(),
+            is_dir,
+            agg.max_atime,
+            agg.size,
+            shared ? &links : nullptr
+        )) {
+            if (is_permission_error(err)) {
+                return StatAgg{};
+            }
+            throw WalkError{err, path};
+        }
+
+        if (is_dir) {
+            return dir_stat_agg(AT_FDCWD, path.c_str(), path, hot, shared);
+        }
+
+        if (hot) {
+            hot->offer(agg.max_atime, path, ".");
+        }
+        if (shared && links.nlink > 1) {
+            shared->emplace_back(links.dev, links.ino, links.nlink, agg.size);
+        }
+        return agg;
+    }
+
+    // the (non-directory) files of a directory
+    struct DirFiles {
+        std::string path;
+        std::vector<std::string> names;
+    };
+
+    // lists the directory tree below name as dir_stat_agg would walk it,
+    // but without stat-ing files where it can be avoided, appending the
+    // files of each directory to dirs_files. returns the number of inodes
+    // found, which is exact.
+    uint64_t list_dir_files(
+        int parent_fd,
+        const char* name,
+        const std::string& path,
+        std::vector<DirFiles>& dirs_files
+    ) {
+        uint64_t inodes = 1;
+
+        int fd = openat(parent_fd, name, O_RDONLY | O_DIRECTORY | O_NOFOLLOW | O_CLOEXEC);
+        if (fd < 0) {
+            if (is_permission_error(errno)) {
+                return inodes;
+            }
+            throw WalkError{errno, path};
+        }
+        DIR* dir = fdopendir(fd);
+        if (!dir) {
+            int err = errno;
+            close(fd);
+            throw WalkError{err, path};
+        }
+        std::unique_ptr<DIR, DirCloser> dir_guard(dir);
+
+        DirFiles files{path, {}};
+        while (true) {
+            errno = 0;
+            struct dirent* entry = readdir(dir);
+            if (!entry) {
+                if (errno) {
+                    throw WalkError{errno, path};
+                }
+                break;
+            }
+            if (!strcmp(entry->d_name, ".") || !strcmp(entry->d_name, "..")) {
+                continue;
+            }
+
+            inodes += 1;
+            bool is_dir = entry->d_type == DT_DIR;
+            if (entry->d_type == DT_UNKNOWN) {
+                double atime;
+                uint64_t size;
+                if (int err = stat_at(fd, entry->d_name, is_dir, atime, size)) {
+                    if (!is_permission_error(err)) {
+                        throw WalkError{err, path + "/" + entry->d_name};
+                    }
+                    continue;
+                }
+            }
+
+            if (is_dir) {
+                // the directory itself was counted above
+                inodes += list_dir_files(fd, entry->d_name, path + "/" + entry->d_name, dirs_files) - 1;
+            } else {
+                files.names.emplace_back(entry->d_name);
+            }
+        }
+
+        if (!files.names.empty()) {
+            dirs_files.push_back(std::move(files));
+        }
+        return inodes;
+    }
+
+    // a stable seed for sampling path, so repeated walks choose the same
+    // sample (64-bit FNV-1a)
+    inline uint64_t path_seed(const std::string& path) {
+        uint64_t hash = 14695981039346656037ULL;
+        for (unsigned char c : path) {
+            hash = (hash ^ c) * 1099511628211ULL;
+        }
+        return hash;
+    }
+
+    // like path_stat_agg, but stat-ing at most file_budget files, which
+    // for paths containing very many files is most of the cost of a walk.
+    // directories are still all listed, so the inode count is exact, but
+    // for larger paths max_atime is only that of a sample spread as evenly
+    // as possible across directories and size is extrapolated from the
+    // sample. exact is set to whether the stats are exact.
+    StatAgg sampled_path_stat_agg(const std::string& path, uint64_t file_budget, bool& exact) {
+        StatAgg agg;
+        bool is_dir;
+        exact = true;
+
+        if (int err = stat_at(AT_FDCWD, path.c_str(), is_dir, agg.max_atime, agg.size)) {
+            if (is_permission_error(err)) {
+                return StatAgg{};
+            }
+            throw WalkError{err, path};
+        }
+        if (!is_dir) {
+            return agg;
+        }
+
+        agg = StatAgg{};
+        std::vector<DirFiles> dirs_files;
+        agg.inodes = list_dir_files(AT_FDCWD, path.c_str(), path, dirs_files);
+
+        uint64_t file_count = 0;
+        for (const auto& files : dirs_files) {
+            file_count += files.names.size();
+        }
+        exact = file_count <= file_budget;
+        if (!exact) {
+            std::mt19937_64 rng(path_seed(path));
+            uint64_t budget_remaining = file_budget;
+            // smallest directories first so any of their share of the
+            // budget they can't use is spread over the remaining directories
+            std::stable_sort(
+                dirs_files.begin(),
+                dirs_files.end(),
+                [](const DirFiles& a, const DirFiles& b) {
+                    return a.names.size() < b.names.size();
+                }
+            );
+            for (size_t i = 0; i < dirs_files.size(); i++) {
+                auto& names = dirs_files[i].names;
+                uint64_t share = budget_remaining / (dirs_files.size() - i);
+                if (share < names.size()) {
+                    std::vector<std::string> chosen;
+                    chosen.reserve(share);
+                    std::sample(
+                        std::make_move_iterator(names.begin()),
+                        std::make_move_iterator(names.end()),
+                        std::back_inserter(chosen),
+                        share,
+                        rng
+                    );
+                    names = std::move(chosen);
+                }
+                budget_remaining -= names.size();
+            }
+        }
+
+        uint64_t sample_count = 0;
+        for (const auto& files : dirs_files) {
+            if (files.names.empty()) {
+                continue;
+            }
+            int fd = open(files.path.c_str(), O_RDONLY | O_DIRECTORY | O_NOFOLLOW | O_CLOEXEC);
+            if (fd < 0) {
+                throw WalkError{errno, files.path};
+            }
+            FdGuard fd_guard{fd};
+
+            for (const auto& name : files.names) {
+                double atime;
+                uint64_t size;
+                sample_count += 1;
+                if (int err = stat_at(fd, name.c_str(), is_dir, atime, size)) {
+                    if (!is_permission_error(err)) {
+                        throw WalkError{err, files.path + "/" + name};
+                    }
+                    continue;
+                }
+                agg.max_atime = std::max(agg.max_atime, atime);
+                agg.size += size;
+            }
+        }
+
+        if (!exact && sample_count) {
+            agg.size = static_cast<uint64_t>(
+                static_cast<unsigned __int128>(agg.size) * file_count / sample_count
+            );
+        }
+        return agg;
+    }
+
+    // converts an error caught while not holding the GIL to a python
+    // exception
+    [[noreturn]] void raise_walk_error(const WalkError& error) {
+        errno = error.err;
+        PyErr_SetFromErrnoWithFilename(PyExc_OSError, error.path.c_str());
+        throw py::error_already_set();
+    }
+
     // a call guard that temporarily re-activates libnix's signal handling, only
     // worth using with long-running calls
     class SigHandlerSwitcher {
@@ -63,8 +556,6 @@ namespace nhgc {
     };
 }
 
-namespace py = pybind11;
-
 PYBIND11_MODULE(libnixstore_wrapper, m) {
     m.doc() = R"pbdoc(
         libnixstore wrapper
@@ -107,6 +598,120 @@ PYBIND11_MODULE(libnixstore_wrapper, m) {
 #endif
     });
 
+    m.def(
+        "path_stat_agg",
+        [](const std::string& path) -> std::tuple<double, uint64_t, uint64_t> {
+            nhgc::StatAgg agg;
+            std::optional<nhgc::WalkError> error;
+            {
+                py::gil_scoped_release release;
+                try {
+                    agg = nhgc::path_stat_agg(path);
+                } catch (nhgc::WalkError& e) {
+                    error = std::move(e);
+                }
+            }
+
+            if (error.has_value()) {
+                nhgc::raise_walk_error(*error);
+            }
+
+            return std::make_tuple(agg.max_atime, agg.inodes, agg.size);
+        },
+        py::arg("path")
+    );
+    m.def(
+        "path_stat_agg_hot_files",
+        [](const std::string& path, size_t hot_count) -> std::tuple<
+            std::tuple<double, uint64_t, uint64_t>,
+            std::vector<std::string>
+        > {
+            nhgc::StatAgg agg;
+            std::vector<std::string> hot_files;
+            std::optional<nhgc::WalkError> error;
+            {
+                py::gil_scoped_release release;
+                try {
+                    nhgc::HotFiles hot(hot_count, path.size());
+                    agg = nhgc::path_stat_agg(path, &hot);
+                    hot_files = hot.take_sorted();
+                } catch (nhgc::WalkError& e) {
+                    error = std::move(e);
+                }
+            }
+
+            if (error.has_value()) {
+                nhgc::raise_walk_error(*error);
+            }
+
+            return std::make_tuple(
+                std::make_tuple(agg.max_atime, agg.inodes, agg.size),
+                std::move(hot_files)
+            );
+        },
+        py::arg("path"),
+        py::arg("hot_count")
+    );
+    m.def(
+        "path_stat_agg_links",
+        [](const std::string& path) -> std::tuple<
+            std::tuple<double, uint64_t, uint64_t>,
+            std::vector<nhgc::SharedFile>
+        > {
+            nhgc::StatAgg agg;
+            std::vector<nhgc::SharedFile> shared;
+            std::optional<nhgc::WalkError> error;
+            {
+                py::gil_scoped_release release;
+                try {
+                    agg = nhgc::path_stat_agg(path, nullptr, &shared);
+                } catch (nhgc::WalkError& e) {
+                    error = std::move(e);
+                }
+            }
+
+            if (error.has_value()) {
+                nhgc::raise_walk_error(*error);
+            }
+
+            return std::make_tuple(
+                std::make_tuple(agg.max_atime, agg.inodes, agg.size),
+                std::move(shared)
+            );
+        },
+        py::arg("path")
+    );
+    m.def(
+        "sampled_path_stat_agg",
+        [](const std::string& path, uint64_t file_budget) -> std::tuple<
+            std::tuple<double, uint64_t, uint64_t>,
+            bool
+        > {
+            nhgc::StatAgg agg;
+            bool exact;
+            std::optional<nhgc::WalkError> error;
+            {
+                py::gil_scoped_release release;
+                try {
+                    agg = nhgc::sampled_path_stat_agg(path, file_budget, exact);
+                } catch (nhgc::WalkError& e) {
+                    error = std::move(e);
+                }
+            }
+
+            if (error.has_value()) {
+                nhgc::raise_walk_error(*error);
+            }
+
+            return std::make_tuple(
+                std::make_tuple(agg.max_atime, agg.inodes, agg.size),
+                exact
+            );
+        },
+        py::arg("path"),
+        py::arg("file_budget")
+    );
+
     py::class_<nix::StorePath>(m, "StorePath")
         .def(py::init<const std::string &>())
         .def("__str__", &nix::StorePath::to_string)
@@ -222,30 +827,115 @@ PYBIND11_MODULE(libnixstore_wrapper, m) {
             py::arg("store_path"),
             py::call_guard<py::gil_scoped_release>()
         ).def(
-            "query_path_info_async",
-            [get_event_loop, RuntimeError](
+            "query_path_infos",
+            [](
                 nix::Store& store,
-                nix::StorePath store_path
+                const std::vector<nix::StorePath>& store_paths
             ){
-                auto pyfuture = get_event_loop().attr("create_future")();
+                // a compact, columnar result avoiding the need for any
+                // per-path python wrapper objects. nar_size and
+                // registration_time are None for invalid paths, and the
+                // references of store_paths[i] are
+                // references[reference_offsets[i]:reference_offsets[i+1]]
+                std::vector<std::string> paths;
+                std::vector<std::optional<uint64_t>> nar_sizes;
+                std::vector<std::optional<time_t>> registration_times;
+                std::vector<size_t> reference_offsets;
+                std::vector<std::string> references;
 
-                store.queryPathInfo(
-                    store_path,
-                    nix::Callback<nix::ref<const nix::ValidPathInfo>>([pyfuture, RuntimeError](
-                        std::future<nix::ref<const nix::ValidPathInfo>> f_vpi
-                    ) -> void {
-                        try {
-                            pyfuture.attr("set_result")(f_vpi.get().get_ptr());
-                        } catch (const std::exception& e) {
-                            // pybind11 doesn't convert exception *arguments* itself
-                            pyfuture.attr("set_exception")(RuntimeError(e.what()));
+                paths.reserve(store_paths.size());
+                nar_sizes.reserve(store_paths.size());
+                registration_times.reserve(store_paths.size());
+                reference_offsets.reserve(store_paths.size() + 1);
+                reference_offsets.push_back(0);
+
+                for (const auto& store_path : store_paths) {
+                    try {
+                        auto path_info = store.queryPathInfo(store_path);
+                        nar_sizes.push_back(path_info->narSize);
+                        registration_times.push_back(path_info->registrationTime);
+                        for (const auto& ref : path_info->references) {
+                            references.emplace_back(ref.to_string());
                         }
-                    })
+                    } catch (const nix::Error& e) {
+                        nar_sizes.push_back(std::nullopt);
+                        registration_times.push_back(std::nullopt);
+                    }
+                    paths.emplace_back(store_path.to_string());
+                    reference_offsets.push_back(references.size());
+                }
+
+                return std::make_tuple(
+                    std::move(paths),
+                    std::move(nar_sizes),
+                    std::move(registration_times),
+                    std::move(reference_offsets),
+                    std::move(references)
                 );
+            },
+            py::arg("store_paths"),
+            py::call_guard<py::gil_scoped_release, nhgc::SigHandlerSwitcher>()
+        ).def(
+            "query_path_info_async",
+            [get_event_loop, RuntimeError](
+                nix::Store& store,
+                nix::StorePath store_path,
+                py::object loop
+            ){
+                if (loop.is_none()) {
+                    loop = get_event_loop();
+                }
+                auto pyfuture = loop.attr("create_future")();
+
+                // the callback may be invoked from any thread, so must only
+                // hand its result to the event loop via call_soon_threadsafe
+                // and take care to hold the GIL while touching python objects
+                nhgc::GilSafeObject set_result(pyfuture.attr("set_result"));
+                nhgc::GilSafeObject set_exception(pyfuture.attr("set_exception"));
+                nhgc::GilSafeObject call_soon_threadsafe(loop.attr("call_soon_threadsafe"));
+                nhgc::GilSafeObject runtime_error(RuntimeError);
+
+                {
+                    py::gil_scoped_release release;
+
+                    store.queryPathInfo(
+                        store_path,
+                        nix::Callback<nix::ref<const nix::ValidPathInfo>>([
+                            set_result,
+                            set_exception,
+                            call_soon_threadsafe,
+                            runtime_error
+                        ](
+                            std::future<nix::ref<const nix::ValidPathInfo>> f_vpi
+                        ) -> void {
+                            std::shared_ptr<const nix::ValidPathInfo> vpi;
+                            std::string error;
+                            try {
+                                vpi = f_vpi.get().get_ptr();
+                            } catch (const std::exception& e) {
+                                error = e.what();
+                            }
+
+                            py::gil_scoped_acquire acquire;
+                            try {
+                                if (vpi) {
+                                    (*call_soon_threadsafe)(*set_result, vpi);
+                                } else {
+                                    // pybind11 doesn't convert exception *arguments* itself
+                                    (*call_soon_threadsafe)(*set_exception, (*runtime_error)(error));
+                                }
+                            } catch (py::error_already_set& e) {
+                                // most likely the loop has been closed - nobody
+                                // is waiting for this result any more
+                                e.discard_as_unraisable("query_path_info_async callback");
+                            }
+                        })
+                    );
+                }
                 return pyfuture;
             },
             py::arg("store_path"),
-            py::call_guard<py::gil_scoped_release>()
+            py::arg("loop") = py::none()
         ).def(
             "query_substitutable_paths",
             &nix::Store::querySubstitutablePaths,
@@ -254,6 +944,34 @@ PYBIND11_MODULE(libnixstore_wrapper, m) {
             "query_substitutable_paths_interruptible",
             &nix::Store::querySubstitutablePaths,
             py::call_guard<py::gil_scoped_release, nhgc::SigHandlerSwitcher>()
+        ).def(
+            "get_uri",
+            [](nix::Store& store){
+#if NIX_VERSION_MINOR >= 31
+                return store.config.getReference().render(/*withParams=*/true);
+#else
+                return store.getUri();
+#endif
+            }
+        ).def(
+            "get_setting",
+            [](
+                nix::Store& store,
+                const std::string& name
+            ) -> std::optional<std::string> {
+                std::map<std::string, nix::AbstractConfig::SettingInfo> settings;
+#if NIX_VERSION_MINOR >= 31
+                const_cast<nix::Store::Config&>(store.config).getSettings(settings);
+#else
+                store.getSettings(settings);
+#endif
+                auto it = settings.find(name);
+                if (it == settings.end()) {
+                    return std::nullopt;
+                }
+                return it->second.value;
+            },
+            py::arg("name")
         ).def(
             "topo_sort_paths",
             &nix::Store::topoSortPaths,
@@ -0,0 +1,121 @@
+from itertools import count
+from threading import Event
+from unittest import mock
+
+import pytest
+
+from nix_heuristic_gc.daemon import watch_watermarks
+from nix_heuristic_gc.quantity import Quantity, QuantityUnit
+
+
+@mock.patch("nix_heuristic_gc.daemon.free_quantity", autospec=True)
+def test_watch_watermarks(mock_free_quantity):
+    stop_event = Event()
+    graph_counter = count()
+    build_graph = mock.Mock(side_effect=lambda: f"graph-{next(graph_counter)}")
+    free = iter([500, 500, 150, 50, 50] + [50] * 100000)
+
+    def free_quantity(path, unit):
+        assert path == "/nix/store"
+        assert unit == QuantityUnit.BYTES
+        try:
+            return next(free)
+        except StopIteration:
+            stop_event.set()
+            return 500
+
+    mock_free_quantity.side_effect = free_quantity
+
+    reclaim_calls = []
+
+    def reclaim(garbage_graph, limit):
+        reclaim_calls.append((garbage_graph, limit))
+        if len(reclaim_calls) == 2:
+            stop_event.set()
+
+    watch_watermarks(
+        build_graph,
+        reclaim,
+        "/nix/store",
+        Quantity(100, QuantityUnit.BYTES),
+        Quantity(200, QuantityUnit.BYTES),
+        check_interval=0.001,
+        refresh_interval=3600,
+        stop_event=stop_event,
+    )
+
+    assert len(reclaim_calls) == 2
+    assert reclaim_calls[0] == ("graph-0", Quantity(150, QuantityUnit.BYTES))
+    # second collection should only have happened once the graph had been
+    # refreshed
+    assert reclaim_calls[1][0] != "graph-0"
+    assert reclaim_calls[1][1] == Quantity(150, QuantityUnit.BYTES)
+
+
+@mock.patch("nix_heuristic_gc.daemon.free_quantity", autospec=True)
+def test_watch_watermarks_refresh_interval(mock_free_quantity):
+    stop_event = Event()
+    build_graph = mock.Mock(return_value="graph")
+
+    def free_quantity(path, unit):
+        if build_graph.call_count >= 3:
+            stop_event.set()
+        return 500
+
+    mock_free_quantity.side_effect = free_quantity
+    reclaim = mock.Mock()
+
+    watch_watermarks(
+        build_graph,
+        reclaim,
+        "/nix/store",
+        Quantity(100, QuantityUnit.INODES),
+        Quantity(200, QuantityUnit.INODES),
+        check_interval=0.001,
+        refresh_interval=0,
+        stop_event=stop_event,
+    )
+
+    assert not reclaim.called
+
+
+@mock.patch("nix_heuristic_gc.daemon.free_quantity", autospec=True)
+def test_watch_watermarks_reclaim_failure(mock_free_quantity):
+    stop_event = Event()
+    graph_counter = count()
+    build_graph = mock.Mock(side_effect=lambda: f"graph-{next(graph_counter)}")
+    mock_free_quantity.return_value = 50
+
+    reclaim_calls = []
+
+    def reclaim(garbage_graph, limit):
+        reclaim_calls.append(garbage_graph)
+        if len(reclaim_calls) == 1:
+            raise OSError("deletion failed")
+        stop_event.set()
+
+    watch_watermarks(
+        build_graph,
+        reclaim,
+        "/nix/store",
+        Quantity(100, QuantityUnit.BYTES),
+        Quantity(200, QuantityUnit.BYTES),
+        check_interval=0.001,
+        refresh_interval=3600,
+        stop_event=stop_event,
+    )
+
+    # the failure shouldn't have stopped the daemon, which should have
+    # retried with a refreshed graph
+    assert reclaim_calls == ["graph-0", "graph-1"]
+
+
+@pytest.mark.parametrize("low_watermark,high_watermark", (
+    (Quantity(100, QuantityUnit.BYTES), Quantity(200, QuantityUnit.INODES)),
+    (Quantity(200, QuantityUnit.BYTES), Quantity(100, QuantityUnit.BYTES)),
+))
+def test_watch_watermarks_bad_watermarks(low_watermark, high_watermark):
+    build_graph = mock.Mock()
+    with pytest.raises(ValueError):
+        watch_watermarks(build_graph, mock.Mock(), "/nix/store", low_watermark, high_watermark)
+    assert not build_graph.called
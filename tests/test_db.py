@@ -0,0 +1,123 @@
+import os
+import sqlite3
+
+from nix_heuristic_gc import libnixstore_wrapper as libstore
+from nix_heuristic_gc.db import local_store_db_path, query_path_infos_db
+
+# a subset of nix's schema
+_SCHEMA = """
+create table ValidPaths (
+    id               integer primary key autoincrement not null,
+    path             text unique not null,
+    hash             text not null,
+    registrationTime integer not null,
+    deriver          text,
+    narSize          integer,
+    ultimate         integer,
+    sigs             text,
+    ca               text
+);
+create table Refs (
+    referrer  integer not null,
+    reference integer not null,
+    primary key (referrer, reference)
+);
+create table DerivationOutputs (
+    drv  integer not null,
+    id   text not null,
+    path text not null,
+    primary key (drv, id)
+);
+"""
+
+
+def _make_db(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.executescript(_SCHEMA)
+    conn.executemany(
+        "INSERT INTO ValidPaths (id, path, hash, registrationTime, narSize) VALUES (?, ?, '', ?, ?)",
+        (
+            (1, "/nix/store/aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1", 1001, 100),
+            (2, "/nix/store/bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2", 1002, 200),
+            (3, "/nix/store/cccccccccccccccccccccccccccccccc-ccc-3.3.3.drv", 1003, 300),
+            (4, "/nix/store/xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx-xxx-x.x.x", 1004, None),
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO Refs (referrer, reference) VALUES (?, ?)",
+        ((2, 1), (2, 2), (2, 4), (3, 1), (4, 1)),
+    )
+    conn.executemany(
+        "INSERT INTO DerivationOutputs (drv, id, path) VALUES (?, ?, ?)",
+        (
+            (3, "out", "/nix/store/bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2"),
+            (3, "dev", "/nix/store/aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1"),
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_query_path_infos_db(tmp_path):
+    db_path = str(tmp_path / "db.sqlite")
+    _make_db(db_path)
+
+    path_infos, derivation_outputs = query_path_infos_db(
+        db_path,
+        "/nix/store",
+        [
+            libstore.StorePath("cccccccccccccccccccccccccccccccc-ccc-3.3.3.drv"),
+            libstore.StorePath("bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2"),
+            libstore.StorePath("dddddddddddddddddddddddddddddddd-ddd-4.4.4"),
+            libstore.StorePath("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1"),
+        ],
+    )
+
+    assert path_infos == [
+        (
+            "cccccccccccccccccccccccccccccccc-ccc-3.3.3.drv",
+            300,
+            1003,
+            ("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1",),
+        ),
+        (
+            "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2",
+            200,
+            1002,
+            (
+                "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1",
+                "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2",
+                "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx-xxx-x.x.x",
+            ),
+        ),
+        # invalid
+        ("dddddddddddddddddddddddddddddddd-ddd-4.4.4", None, None, ()),
+        ("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1", 100, 1001, ()),
+    ]
+    assert derivation_outputs == {
+        "cccccccccccccccccccccccccccccccc-ccc-3.3.3.drv": (
+            "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1",
+            "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2",
+        ),
+    }
+
+
+def test_query_path_infos_db_read_only(tmp_path):
+    db_path = str(tmp_path / "db.sqlite")
+    _make_db(db_path)
+    mtime = os.stat(db_path).st_mtime_ns
+
+    query_path_infos_db(
+        db_path,
+        "/nix/store/",
+        [libstore.StorePath("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1")],
+    )
+
+    assert os.stat(db_path).st_mtime_ns == mtime
+
+
+def test_local_store_db_path():
+    # the store set up by conftest.py
+    db_path = local_store_db_path(libstore.Store())
+    assert db_path is not None
+    assert os.path.exists(db_path)
@@ -0,0 +1,80 @@
+from unittest import mock
+
+import pytest
+
+from nix_heuristic_gc import libnixstore_wrapper as libstore
+from nix_heuristic_gc.deletion import delete_chunked
+
+
+def _mock_spn(i):
+    return mock.Mock(path=f"{i:032d}-path-{i}")
+
+
+def _mock_store():
+    mock_store = mock.create_autospec(
+        libstore.Store,
+        spec_set=True,
+        instance=True,
+    )
+    mock_store.collect_garbage.side_effect = lambda action, paths_to_delete: (
+        set(), 100 * len(paths_to_delete),
+    )
+    return mock_store
+
+
+def _deleted_chunks(mock_store):
+    return [
+        c.kwargs["paths_to_delete"] for c in mock_store.collect_garbage.call_args_list
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", (1, 3, 10, 100))
+def test_delete_chunked(chunk_size):
+    mock_store = _mock_store()
+    selection = [_mock_spn(i) for i in range(10)]
+    on_chunk_deleted = mock.Mock()
+
+    assert delete_chunked(
+        mock_store,
+        iter(selection),
+        chunk_size,
+        on_chunk_deleted=on_chunk_deleted,
+    ) == (10, 1000)
+
+    expected_chunks = [
+        selection[i:i+chunk_size] for i in range(0, len(selection), chunk_size)
+    ]
+    assert _deleted_chunks(mock_store) == [
+        {libstore.StorePath(spn.path) for spn in chunk} for chunk in expected_chunks
+    ]
+    assert all(
+        c.kwargs["action"] == libstore.GCAction.GCDeleteSpecific
+        for c in mock_store.collect_garbage.call_args_list
+    )
+    assert [c.args[0] for c in on_chunk_deleted.call_args_list] == expected_chunks
+
+
+def test_delete_chunked_stops_early():
+    mock_store = _mock_store()
+    selection = iter([_mock_spn(i) for i in range(10)])
+
+    assert delete_chunked(mock_store, selection, 2, max_bytes_freed=350) == (4, 400)
+    # the chunk being selected while the second chunk was being deleted
+    # should have been discarded
+    assert len(_deleted_chunks(mock_store)) == 2
+    assert len(list(selection)) == 4
+
+
+def test_delete_chunked_interrupted(caplog):
+    mock_store = _mock_store()
+
+    def selection():
+        yield from (_mock_spn(i) for i in range(5))
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        delete_chunked(mock_store, selection(), 2)
+
+    # the chunk in flight at the time should have been accounted for
+    assert len(_deleted_chunks(mock_store)) == 2
+    assert "interrupted after deleting 4 store paths, freeing 400 bytes" in caplog.text
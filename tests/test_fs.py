@@ -0,0 +1,161 @@
+import os
+
+import pytest
+
+from nix_heuristic_gc.fs import (
+    links_stat_agg_chunk,
+    path_stat_agg,
+    path_stat_agg_hot_files,
+    path_stat_agg_links,
+    py_path_stat_agg,
+    sampled_path_stat_agg,
+    sampled_stat_agg_chunk,
+    stat_agg_chunk,
+)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / "a" / "b" / "c").mkdir(parents=True)
+    (tmp_path / "a" / "x").write_bytes(b"x" * 100)
+    (tmp_path / "a" / "b" / "y").write_bytes(b"y" * 10)
+    (tmp_path / "a" / "b" / "c" / "z").write_bytes(b"")
+    (tmp_path / "a" / "l").symlink_to("x")
+    (tmp_path / "a" / "d").symlink_to("b")
+    os.utime(tmp_path / "a" / "l", (1500, 1), follow_symlinks=False)
+    os.utime(tmp_path / "a" / "d", (1500, 1), follow_symlinks=False)
+    os.utime(tmp_path / "a" / "x", (1000.5, 1))
+    os.utime(tmp_path / "a" / "b" / "y", (3000.25, 1))
+    os.utime(tmp_path / "a" / "b" / "c" / "z", (2000, 1))
+    # directory atimes should be ignored
+    os.utime(tmp_path / "a" / "b", (9000, 1))
+    return tmp_path
+
+
+def test_path_stat_agg_dir(tree):
+    result = path_stat_agg(str(tree / "a"))
+    assert result == py_path_stat_agg(str(tree / "a"))
+    atime, inodes, _ = result
+    assert (atime, inodes) == (3000.25, 8)
+
+
+def test_path_stat_agg_file(tree):
+    assert path_stat_agg(str(tree / "a" / "x")) == py_path_stat_agg(str(tree / "a" / "x")) == (1000.5, 1, 100)
+
+
+def test_path_stat_agg_symlink(tree):
+    assert path_stat_agg(str(tree / "a" / "d")) == py_path_stat_agg(str(tree / "a" / "d"))
+
+
+def test_path_stat_agg_empty_dir(tree):
+    assert path_stat_agg(str(tree / "a" / "b" / "c" / "z")) == py_path_stat_agg(str(tree / "a" / "b" / "c" / "z"))
+    (tree / "e").mkdir()
+    assert path_stat_agg(str(tree / "e")) == py_path_stat_agg(str(tree / "e")) == (0, 1, 0)
+
+
+@pytest.mark.skipif(os.geteuid() == 0, reason="permissions don't apply to root")
+def test_path_stat_agg_permission_error(tree):
+    (tree / "a" / "b").chmod(0)
+    try:
+        assert path_stat_agg(str(tree / "a")) == py_path_stat_agg(str(tree / "a"))
+    finally:
+        (tree / "a" / "b").chmod(0o755)
+
+
+def test_path_stat_agg_missing(tree):
+    with pytest.raises(FileNotFoundError):
+        py_path_stat_agg(str(tree / "missing"))
+    with pytest.raises(FileNotFoundError):
+        path_stat_agg(str(tree / "missing"))
+
+
+@pytest.mark.parametrize("hot_count,expected", (
+    (0, []),
+    (2, ["b/y", "b/c/z"]),
+    (10, ["b/y", "b/c/z", "l", "d", "x"]),
+))
+def test_path_stat_agg_hot_files(tree, hot_count, expected):
+    stat_agg, hot_files = path_stat_agg_hot_files(str(tree / "a"), hot_count)
+    assert stat_agg == path_stat_agg(str(tree / "a"))
+    # the symlinks share an atime, so are in no particular order
+    assert hot_files[:2] == expected[:2]
+    assert sorted(hot_files[2:]) == sorted(expected[2:])
+
+
+def test_path_stat_agg_hot_files_missing(tree):
+    with pytest.raises(FileNotFoundError):
+        path_stat_agg_hot_files(str(tree / "missing"), 1)
+
+
+def test_stat_agg_chunk(tree):
+    chunk = [(3, str(tree / "a")), (7, str(tree / "a" / "x"))]
+    assert stat_agg_chunk(chunk) == [
+        (3, *path_stat_agg(str(tree / "a")), []),
+        (7, 1000.5, 1, 100, []),
+    ]
+    assert stat_agg_chunk(chunk, hot_count=1) == [
+        (3, *path_stat_agg(str(tree / "a")), ["b/y"]),
+        (7, 1000.5, 1, 100, ["."]),
+    ]
+
+
+@pytest.mark.parametrize("file_budget", (5, 6, 1000))
+def test_sampled_path_stat_agg_within_budget(tree, file_budget):
+    assert sampled_path_stat_agg(str(tree / "a"), file_budget) == (
+        path_stat_agg(str(tree / "a")),
+        True,
+    )
+    assert sampled_path_stat_agg(str(tree / "a" / "x"), file_budget) == ((1000.5, 1, 100), True)
+
+
+def test_sampled_path_stat_agg_over_budget(tree):
+    # each directory with files gets a share of the budget, so the most
+    # recently accessed file, alone in its directory, is always sampled
+    (atime, inodes, size), exact = sampled_path_stat_agg(str(tree / "a"), 3)
+    assert not exact
+    assert (atime, inodes) == (3000.25, 8)
+    # repeatable
+    assert sampled_path_stat_agg(str(tree / "a"), 3) == ((atime, inodes, size), exact)
+
+    # only one file of the largest directory can be sampled
+    (atime, inodes, size), exact = sampled_path_stat_agg(str(tree / "a"), 1)
+    assert not exact
+    assert atime in (1000.5, 1500)
+    # the inode count is always exact, sizes extrapolated
+    assert inodes == 8
+    assert size in (500, 5)
+
+
+def test_sampled_stat_agg_chunk(tree):
+    chunk = [(3, str(tree / "a")), (7, str(tree / "a" / "x"))]
+    assert sampled_stat_agg_chunk(chunk, file_budget=1000) == [
+        (3, *path_stat_agg(str(tree / "a")), True),
+        (7, 1000.5, 1, 100, True),
+    ]
+    assert [record[-1] for record in sampled_stat_agg_chunk(chunk, file_budget=1)] == [
+        False, True,
+    ]
+
+
+def test_path_stat_agg_links(tree):
+    assert path_stat_agg_links(str(tree / "a")) == (path_stat_agg(str(tree / "a")), [])
+
+    os.link(tree / "a" / "x", tree / "a" / "b" / "x2")
+    st = os.stat(tree / "a" / "x")
+    stat_agg, shared = path_stat_agg_links(str(tree / "a"))
+    assert stat_agg == path_stat_agg(str(tree / "a"))
+    assert shared == [(st.st_dev, st.st_ino, 2, 100)] * 2
+    assert path_stat_agg_links(str(tree / "a" / "x")) == (
+        (1000.5, 1, 100),
+        [(st.st_dev, st.st_ino, 2, 100)],
+    )
+
+
+def test_links_stat_agg_chunk(tree):
+    os.link(tree / "a" / "x", tree / "x2")
+    st = os.stat(tree / "a" / "x")
+    chunk = [(3, str(tree / "a")), (7, str(tree / "a" / "b"))]
+    assert links_stat_agg_chunk(chunk) == [
+        (3, *path_stat_agg(str(tree / "a")), [(st.st_dev, st.st_ino, 2, 100)]),
+        (7, *path_stat_agg(str(tree / "a" / "b")), []),
+    ]
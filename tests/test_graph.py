@@ -1,3 +1,5 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import nullcontext
 from unittest import mock
 
@@ -5,7 +7,16 @@ import pytest
 
 from nix_heuristic_gc import libnixstore_wrapper as libstore
 from nix_heuristic_gc.graph import GarbageGraph
+from nix_heuristic_gc.graph_snapshot import GraphSnapshot
+from nix_heuristic_gc.metrics import Metrics
+from nix_heuristic_gc.naive_executor import NaiveExecutor
+from nix_heuristic_gc.path_info import default_query_window
+from nix_heuristic_gc.plan import plan_reclaim
+from nix_heuristic_gc.prefetch import StatPrefetcher
 from nix_heuristic_gc.quantity import QuantityUnit
+from nix_heuristic_gc.recency import RecencySource
+from nix_heuristic_gc.stat_cache import StatCache
+from nix_heuristic_gc.substitutable_cache import SubstitutableCache
 
 
 def _raise_if_exc(val):
@@ -186,3 +197,1332 @@ def test_basic_init(
         assert garbage_graph.very_invalid_paths == {
             "/nix/store/666-6.6.6",
         }
+
+
+def _mock_path_info(path, references=(), nar_size=123, registration_time=1700000000):
+    return mock.Mock(
+        autospec = libstore.ValidPathInfo,
+        references = {libstore.StorePath(ref) for ref in references},
+        nar_size = nar_size,
+        registration_time = registration_time,
+        path = libstore.StorePath(path),
+    )
+
+
+# topologically sorted, referrers first
+_SIMPLE_PATH_INFOS = {
+    "hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh-eee-5.5.5": _mock_path_info(
+        "hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh-eee-5.5.5",
+        (
+            "cccccccccccccccccccccccccccccccc-ccc-3.3.3",
+            "dddddddddddddddddddddddddddddddd-ddd-4.4.4",
+            "hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh-eee-5.5.5",
+        ),
+    ),
+    "dddddddddddddddddddddddddddddddd-ddd-4.4.4": RuntimeError("nope"),
+    "cccccccccccccccccccccccccccccccc-ccc-3.3.3": _mock_path_info(
+        "cccccccccccccccccccccccccccccccc-ccc-3.3.3",
+        (
+            "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1",
+            "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2",
+        ),
+        nar_size=456,
+    ),
+    "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2": _mock_path_info(
+        "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2",
+        (
+            "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1",
+            # non-garbage path
+            "xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx-xxx-x.x.x",
+        ),
+    ),
+    "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1": _mock_path_info(
+        "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1",
+        nar_size=789,
+    ),
+}
+
+
+def _mock_store(path_infos=_SIMPLE_PATH_INFOS):
+    mock_store = mock.create_autospec(
+        libstore.Store,
+        spec_set=True,
+        instance=True,
+    )
+    mock_store.collect_garbage.return_value = {
+        f"/nix/store/{path}" for path in path_infos
+    }, 0
+    mock_store.topo_sort_paths.return_value = [
+        libstore.StorePath(path) for path in path_infos
+    ]
+    mock_store.query_path_info.side_effect = lambda store_path: _raise_if_exc(
+        path_infos[str(store_path)]
+    )
+
+    def query_path_info_async(store_path, loop):
+        future = loop.create_future()
+        path_info = path_infos[str(store_path)]
+        loop.call_soon_threadsafe(
+            future.set_exception if isinstance(path_info, Exception) else future.set_result,
+            path_info,
+        )
+        return future
+
+    mock_store.query_path_info_async.side_effect = query_path_info_async
+
+    def query_path_infos(store_paths):
+        paths, nar_sizes, registration_times, reference_offsets, references = [], [], [], [0], []
+        for store_path in store_paths:
+            path_info = path_infos[str(store_path)]
+            paths.append(str(store_path))
+            if isinstance(path_info, Exception):
+                nar_sizes.append(None)
+                registration_times.append(None)
+            else:
+                nar_sizes.append(path_info.nar_size)
+                registration_times.append(path_info.registration_time)
+                references.extend(sorted(str(ref) for ref in path_info.references))
+            reference_offsets.append(len(references))
+        return paths, nar_sizes, registration_times, reference_offsets, references
+
+    mock_store.query_path_infos.side_effect = query_path_infos
+    return mock_store
+
+
+def _graph_summary(garbage_graph):
+    return (
+        [
+            (i, garbage_graph.node(i).path, garbage_graph.node(i).nar_size)
+            for i in garbage_graph.graph.node_indices()
+        ],
+        list(garbage_graph.graph.weighted_edge_list()),
+        garbage_graph.path_index_mapping,
+        garbage_graph.heap,
+    )
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("path_info_window", (1, 2, 16))
+def test_async_build_matches_serial(mock_path_stat_agg, path_info_window):
+    mock_path_stat_agg.return_value = 123, 123, 123
+
+    serial_graph = GarbageGraph(_mock_store(), QuantityUnit.BYTES)
+    async_store = _mock_store()
+    async_graph = GarbageGraph(
+        async_store,
+        QuantityUnit.BYTES,
+        path_info_mode="async",
+        path_info_window=path_info_window,
+    )
+
+    assert _graph_summary(async_graph) == _graph_summary(serial_graph)
+    assert len(async_graph.graph.edge_list()) == 5
+    assert not async_store.query_path_info.called
+    assert async_store.query_path_info_async.call_count == len(_SIMPLE_PATH_INFOS)
+
+
+@mock.patch("nix_heuristic_gc.path_info.cpu_count", return_value=64)
+@pytest.mark.parametrize("max_connections", (None, "1", "64"))
+def test_default_query_window(mock_cpu_count, max_connections, caplog):
+    # a daemon's default max-connections of 1 shouldn't shrink the window
+    store = mock.create_autospec(libstore.Store, instance=True)
+    store.get_setting.return_value = max_connections
+
+    with caplog.at_level("INFO"):
+        assert default_query_window(store) == 32
+    assert ("max-connections" in caplog.text) == (max_connections == "1")
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("executor", (NaiveExecutor(), ThreadPoolExecutor(max_workers=2)))
+@pytest.mark.parametrize("path_info_batch_size", (1, 2, 1024))
+def test_batch_build_matches_serial(mock_path_stat_agg, executor, path_info_batch_size):
+    mock_path_stat_agg.return_value = 123, 123, 123
+
+    serial_graph = GarbageGraph(_mock_store(), QuantityUnit.BYTES)
+    batch_store = _mock_store()
+    batch_graph = GarbageGraph(
+        batch_store,
+        QuantityUnit.BYTES,
+        executor=executor,
+        path_info_mode="batch",
+        path_info_batch_size=path_info_batch_size,
+    )
+
+    serial_nodes, serial_edges, serial_mapping, serial_heap = _graph_summary(serial_graph)
+    batch_nodes, batch_edges, batch_mapping, batch_heap = _graph_summary(batch_graph)
+    assert batch_nodes == serial_nodes
+    assert batch_mapping == serial_mapping
+    assert batch_heap == serial_heap
+    # reference ordering may legitimately differ
+    assert sorted(batch_edges, key=lambda e: e[:2]) == sorted(serial_edges, key=lambda e: e[:2])
+    assert not batch_store.query_path_info.called
+    assert batch_store.query_path_infos.call_count == -(-len(_SIMPLE_PATH_INFOS) // path_info_batch_size)
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("min_vectorized_batch", (1, 32))
+@pytest.mark.parametrize("limit_unit", (QuantityUnit.BYTES, QuantityUnit.INODES))
+@pytest.mark.parametrize("inherit_max_atime", (False, True))
+@pytest.mark.parametrize("penalties,collect_substitutable", (
+    ({}, True),
+    ({"penalize_substitutable": 1e5}, True),
+    ({"penalize_invalid": 1e6, "penalize_drvs": 1e5}, False),
+    ({"penalize_inodes": 1e6 / 7, "penalize_size": 1e-3 * 49}, "only"),
+))
+def test_columnar_matches_objects(
+    mock_path_stat_agg,
+    min_vectorized_batch,
+    limit_unit,
+    inherit_max_atime,
+    penalties,
+    collect_substitutable,
+):
+    mock_path_stat_agg.side_effect = lambda path: {
+        "/nix/store/hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh-eee-5.5.5": (5000.5, 5, 500),
+        "/nix/store/dddddddddddddddddddddddddddddddd-ddd-4.4.4": (4000.25, 4, 400),
+        "/nix/store/cccccccccccccccccccccccccccccccc-ccc-3.3.3": (3000, 3, 300),
+        "/nix/store/bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2": (2000, 2, 200),
+        "/nix/store/aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1": (6000, 1, 100),
+    }[path]
+
+    def build(columnar):
+        mock_store = _mock_store()
+        mock_store.query_substitutable_paths_interruptible.side_effect = lambda store_paths: {
+            libstore.StorePath("cccccccccccccccccccccccccccccccc-ccc-3.3.3"),
+            libstore.StorePath("hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh-eee-5.5.5"),
+        } & store_paths
+        mock_store.query_substitutable_paths.side_effect = (
+            mock_store.query_substitutable_paths_interruptible.side_effect
+        )
+        return GarbageGraph(
+            mock_store,
+            limit_unit,
+            inherit_max_atime=inherit_max_atime,
+            collect_substitutable=collect_substitutable,
+            columnar=columnar,
+            **penalties,
+        )
+
+    object_graph = build(False)
+    with mock.patch("nix_heuristic_gc.graph._MIN_VECTORIZED_BATCH", new=min_vectorized_batch):
+        columnar_graph = build(True)
+    assert columnar_graph.columns is not None
+    assert _graph_summary(columnar_graph) == _graph_summary(object_graph)
+
+    def removed_summary(garbage_graph):
+        return [
+            (
+                spn.path,
+                spn.nar_size,
+                spn.registration_time,
+                spn.valid,
+                spn.size,
+                spn.inodes,
+                spn.max_atime,
+                spn.substitutable,
+                spn.score,
+            ) for spn in garbage_graph.remove_to_limit(10000)
+        ]
+
+    with mock.patch("nix_heuristic_gc.graph._MIN_VECTORIZED_BATCH", new=min_vectorized_batch):
+        assert removed_summary(columnar_graph) == removed_summary(object_graph)
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+def test_db_build_falls_back_for_daemon(mock_path_stat_agg):
+    mock_path_stat_agg.return_value = 123, 123, 123
+
+    db_store = _mock_store()
+    db_store.get_uri.return_value = "daemon"
+    db_graph = GarbageGraph(db_store, QuantityUnit.BYTES, path_info_mode="db")
+
+    assert db_store.query_path_infos.called
+    assert _graph_summary(db_graph)[0] == _graph_summary(
+        GarbageGraph(_mock_store(), QuantityUnit.BYTES),
+    )[0]
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+def test_stat_cache_used_for_valid_paths(mock_path_stat_agg):
+    mock_path_stat_agg.return_value = 123, 123, 123
+    mock_stat_cache = mock.create_autospec(StatCache, instance=True)
+    mock_stat_cache.path_stat_agg.return_value = 456, 456, 456
+
+    garbage_graph = GarbageGraph(
+        _mock_store(),
+        QuantityUnit.BYTES,
+        stat_cache=mock_stat_cache,
+    )
+
+    # the only pseudo-root
+    assert mock_stat_cache.path_stat_agg.mock_calls == [
+        mock.call("hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh-eee-5.5.5", 1700000000),
+    ]
+    assert [score for score, _ in garbage_graph.heap] == [456]
+
+    # removing it exposes an invalid path, which mustn't be cached
+    garbage_graph.remove_heap_root()
+    assert mock_path_stat_agg.mock_calls == [
+        mock.call("/nix/store/dddddddddddddddddddddddddddddddd-ddd-4.4.4"),
+    ]
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.fs.path_stat_agg", autospec=True)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("stat_chunk_size", (1, 64))
+def test_stat_executor(mock_graph_path_stat_agg, mock_fs_path_stat_agg, stat_chunk_size):
+    mock_fs_path_stat_agg.side_effect = lambda path: {
+        "/nix/store/cccccccccccccccccccccccccccccccc-ccc-3.3.3": (1000, 3, 300),
+        "/nix/store/dddddddddddddddddddddddddddddddd-ddd-4.4.4": (2000, 4, 400),
+    }[path]
+
+    path_infos = {
+        k: v for k, v in _SIMPLE_PATH_INFOS.items()
+        if not k.startswith("hhhhhhhh")
+    }
+    stat_graph = GarbageGraph(
+        _mock_store(path_infos),
+        QuantityUnit.BYTES,
+        stat_executor=NaiveExecutor(),
+        stat_chunk_size=stat_chunk_size,
+    )
+
+    assert not mock_graph_path_stat_agg.called
+    assert sorted(mock_fs_path_stat_agg.mock_calls) == [
+        mock.call("/nix/store/cccccccccccccccccccccccccccccccc-ccc-3.3.3"),
+        mock.call("/nix/store/dddddddddddddddddddddddddddddddd-ddd-4.4.4"),
+    ]
+
+    mock_graph_path_stat_agg.side_effect = mock_fs_path_stat_agg.side_effect
+    assert _graph_summary(stat_graph) == _graph_summary(
+        GarbageGraph(_mock_store(path_infos), QuantityUnit.BYTES),
+    )
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("batch_size", (1, 5))
+@pytest.mark.parametrize("limit", (1024, 4096, 16384))
+@pytest.mark.parametrize("seed", range(4))
+def test_remove_to_limit_penalize_exceeding_limit(mock_path_stat_agg, limit, seed, batch_size):
+    rng = random.Random(seed)
+    # no references between these so all are candidates from the outset.
+    # values chosen so all score arithmetic is exact.
+    candidates = {
+        f"{i:032d}-candidate-{i}": (float(rng.randrange(8)), rng.randrange(1, 2048))
+        for i in range(64)
+    }
+    mock_path_stat_agg.side_effect = lambda path: (
+        candidates[path.removeprefix("/nix/store/")][0], 1, 1,
+    )
+    weight = 4.0
+
+    garbage_graph = GarbageGraph(
+        _mock_store({
+            path: _mock_path_info(path, nar_size=nar_size)
+            for path, (_, nar_size) in candidates.items()
+        }),
+        QuantityUnit.BYTES,
+        penalize_exceeding_limit=weight,
+    )
+    path_index_mapping = dict(garbage_graph.path_index_mapping)
+    removed_paths = [
+        spn.path for spn in garbage_graph.remove_to_limit(limit, batch_size=batch_size)
+    ]
+
+    # with no references, batches can't free any new candidates, so
+    # should make no difference to the choices made.
+    # naively choose the lowest scoring candidate at each step
+    expected_paths = []
+    remaining = dict(candidates)
+    limit_remaining = limit
+    while limit_remaining > 0 and remaining:
+        path = min(remaining, key=lambda path: (
+            remaining[path][0] + (
+                max(remaining[path][1] - limit_remaining, 0) * weight / limit
+            ),
+            path_index_mapping[path],
+        ))
+        expected_paths.append(path)
+        limit_remaining -= remaining.pop(path)[1]
+
+    assert removed_paths == expected_paths
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("columnar", (False, True))
+@pytest.mark.parametrize("penalize_exceeding_limit", (None, 4.0))
+@pytest.mark.parametrize("batch_size", (2, 8, 1000))
+@pytest.mark.parametrize("seed", range(4))
+def test_remove_to_limit_batched(
+    mock_path_stat_agg,
+    seed,
+    batch_size,
+    penalize_exceeding_limit,
+    columnar,
+):
+    rng = random.Random(seed)
+    paths = [f"{i:032d}-path-{i}" for i in range(64)]
+    path_infos = {
+        path: _mock_path_info(
+            path,
+            references=rng.sample(paths[:i], min(i, rng.randrange(3))),
+            nar_size=rng.randrange(1, 256),
+        ) for i, path in enumerate(paths)
+    }
+    atimes = {path: float(rng.randrange(1000)) for path in paths}
+    mock_path_stat_agg.side_effect = lambda path: (
+        atimes[path.removeprefix("/nix/store/")], 1, 1,
+    )
+    limit = 2048
+
+    def removed_paths(batch_size):
+        garbage_graph = GarbageGraph(
+            _mock_store({path: path_infos[path] for path in reversed(paths)}),
+            QuantityUnit.BYTES,
+            penalize_exceeding_limit=penalize_exceeding_limit,
+            columnar=columnar,
+        )
+        return [
+            spn.path
+            for spn in garbage_graph.remove_to_limit(limit, batch_size=batch_size)
+        ]
+
+    one_at_a_time = removed_paths(1)
+    batched = removed_paths(batch_size)
+
+    # no path may be removed before all of its referrers
+    removed_before = set()
+    for path in batched:
+        assert not any(
+            path in {str(ref) for ref in path_infos[referrer].references}
+            for referrer in paths if referrer not in removed_before
+            and referrer != path
+        )
+        removed_before.add(path)
+
+    assert len(set(batched)) == len(batched)
+    assert batched[0] == one_at_a_time[0]
+    removed_size = sum(path_infos[path].nar_size for path in batched)
+    assert removed_size >= limit
+    # only the last removal of the last batch may take us over the limit
+    assert removed_size - path_infos[batched[-1]].nar_size < limit
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+def test_remove_to_limit_bad_batch_size(mock_path_stat_agg):
+    mock_path_stat_agg.return_value = 123, 123, 123
+    garbage_graph = GarbageGraph(_mock_store(), QuantityUnit.BYTES)
+    with pytest.raises(ValueError):
+        garbage_graph.remove_to_limit(1000, batch_size=0)
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("columnar", (False, True))
+@pytest.mark.parametrize("lookahead", (1, 4, 64))
+def test_stat_prefetcher(mock_path_stat_agg, lookahead, columnar):
+    rng = random.Random(0)
+    paths = [f"{i:032d}-path-{i}" for i in range(64)]
+    path_infos = {
+        path: _mock_path_info(
+            path,
+            references=rng.sample(paths[:i], min(i, rng.randrange(3))),
+            nar_size=rng.randrange(1, 256),
+        ) for i, path in enumerate(paths)
+    }
+    atimes = {path: float(rng.randrange(1000)) for path in paths}
+    mock_path_stat_agg.side_effect = lambda path: (
+        atimes[path.removeprefix("/nix/store/")], 1, 1,
+    )
+
+    def removed_paths(stat_prefetcher):
+        garbage_graph = GarbageGraph(
+            _mock_store({path: path_infos[path] for path in reversed(paths)}),
+            QuantityUnit.BYTES,
+            stat_prefetcher=stat_prefetcher,
+            columnar=columnar,
+        )
+        return [
+            (spn.path, spn.max_atime, spn.inodes, spn.fs_size)
+            for spn in garbage_graph.remove_to_limit(4096)
+        ]
+
+    expected = removed_paths(None)
+    with StatPrefetcher(max_workers=2, lookahead=lookahead) as stat_prefetcher:
+        assert removed_paths(stat_prefetcher) == expected
+
+    # at least some freed paths should have been prefetched
+    assert stat_prefetcher.hits + stat_prefetcher.waits > 0
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("use_substitutable_cache", (False, True))
+@pytest.mark.parametrize("executor", (NaiveExecutor(), ThreadPoolExecutor(max_workers=4)))
+@pytest.mark.parametrize("substitutable_batch_size", (1, 2, 1024))
+def test_prefetch_substitutable(
+    mock_path_stat_agg,
+    tmp_path,
+    substitutable_batch_size,
+    executor,
+    use_substitutable_cache,
+):
+    mock_path_stat_agg.return_value = 123, 123, 123
+    substitutable = {
+        libstore.StorePath("cccccccccccccccccccccccccccccccc-ccc-3.3.3"),
+        libstore.StorePath("hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh-eee-5.5.5"),
+    }
+
+    def build(prefetch_substitutable, substitutable_cache=None):
+        mock_store = _mock_store()
+        mock_store.query_substitutable_paths_interruptible.side_effect = (
+            lambda store_paths: substitutable & store_paths
+        )
+        mock_store.query_substitutable_paths.side_effect = (
+            lambda store_paths: substitutable & store_paths
+        )
+        garbage_graph = GarbageGraph(
+            mock_store,
+            QuantityUnit.BYTES,
+            executor=executor,
+            penalize_substitutable=1e5,
+            substitutable_cache=substitutable_cache,
+            prefetch_substitutable=prefetch_substitutable,
+            substitutable_batch_size=substitutable_batch_size,
+        )
+        return mock_store, garbage_graph
+
+    _, expected_graph = build(False)
+    expected = [
+        (spn.path, spn.substitutable) for spn in expected_graph.remove_to_limit(10000)
+    ]
+
+    with (
+        SubstitutableCache(str(tmp_path / "substitutable-cache.sqlite"))
+        if use_substitutable_cache else nullcontext()
+    ) as substitutable_cache:
+        mock_store, garbage_graph = build(True, substitutable_cache)
+        assert [
+            (spn.path, spn.substitutable) for spn in garbage_graph.remove_to_limit(10000)
+        ] == expected
+
+    # all answers should have been gathered up front
+    assert sum(
+        len(c.args[0]) for c in mock_store.query_substitutable_paths.call_args_list
+    ) == sum(1 for spn in _SIMPLE_PATH_INFOS.values() if not isinstance(spn, Exception))
+    assert not mock_store.query_substitutable_paths_interruptible.called
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("path_info_mode", ("serial", "async", "batch"))
+def test_unsorted_build_matches_sorted(mock_path_stat_agg, path_info_mode):
+    mock_path_stat_agg.return_value = 123, 123, 123
+
+    def summary(garbage_graph):
+        # node indexes will differ, so compare by path
+        def path(idx):
+            return garbage_graph.node(idx).path
+
+        return (
+            {
+                (path(i), garbage_graph.node(i).nar_size)
+                for i in garbage_graph.graph.node_indices()
+            },
+            {(path(a), path(b), t) for a, b, t in garbage_graph.graph.weighted_edge_list()},
+            {(score, path(i)) for score, i in garbage_graph.heap},
+        )
+
+    sorted_graph = GarbageGraph(_mock_store(), QuantityUnit.BYTES)
+    unsorted_store = _mock_store()
+    unsorted_graph = GarbageGraph(
+        unsorted_store,
+        QuantityUnit.BYTES,
+        path_info_mode=path_info_mode,
+        topo_sort=False,
+    )
+
+    assert summary(unsorted_graph) == summary(sorted_graph)
+    assert not unsorted_store.topo_sort_paths.called
+
+
+_DRV_PATH_INFOS = {
+    "ffffffffffffffffffffffffffffffff-fff-6.6.6.drv": _mock_path_info(
+        "ffffffffffffffffffffffffffffffff-fff-6.6.6.drv",
+    ),
+    "gggggggggggggggggggggggggggggggg-ggg-7.7.7.drv": _mock_path_info(
+        "gggggggggggggggggggggggggggggggg-ggg-7.7.7.drv",
+    ),
+    "hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh-hhh-8.8.8.drv": RuntimeError("nope"),
+    **_SIMPLE_PATH_INFOS,
+}
+
+
+def _query_derivation_outputs(store_path):
+    return {
+        "ffffffffffffffffffffffffffffffff-fff-6.6.6.drv": {
+            libstore.StorePath("cccccccccccccccccccccccccccccccc-ccc-3.3.3"),
+            libstore.StorePath("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1"),
+            # invalid
+            libstore.StorePath("dddddddddddddddddddddddddddddddd-ddd-4.4.4"),
+            # non-garbage
+            libstore.StorePath("xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx-xxx-x.x.x"),
+        },
+    }.get(str(store_path)) or _raise_if_exc(libstore.MissingRealisation("nope"))
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("executor", (NaiveExecutor(), ThreadPoolExecutor(max_workers=2)))
+@pytest.mark.parametrize("keep_derivations,keep_outputs", (
+    (True, False),
+    (False, True),
+    (True, True),
+))
+def test_drv_output_edges(mock_path_stat_agg, keep_derivations, keep_outputs, executor):
+    mock_path_stat_agg.return_value = 123, 123, 123
+    mock_store = _mock_store(_DRV_PATH_INFOS)
+    mock_store.query_derivation_outputs.side_effect = _query_derivation_outputs
+
+    with mock.patch(
+        "nix_heuristic_gc.graph._gc_keep_derivations", new=keep_derivations,
+    ), mock.patch(
+        "nix_heuristic_gc.graph._gc_keep_outputs", new=keep_outputs,
+    ):
+        garbage_graph = GarbageGraph(mock_store, QuantityUnit.BYTES, executor=executor)
+
+    def path(idx):
+        return garbage_graph.node(idx).path
+
+    drv = "ffffffffffffffffffffffffffffffff-fff-6.6.6.drv"
+    outputs = (
+        "cccccccccccccccccccccccccccccccc-ccc-3.3.3",
+        "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1",
+    )
+    assert {
+        (path(a), path(b), t)
+        for a, b, t in garbage_graph.graph.weighted_edge_list()
+        if t != GarbageGraph.EdgeType.REFERENCE
+    } == {
+        (output, drv, GarbageGraph.EdgeType.OUTPUT_DRV)
+        for output in outputs if keep_derivations
+    } | {
+        (drv, output, GarbageGraph.EdgeType.DRV_OUTPUT)
+        for output in outputs if keep_outputs
+    }
+    # only valid drvs should have been queried
+    assert sorted(
+        str(c.args[0]) for c in mock_store.query_derivation_outputs.call_args_list
+    ) == [
+        "ffffffffffffffffffffffffffffffff-fff-6.6.6.drv",
+        "gggggggggggggggggggggggggggggggg-ggg-7.7.7.drv",
+    ]
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("path_info_mode", ("serial", "async", "batch"))
+def test_graph_snapshot(mock_path_stat_agg, tmp_path, path_info_mode):
+    mock_path_stat_agg.return_value = 123, 123, 123
+    db_path = str(tmp_path / "graph-snapshot.sqlite")
+
+    with GraphSnapshot(db_path) as graph_snapshot:
+        GarbageGraph(
+            _mock_store(),
+            QuantityUnit.BYTES,
+            path_info_mode=path_info_mode,
+            graph_snapshot=graph_snapshot,
+        )
+
+    # since the last run, eee has been deleted and fff has died
+    path_infos = {
+        "ffffffffffffffffffffffffffffffff-fff-6.6.6": _mock_path_info(
+            "ffffffffffffffffffffffffffffffff-fff-6.6.6",
+            ("cccccccccccccccccccccccccccccccc-ccc-3.3.3",),
+            nar_size=321,
+        ),
+        **_SIMPLE_PATH_INFOS,
+    }
+    del path_infos["hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh-eee-5.5.5"]
+
+    full_graph = GarbageGraph(
+        _mock_store(path_infos),
+        QuantityUnit.BYTES,
+        path_info_mode=path_info_mode,
+    )
+    incremental_store = _mock_store(path_infos)
+    with GraphSnapshot(db_path) as graph_snapshot:
+        incremental_graph = GarbageGraph(
+            incremental_store,
+            QuantityUnit.BYTES,
+            path_info_mode=path_info_mode,
+            graph_snapshot=graph_snapshot,
+        )
+        # deleted path should have been dropped
+        assert graph_snapshot.get("hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh-eee-5.5.5") is None
+
+    assert _graph_summary(incremental_graph) == _graph_summary(full_graph)
+
+    # only the new and invalid paths should have needed querying
+    queried = (
+        {str(c.args[0]) for c in incremental_store.query_path_info.call_args_list}
+        | {str(c.args[0]) for c in incremental_store.query_path_info_async.call_args_list}
+        | {
+            str(sp)
+            for c in incremental_store.query_path_infos.call_args_list
+            for sp in c.args[0]
+        }
+    )
+    assert queried == {
+        "ffffffffffffffffffffffffffffffff-fff-6.6.6",
+        "dddddddddddddddddddddddddddddddd-ddd-4.4.4",
+    }
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("topo_sort", (False, True))
+def test_metrics(mock_path_stat_agg, topo_sort):
+    rng = random.Random(0)
+    paths = [f"{i:032d}-path-{i}" for i in range(32)]
+    path_infos = {
+        path: _mock_path_info(
+            path,
+            references=rng.sample(paths[:i], min(i, rng.randrange(3))),
+            nar_size=rng.randrange(1, 256),
+        ) for i, path in enumerate(paths)
+    }
+    mock_path_stat_agg.side_effect = lambda path: (float(rng.randrange(1000)), 3, 5)
+
+    mock_store = _mock_store({path: path_infos[path] for path in reversed(paths)})
+    mock_store.query_substitutable_paths.return_value = set()
+    mock_store.query_substitutable_paths_interruptible.return_value = set()
+
+    metrics = Metrics()
+    garbage_graph = GarbageGraph(
+        mock_store,
+        QuantityUnit.BYTES,
+        penalize_substitutable=1000,
+        topo_sort=topo_sort,
+        metrics=metrics,
+    )
+    assert garbage_graph.metrics is metrics
+    removed = garbage_graph.remove_to_limit(1 << 20)
+    assert len(removed) == len(paths)
+
+    d = metrics.as_dict()
+    assert set(d["phases"]) == {
+        "query_dead_paths",
+        "sort_paths",
+        "build_graph",
+        "gather_candidates",
+        "query_substitutable",
+        "construct_heap",
+    }
+    assert all(phase["count"] == 1 for phase in d["phases"].values())
+
+    counters = d["counters"]
+    assert counters["path_info_queries"] == len(paths)
+    assert counters["stat_walks"] == len(paths)
+    assert counters["stat_walk_inodes"] == 3 * len(paths)
+    assert counters["stat_walk_bytes"] == 5 * len(paths)
+    assert counters["heap_pushes"] == counters["heap_pops"] == len(paths)
+    assert counters["nodes_removed"] == len(paths)
+    assert counters["substitutable_queries"] >= 1
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("inherit_max_atime", (False, True))
+def test_plan_reclaim_matches_remove_to_limit(mock_path_stat_agg, inherit_max_atime):
+    rng = random.Random(0)
+    paths = [f"{i:032d}-path-{i}" for i in range(48)]
+    path_infos = {
+        path: _mock_path_info(
+            path,
+            references=rng.sample(paths[:i], min(i, rng.randrange(3))),
+            nar_size=rng.randrange(1, 256),
+        ) for i, path in enumerate(paths)
+    }
+    atimes = {path: float(rng.randrange(1000)) for path in paths}
+    mock_path_stat_agg.side_effect = lambda path: (
+        atimes[path.removeprefix("/nix/store/")], 1, 1,
+    )
+
+    def garbage_graph():
+        return GarbageGraph(
+            _mock_store({path: path_infos[path] for path in reversed(paths)}),
+            QuantityUnit.BYTES,
+            inherit_max_atime=inherit_max_atime,
+        )
+
+    limits = [1, 500, 2000, 1 << 20]
+    plan = plan_reclaim(garbage_graph(), limits)
+
+    for limit in limits[:-1]:
+        expected = garbage_graph().remove_to_limit(limit)
+        point = plan.thresholds[limit]
+        assert point.paths == len(expected)
+        assert point.bytes == sum(spn.size for spn in expected)
+        assert [p.path for p in plan.curve[:point.paths]] == [spn.path for spn in expected]
+        assert [p.score for p in plan.curve[:point.paths]] == [spn.score for spn in expected]
+    # not reachable
+    assert limits[-1] not in plan.thresholds
+    assert len(plan.curve) == len(paths)
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("columnar", (False, True))
+@pytest.mark.parametrize("batch_size", (1, 4))
+@pytest.mark.parametrize("penalize_exceeding_limit", (None, 5e5))
+@pytest.mark.parametrize("inherit_max_atime", (False, True))
+def test_defer_stats(
+    mock_path_stat_agg,
+    inherit_max_atime,
+    penalize_exceeding_limit,
+    batch_size,
+    columnar,
+):
+    rng = random.Random(0)
+    paths = [
+        f"{i:032d}-path-{i}" + (".drv" if rng.random() < 0.2 else "")
+        for i in range(1000)
+    ]
+    path_infos = {}
+    stat_aggs = {}
+    for i, path in enumerate(paths):
+        nar_size = rng.randrange(1, 1 << 16)
+        registration_time = 1_700_000_000 + rng.randrange(1_000_000)
+        path_infos[path] = (
+            RuntimeError("invalid") if rng.random() < 0.05 else _mock_path_info(
+                path,
+                references=rng.sample(paths[:i], min(i, rng.randrange(3))),
+                nar_size=nar_size,
+                registration_time=registration_time,
+            )
+        )
+        stat_aggs[path] = (
+            # including empty directories, and files much older than the
+            # path itself
+            rng.choice((0.0, float(rng.randrange(registration_time)))),
+            rng.randrange(1, nar_size // 128 + 2),
+            nar_size,
+        )
+    mock_path_stat_agg.side_effect = lambda path: stat_aggs[path.removeprefix("/nix/store/")]
+
+    def removed_paths(defer_stats, limit):
+        mock_path_stat_agg.reset_mock()
+        garbage_graph = GarbageGraph(
+            _mock_store({path: path_infos[path] for path in reversed(paths)}),
+            QuantityUnit.BYTES,
+            inherit_max_atime=inherit_max_atime,
+            penalize_invalid=1e6,
+            penalize_drvs=1e5,
+            penalize_inodes=1e6,
+            penalize_size=1e-1,
+            penalize_exceeding_limit=penalize_exceeding_limit,
+            columnar=columnar,
+            defer_stats=defer_stats,
+        )
+        removed = [
+            spn.path for spn in garbage_graph.remove_to_limit(limit, batch_size=batch_size)
+        ]
+        return removed, mock_path_stat_agg.call_count
+
+    for limit in (1 << 16, 1 << 20, 1 << 30):
+        expected, full_walks = removed_paths(False, limit)
+        removed, deferred_walks = removed_paths(True, limit)
+        assert removed == expected
+        assert deferred_walks <= full_walks
+
+
+def _removed_and_walks(mock_path_stat_agg, path_infos, limit, **kwargs):
+    mock_path_stat_agg.reset_mock()
+    garbage_graph = GarbageGraph(_mock_store(path_infos), QuantityUnit.BYTES, **kwargs)
+    removed = [spn.path for spn in garbage_graph.remove_to_limit(limit)]
+    return removed, mock_path_stat_agg.call_count
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("columnar", (False, True))
+@pytest.mark.parametrize("limit", (1, 1 << 20))
+def test_defer_stats_atimes_before_registration(mock_path_stat_agg, limit, columnar):
+    # nothing about a path bounds the atimes of its files - an empty
+    # directory has none, and hard links can bring in files last accessed
+    # long before the path was registered - so deferred selection must
+    # match eager selection regardless
+    referrer = "rrrrrrrrrrrrrrrrrrrrrrrrrrrrrrrr-referrer"
+    referenced_empty = "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-referenced-empty"
+    empty = "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-empty"
+    invalid = "cccccccccccccccccccccccccccccccc-invalid"
+    path_infos = {
+        referrer: _mock_path_info(referrer, (referenced_empty,), registration_time=2_000_000_000),
+        referenced_empty: _mock_path_info(referenced_empty, registration_time=2_000_000_000),
+        empty: _mock_path_info(empty, registration_time=2_000_000_000),
+        invalid: RuntimeError("invalid"),
+    }
+    stat_aggs = {
+        referrer: (5e8, 1, 123),
+        referenced_empty: (0, 1, 0),
+        empty: (0, 1, 0),
+        invalid: (1e9, 1, 123),
+    }
+    mock_path_stat_agg.side_effect = lambda path: stat_aggs[path.removeprefix("/nix/store/")]
+
+    expected, _ = _removed_and_walks(mock_path_stat_agg, path_infos, limit, columnar=columnar)
+    removed, _ = _removed_and_walks(
+        mock_path_stat_agg,
+        path_infos,
+        limit,
+        columnar=columnar,
+        defer_stats=True,
+    )
+    assert removed == expected
+    assert expected == (
+        [empty] if limit == 1 else [empty, referrer, referenced_empty, invalid]
+    )
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("columnar", (False, True))
+def test_defer_stats_walks(mock_path_stat_agg, columnar):
+    # a recently used derivation penalized into being removed early frees
+    # its dependencies, which inherit its atime and so needn't be walked
+    # while much older paths remain
+    drv = "dddddddddddddddddddddddddddddddd-recent.drv"
+    deps = [f"{i:032d}-dep-{i}" for i in range(50)]
+    olds = [f"{i:032d}-old-{i}" for i in range(50, 60)]
+    path_infos = {
+        drv: _mock_path_info(drv, deps),
+        **{path: _mock_path_info(path) for path in deps + olds},
+    }
+    stat_aggs = {
+        drv: (1e9, 1, 123),
+        **{path: (0, 1, 123) for path in deps},
+        **{path: (i, 1, 123) for i, path in enumerate(olds)},
+    }
+    mock_path_stat_agg.side_effect = lambda path: stat_aggs[path.removeprefix("/nix/store/")]
+
+    kwargs = {"penalize_drvs": 2e9, "columnar": columnar}
+    expected, full_walks = _removed_and_walks(mock_path_stat_agg, path_infos, 123 * 5, **kwargs)
+    removed, deferred_walks = _removed_and_walks(
+        mock_path_stat_agg,
+        path_infos,
+        123 * 5,
+        defer_stats=True,
+        **kwargs,
+    )
+    assert removed == expected == [drv, *olds[:4]]
+    assert (full_walks, deferred_walks) == (61, 11)
+
+
+def test_defer_stats_negative_penalty():
+    with pytest.raises(ValueError):
+        GarbageGraph(_mock_store(), QuantityUnit.BYTES, penalize_size=-1, defer_stats=True)
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@mock.patch("nix_heuristic_gc.graph.sampled_path_stat_agg", autospec=True)
+@pytest.mark.parametrize("columnar", (False, True))
+def test_stat_file_budget(mock_sampled_path_stat_agg, mock_path_stat_agg, columnar):
+    # pretend these paths have more files than the budget
+    large_paths = {
+        "hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh-eee-5.5.5",
+        "cccccccccccccccccccccccccccccccc-ccc-3.3.3",
+    }
+    mock_sampled_path_stat_agg.side_effect = lambda path, file_budget: (
+        (123, 456, 789),
+        path.removeprefix("/nix/store/") not in large_paths,
+    )
+
+    metrics = Metrics()
+    garbage_graph = GarbageGraph(
+        _mock_store(),
+        QuantityUnit.BYTES,
+        columnar=columnar,
+        stat_file_budget=100,
+        metrics=metrics,
+    )
+    removed = garbage_graph.remove_to_limit(1 << 20)
+
+    assert not mock_path_stat_agg.called
+    assert all(c.args[1] == 100 for c in mock_sampled_path_stat_agg.mock_calls)
+    assert removed
+    for spn in removed:
+        assert (spn.max_atime, spn.inodes, spn.fs_size) == (123, 456, 789)
+        assert spn.atime_sampled == (spn.path in large_paths)
+    assert metrics.as_dict()["counters"]["sampled_stat_walks"] == sum(
+        1 for spn in removed if spn.path in large_paths
+    )
+
+
+def test_stat_file_budget_with_stat_cache():
+    with pytest.raises(ValueError):
+        GarbageGraph(
+            _mock_store(),
+            QuantityUnit.BYTES,
+            stat_cache=mock.create_autospec(StatCache, instance=True),
+            stat_file_budget=100,
+        )
+
+
+class _DictRecencySource(RecencySource):
+    def __init__(self, last_used):
+        self._last_used = last_used
+
+    def last_used(self, path):
+        return self._last_used.get(path)
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("columnar", (False, True))
+@pytest.mark.parametrize("penalize_inodes", (None, 1e6))
+def test_recency_source(mock_path_stat_agg, penalize_inodes, columnar):
+    mock_path_stat_agg.return_value = 123, 456, 789
+    recency_source = _DictRecencySource({
+        "hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh-eee-5.5.5": 1800000000,
+        # earlier than registration
+        "cccccccccccccccccccccccccccccccc-ccc-3.3.3": 1000,
+    })
+
+    garbage_graph = GarbageGraph(
+        _mock_store(),
+        QuantityUnit.BYTES,
+        penalize_inodes=penalize_inodes,
+        inherit_max_atime=False,
+        recency_source=recency_source,
+        columnar=columnar,
+    )
+    removed = {spn.path: spn.max_atime for spn in garbage_graph.remove_to_limit(1 << 20)}
+
+    assert removed["hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh-eee-5.5.5"] == 1800000000
+    assert removed["cccccccccccccccccccccccccccccccc-ccc-3.3.3"] == 1700000000
+    # invalid paths still get their atime from a walk
+    assert removed["dddddddddddddddddddddddddddddddd-ddd-4.4.4"] == 123
+
+    walked = {c.args[0].removeprefix("/nix/store/") for c in mock_path_stat_agg.mock_calls}
+    if penalize_inodes is None:
+        assert walked == {"dddddddddddddddddddddddddddddddd-ddd-4.4.4"}
+    else:
+        assert walked == set(removed)
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+def test_recency_source_plan(mock_path_stat_agg):
+    # planning shouldn't walk paths the recency source has spared
+    mock_path_stat_agg.return_value = 123, 456, 789
+    recency_source = _DictRecencySource({
+        "hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh-eee-5.5.5": 1800000000,
+    })
+
+    garbage_graph = GarbageGraph(
+        _mock_store(),
+        QuantityUnit.BYTES,
+        inherit_max_atime=False,
+        recency_source=recency_source,
+    )
+    plan = plan_reclaim(garbage_graph, [1 << 20])
+
+    walked = {c.args[0].removeprefix("/nix/store/") for c in mock_path_stat_agg.mock_calls}
+    assert walked == {"dddddddddddddddddddddddddddddddd-ddd-4.4.4"}
+    assert len(plan.curve) == len(_SIMPLE_PATH_INFOS)
+    assert plan.curve[-1].inodes is None
+
+
+# nar sizes include the nar's own framing, so are a little larger than
+# the walked sizes
+_HARDLINK_PATH_INFOS = {
+    "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1": _mock_path_info(
+        "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1",
+        nar_size=1100,
+    ),
+    "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2": _mock_path_info(
+        "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2",
+        nar_size=1100,
+    ),
+    "cccccccccccccccccccccccccccccccc-ccc-3.3.3": _mock_path_info(
+        "cccccccccccccccccccccccccccccccc-ccc-3.3.3",
+        nar_size=1100,
+    ),
+}
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg_links", autospec=True)
+@pytest.mark.parametrize("columnar", (False, True))
+@pytest.mark.parametrize("hardlink_aware", (False, True))
+def test_hardlink_aware(mock_path_stat_agg_links, mock_path_stat_agg, hardlink_aware, columnar):
+    # aaa & bbb share an 800 byte file (also linked from .links), so
+    # deleting aaa alone frees only 200 bytes
+    stats = {
+        "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1": (
+            (1000, 3, 1000), [(1, 10, 3, 800)],
+        ),
+        "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2": (
+            (2000, 3, 1000), [(1, 10, 3, 800)],
+        ),
+        "cccccccccccccccccccccccccccccccc-ccc-3.3.3": (
+            (3000, 3, 1000), [],
+        ),
+    }
+    mock_path_stat_agg_links.side_effect = lambda path: stats[path.removeprefix("/nix/store/")]
+    mock_path_stat_agg.side_effect = lambda path: stats[path.removeprefix("/nix/store/")][0]
+
+    metrics = Metrics()
+    garbage_graph = GarbageGraph(
+        _mock_store(_HARDLINK_PATH_INFOS),
+        QuantityUnit.BYTES,
+        hardlink_aware=hardlink_aware,
+        columnar=columnar,
+        metrics=metrics,
+    )
+    removed = garbage_graph.remove_to_limit(1000)
+
+    if hardlink_aware:
+        assert not mock_path_stat_agg.called
+        assert [(spn.path, spn.limit_measurement, spn.freed_size) for spn in removed] == [
+            ("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1", 200, 200),
+            # now the only remaining link outside .links
+            ("bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2", 1000, 1000),
+        ]
+        assert metrics.as_dict()["counters"]["hardlinked_files"] == 2
+    else:
+        assert not mock_path_stat_agg_links.called
+        assert [(spn.path, spn.freed_size) for spn in removed] == [
+            ("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1", 1100),
+        ]
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg_links", autospec=True)
+def test_hardlink_aware_shared_prefetcher(mock_path_stat_agg_links):
+    # as with a daemon's successive graphs, a prefetch requested by one
+    # graph may be taken by another, which should be the one accounting
+    # for its shared files
+    referrer = "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2"
+    path = "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1"
+    path_infos = {
+        referrer: _mock_path_info(referrer, (path,)),
+        path: _mock_path_info(path),
+    }
+    mock_path_stat_agg_links.return_value = ((1000, 3, 1000), [(1, 10, 3, 800)])
+
+    with StatPrefetcher(max_workers=1) as stat_prefetcher:
+        old_graph, new_graph = (
+            GarbageGraph(
+                _mock_store(path_infos),
+                QuantityUnit.BYTES,
+                hardlink_aware=True,
+                stat_prefetcher=stat_prefetcher,
+            )
+            for _ in range(2)
+        )
+        # not yet a candidate, so not yet walked by either graph
+        idx = old_graph.path_index_mapping[path]
+        stat_prefetcher.prefetch(path, old_graph._path_stat_agg, old_graph.node(idx))
+
+        new_graph._take_prefetched_stats([new_graph.path_index_mapping[path]])
+
+    assert new_graph._hardlinks._paths[path] == {(1, 10): 1}
+    assert path not in old_graph._hardlinks._paths
+
+
+@pytest.mark.parametrize("kwargs", (
+    {"stat_cache": mock.create_autospec(StatCache, instance=True)},
+    {"stat_file_budget": 100},
+))
+def test_hardlink_aware_incompatible(kwargs):
+    with pytest.raises(ValueError):
+        GarbageGraph(
+            _mock_store(),
+            QuantityUnit.BYTES,
+            hardlink_aware=True,
+            **kwargs,
+        )
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=False)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=False)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg_links", autospec=True)
+def test_hardlink_aware_batch_size(mock_path_stat_agg_links):
+    mock_path_stat_agg_links.return_value = ((1000, 3, 1000), [])
+    garbage_graph = GarbageGraph(
+        _mock_store(_HARDLINK_PATH_INFOS),
+        QuantityUnit.BYTES,
+        hardlink_aware=True,
+    )
+    with pytest.raises(ValueError):
+        garbage_graph.remove_to_limit(1000, batch_size=2)
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=True)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=True)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+@pytest.mark.parametrize("columnar", (False, True))
+@pytest.mark.parametrize("condense_cycles", (False, True))
+def test_condense_cycles(mock_path_stat_agg, condense_cycles, columnar):
+    mock_path_stat_agg.return_value = 123, 123, 123
+    mock_store = _mock_store(_DRV_PATH_INFOS)
+    mock_store.query_derivation_outputs.side_effect = _query_derivation_outputs
+
+    metrics = Metrics()
+    garbage_graph = GarbageGraph(
+        mock_store,
+        QuantityUnit.BYTES,
+        condense_cycles=condense_cycles,
+        columnar=columnar,
+        metrics=metrics,
+    )
+    # with both keep-derivations & keep-outputs, fff.drv forms a loop
+    # with its outputs, and bbb sits between two of them
+    component = {
+        "ffffffffffffffffffffffffffffffff-fff-6.6.6.drv",
+        "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1",
+        "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2",
+        "cccccccccccccccccccccccccccccccc-ccc-3.3.3",
+    }
+    removed = [spn.path for spn in garbage_graph.remove_to_limit(1 << 20)]
+
+    if not condense_cycles:
+        assert set(removed) == set(_DRV_PATH_INFOS) - component
+        assert garbage_graph.graph.num_nodes() == len(component)
+        return
+
+    assert sorted(removed) == sorted(_DRV_PATH_INFOS)
+    assert garbage_graph.graph.num_nodes() == 0
+    assert not garbage_graph.path_index_mapping
+    # members are removed together, only once their referrer eee is gone
+    first = min(removed.index(path) for path in component)
+    assert set(removed[first:first+len(component)]) == component
+    assert removed.index("hhhhhhhhhhhhhhhhhhhhhhhhhhhhhhhh-eee-5.5.5") < first
+    counters = metrics.as_dict()["counters"]
+    assert counters["condensed_components"] == 1
+    assert counters["condensed_paths"] == len(component)
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=True)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=True)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg", autospec=True)
+def test_condense_cycles_aggregates(mock_path_stat_agg):
+    mock_path_stat_agg.side_effect = lambda path: {
+        "/nix/store/aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1": (1000, 1, 10),
+        "/nix/store/bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2": (3000, 2, 20),
+    }.get(path, (2000, 3, 30))
+    mock_store = _mock_store(_DRV_PATH_INFOS)
+    mock_store.query_derivation_outputs.side_effect = _query_derivation_outputs
+
+    garbage_graph = GarbageGraph(
+        mock_store,
+        QuantityUnit.BYTES,
+        condense_cycles=True,
+        collect_drvs=False,
+    )
+    idx = garbage_graph.path_index_mapping["aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1"]
+    spn = garbage_graph.node(idx)
+    assert isinstance(spn, garbage_graph.ComponentNode)
+    assert spn.valid
+    assert spn.is_drv
+    assert spn.size == sum(
+        _DRV_PATH_INFOS[member.path].nar_size for member in spn.members
+    )
+    assert spn.inodes == 1 + 2 + 3 + 3
+    assert spn.max_atime == 3000
+    # the component includes fff.drv so can't be collected at all
+    assert not spn.collection_allowed
+    removed = {spn.path for spn in garbage_graph.remove_to_limit(1 << 20)}
+    assert "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1" not in removed
+
+
+@mock.patch("nix_heuristic_gc.graph._nix_store_path", new="/nix/store")
+@mock.patch("nix_heuristic_gc.graph._gc_keep_derivations", new=True)
+@mock.patch("nix_heuristic_gc.graph._gc_keep_outputs", new=True)
+@mock.patch("nix_heuristic_gc.graph.path_stat_agg_links", autospec=True)
+def test_condense_cycles_hardlink_aware(mock_path_stat_agg_links):
+    # aaa & bbb share an 800 byte file only with each other (and .links),
+    # which deleting their component as a whole frees
+    mock_path_stat_agg_links.side_effect = lambda path: {
+        "/nix/store/aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1": ((1000, 2, 1000), [(1, 10, 3, 800)]),
+        "/nix/store/bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2": ((1000, 2, 1000), [(1, 10, 3, 800)]),
+    }.get(path, ((2000, 1, 100), []))
+    mock_store = _mock_store(_DRV_PATH_INFOS)
+    mock_store.query_derivation_outputs.side_effect = _query_derivation_outputs
+
+    garbage_graph = GarbageGraph(
+        mock_store,
+        QuantityUnit.BYTES,
+        condense_cycles=True,
+        hardlink_aware=True,
+    )
+    idx = garbage_graph.path_index_mapping["aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1"]
+    spn = garbage_graph.node(idx)
+    assert isinstance(spn, garbage_graph.ComponentNode)
+    others = len(spn.members) - 2
+    assert spn.freed_size == 200 + 200 + 800 + 100 * others
+    assert spn.freed_inodes == 1 + 1 + 1 + 1 * others
+    assert spn.limit_measurement == spn.freed_size
@@ -0,0 +1,46 @@
+from nix_heuristic_gc.graph_snapshot import GraphSnapshot
+
+_PATH_INFO_A = (
+    "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1",
+    123,
+    1700000000,
+    ("bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2",),
+)
+_PATH_INFO_B = ("bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2", 456, 1700000001, ())
+_PATH_INFO_INVALID = ("cccccccccccccccccccccccccccccccc-ccc-3.3.3", None, None, ())
+
+
+def test_graph_snapshot(tmp_path):
+    db_path = str(tmp_path / "graph-snapshot.sqlite")
+
+    with GraphSnapshot(db_path, context="local") as graph_snapshot:
+        assert graph_snapshot.get(_PATH_INFO_A[0]) is None
+        graph_snapshot.put([_PATH_INFO_A, _PATH_INFO_B, _PATH_INFO_INVALID])
+        assert (graph_snapshot.hits, graph_snapshot.misses) == (0, 1)
+
+    with GraphSnapshot(db_path, context="local") as graph_snapshot:
+        assert graph_snapshot.get(_PATH_INFO_A[0]) == _PATH_INFO_A
+        assert graph_snapshot.get(_PATH_INFO_B[0]) == _PATH_INFO_B
+        # invalid paths shouldn't be remembered
+        assert graph_snapshot.get(_PATH_INFO_INVALID[0]) is None
+        assert (graph_snapshot.hits, graph_snapshot.misses) == (2, 1)
+
+        graph_snapshot.retain([_PATH_INFO_B[0]])
+        assert graph_snapshot.get(_PATH_INFO_A[0]) is None
+
+    with GraphSnapshot(db_path, context="local") as graph_snapshot:
+        assert graph_snapshot.get(_PATH_INFO_A[0]) is None
+        assert graph_snapshot.get(_PATH_INFO_B[0]) == _PATH_INFO_B
+
+    with GraphSnapshot(db_path, context="daemon") as graph_snapshot:
+        assert graph_snapshot.get(_PATH_INFO_B[0]) is None
+
+
+def test_graph_snapshot_max_age(tmp_path):
+    db_path = str(tmp_path / "graph-snapshot.sqlite")
+
+    with GraphSnapshot(db_path) as graph_snapshot:
+        graph_snapshot.put([_PATH_INFO_A])
+
+    with GraphSnapshot(db_path, max_age=0) as graph_snapshot:
+        assert graph_snapshot.get(_PATH_INFO_A[0]) is None
@@ -0,0 +1,69 @@
+from nix_heuristic_gc.hardlinks import HardlinkIndex
+
+
+def test_hardlink_index():
+    index = HardlinkIndex()
+    # file 10 linked from a, b and .links, file 11 twice from a and .links,
+    # file 12 from c and .links
+    index.add("a", [(1, 10, 3, 800), (1, 11, 3, 50), (1, 11, 3, 50)])
+    index.add("b", [(1, 10, 3, 800)])
+    index.add("c", [(1, 12, 2, 30)])
+
+    assert index.marginal_size("a", 1000) == 100 + 50
+    assert index.marginal_inodes("a", 5) == 2 + 1
+    assert index.marginal_size("b", 1000) == 200
+    assert index.marginal_size("c", 100) == 100
+    assert index.marginal_inodes("c", 1) == 1
+    # paths without shared files
+    assert index.marginal_size("d", 100) == 100
+
+    index.remove("a")
+    # fixed as of removal
+    assert index.marginal_size("a", 1000) == 150
+    assert index.marginal_size("b", 1000) == 1000
+    assert index.marginal_inodes("b", 1) == 1
+
+    # re-adding a removed path is ignored
+    index.add("a", [(1, 10, 3, 800)])
+    assert index.marginal_size("b", 1000) == 1000
+
+
+def test_hardlink_index_nar_size_smaller():
+    # nar sizes aren't exactly file sizes, so sharing may seem to exceed
+    # a path's size
+    index = HardlinkIndex()
+    index.add("a", [(1, 10, 3, 800)])
+    index.add("b", [(1, 10, 3, 800)])
+    assert index.marginal_size("a", 700) == 0
+
+
+def test_hardlink_index_joint():
+    # file 10 linked only from a, b and .links is freed by deleting a and
+    # b together, though by neither alone
+    index = HardlinkIndex()
+    index.add("a", [(1, 10, 3, 800)])
+    index.add("b", [(1, 10, 3, 800)])
+    index.add("c", [(1, 11, 2, 30)])
+
+    assert index.marginal_size("a", 1000) + index.marginal_size("b", 1000) == 400
+    assert index.marginal_size(["a", "b"], 2000) == 400 + 800
+    assert index.marginal_inodes(["a", "b"], 4) == 2 + 1
+    assert index.marginal_size(["a", "c"], 1100) == 200 + 100
+
+    # removed paths contribute what they were fixed to
+    index.remove("a")
+    assert index.marginal_size(["a", "b"], 2000) == 200 + 1000
+
+
+def test_hardlink_index_more_links_than_counted():
+    # file 10 has no .links entry, so its three links are all in a & b,
+    # outlasting the two links outside .links its nlink suggests
+    index = HardlinkIndex()
+    index.add("a", [(1, 10, 3, 800), (1, 10, 3, 800)])
+    index.add("b", [(1, 10, 3, 800)])
+
+    index.remove("a")
+    assert index.marginal_size("b", 1000) == 1000
+    assert index.marginal_inodes("b", 2) == 2
+    index.remove("b")
+    assert index.marginal_size("b", 1000) == 1000
@@ -0,0 +1,101 @@
+import json
+import os
+from threading import Thread
+
+import pytest
+
+from nix_heuristic_gc.metrics import Metrics
+
+
+def test_metrics_phases_and_counters():
+    metrics = Metrics()
+
+    with metrics.phase("a"):
+        metrics.count("x")
+    with metrics.phase("a"):
+        metrics.count("x", 4)
+
+    metrics.begin_phase("b")
+    metrics.count("y", 2)
+    # implicitly ends "b"
+    metrics.begin_phase("c")
+    metrics.end_phase()
+    # nothing to end
+    metrics.end_phase()
+
+    d = metrics.as_dict()
+    assert d["phases"]["a"]["count"] == 2
+    assert d["phases"]["b"]["count"] == 1
+    assert d["phases"]["c"]["count"] == 1
+    assert all(p["wall_seconds"] >= 0 for p in d["phases"].values())
+    assert d["counters"] == {"x": 5, "y": 2}
+    assert d["peak_rss_bytes"] > 0
+
+
+def test_metrics_phases_per_thread():
+    metrics = Metrics()
+    metrics.begin_phase("main")
+
+    def other():
+        metrics.begin_phase("other")
+        metrics.end_phase()
+
+    t = Thread(target=other)
+    t.start()
+    t.join()
+
+    # "main" shouldn't have been ended by the other thread
+    assert set(metrics.as_dict()["phases"]) == {"other"}
+    metrics.end_phase()
+    assert set(metrics.as_dict()["phases"]) == {"main", "other"}
+
+
+def test_metrics_to_prometheus():
+    metrics = Metrics()
+    with metrics.phase("build_graph"):
+        pass
+    metrics.count("stat_walks", 3)
+
+    lines = metrics.to_prometheus().splitlines()
+    assert "# TYPE nix_heuristic_gc_phase_wall_seconds gauge" in lines
+    assert any(
+        line.startswith('nix_heuristic_gc_phase_wall_seconds{phase="build_graph"} ')
+        for line in lines
+    )
+    assert 'nix_heuristic_gc_phase_runs{phase="build_graph"} 1' in lines
+    assert "# TYPE nix_heuristic_gc_stat_walks_total counter" in lines
+    assert "nix_heuristic_gc_stat_walks_total 3" in lines
+    assert any(line.startswith("nix_heuristic_gc_peak_rss_bytes ") for line in lines)
+
+
+@pytest.mark.parametrize("filename,fmt,expected_fmt", (
+    ("metrics.json", None, "json"),
+    ("metrics.prom", None, "prometheus"),
+    ("metrics.prom", "json", "json"),
+    ("metrics.txt", "prometheus", "prometheus"),
+))
+def test_metrics_write(tmp_path, filename, fmt, expected_fmt):
+    metrics = Metrics()
+    metrics.count("stat_walks", 3)
+    path = str(tmp_path / filename)
+
+    # should be replaced
+    with open(path, "w") as f:
+        f.write("old")
+
+    metrics.write(path, fmt)
+
+    with open(path) as f:
+        content = f.read()
+    if expected_fmt == "json":
+        assert json.loads(content)["counters"] == {"stat_walks": 3}
+    else:
+        assert "nix_heuristic_gc_stat_walks_total 3\n" in content
+
+    # no temporary files left behind
+    assert os.listdir(tmp_path) == [filename]
+
+
+def test_metrics_write_bad_format(tmp_path):
+    with pytest.raises(ValueError):
+        Metrics().write(str(tmp_path / "metrics"), "xml")
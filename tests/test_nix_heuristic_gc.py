@@ -9,7 +9,8 @@ from nix_heuristic_gc.quantity import Quantity, QuantityUnit
 
 @pytest.mark.parametrize("dry_run", (False, True))
 @pytest.mark.parametrize("unit", (QuantityUnit.BYTES, QuantityUnit.INODES))
-def test_empty_local_store(caplog, dry_run, unit):
+@pytest.mark.parametrize("path_info_mode", ("serial", "async", "batch", "db"))
+def test_empty_local_store(caplog, dry_run, unit, path_info_mode):
     caplog.set_level(logging.DEBUG)
 
     nix_heuristic_gc(
@@ -17,6 +18,7 @@ def test_empty_local_store(caplog, dry_run, unit):
         penalize_substitutable=None,  # avoid network requests
         dry_run=dry_run,
         threads=0,
+        path_info_mode=path_info_mode,
     )
 
     assert "requesting deletion of 0 store paths, total size 0 bytes, 0 inodes" in caplog.text
@@ -0,0 +1,108 @@
+import csv
+import io
+import json
+from unittest import mock
+
+import pytest
+
+from nix_heuristic_gc.plan import plan_reclaim, write_plan
+
+
+def _mock_spn(i, size, max_atime, walked=True):
+    return mock.Mock(
+        path=f"{i:032d}-path-{i}",
+        size=size,
+        _inodes=2 if walked else None,
+        freed_size=size,
+        freed_inodes=2,
+        limit_measurement=size,
+        max_atime=max_atime,
+    )
+
+
+def _mock_graph(spns):
+    garbage_graph = mock.Mock()
+    garbage_graph.iter_remove_to_limit.side_effect = (
+        lambda limit, batch_size, with_scores: (
+            (spn, float(spn.max_atime)) for spn in spns
+        )
+    )
+    return garbage_graph
+
+
+_SPNS = [
+    _mock_spn(0, 100, 10),
+    _mock_spn(1, 50, 30),
+    _mock_spn(2, 200, 20),
+    _mock_spn(3, 10, 40),
+]
+
+
+def test_plan_reclaim():
+    garbage_graph = _mock_graph(_SPNS)
+    plan = plan_reclaim(garbage_graph, [150, 100, 1000, 120, 150], batch_size=3)
+
+    garbage_graph.iter_remove_to_limit.assert_called_once_with(
+        1000,
+        batch_size=3,
+        with_scores=True,
+    )
+    assert plan.limits == [100, 120, 150, 1000]
+    assert [(p.paths, p.bytes, p.inodes, p.atime_boundary) for p in plan.curve] == [
+        (1, 100, 2, 10),
+        (2, 150, 4, 30),
+        (3, 350, 6, 30),
+        (4, 360, 8, 40),
+    ]
+    assert [p.score for p in plan.curve] == [10.0, 30.0, 20.0, 40.0]
+    assert plan.thresholds == {
+        100: plan.curve[0],
+        120: plan.curve[1],
+        150: plan.curve[1],
+    }
+
+
+def test_plan_reclaim_unwalked():
+    # e.g. with a recency source, paths needn't have been walked, and
+    # shouldn't be just to report their inodes
+    spns = [_mock_spn(0, 100, 10), _mock_spn(1, 50, 30, walked=False), _mock_spn(2, 200, 20)]
+    plan = plan_reclaim(_mock_graph(spns), [1000])
+
+    assert [(p.bytes, p.inodes) for p in plan.curve] == [(100, 2), (150, None), (350, None)]
+
+
+def test_plan_reclaim_no_limits():
+    with pytest.raises(ValueError):
+        plan_reclaim(_mock_graph(_SPNS), [])
+
+
+def test_write_plan_json(tmp_path):
+    plan = plan_reclaim(_mock_graph(_SPNS), [120, 1000])
+    path = str(tmp_path / "plan.json")
+    write_plan(plan, path)
+
+    with open(path) as f:
+        d = json.load(f)
+    assert [
+        (t["limit"], t["reached"], t["paths"], t["bytes"]) for t in d["thresholds"]
+    ] == [
+        (120, True, 2, 150),
+        # reports the most that could be reclaimed
+        (1000, False, 4, 360),
+    ]
+    assert [p["path"] for p in d["curve"]] == [spn.path for spn in _SPNS]
+
+
+def test_write_plan_csv(tmp_path, capsys):
+    plan = plan_reclaim(_mock_graph(_SPNS), [100, 120, 350])
+    write_plan(plan, "-", "csv")
+
+    rows = list(csv.DictReader(io.StringIO(capsys.readouterr().out)))
+    assert [row["path"] for row in rows] == [spn.path for spn in _SPNS]
+    assert [row["bytes"] for row in rows] == ["100", "150", "350", "360"]
+    assert [row["thresholds"] for row in rows] == ["100", "120", "350", ""]
+
+
+def test_write_plan_bad_format(tmp_path):
+    with pytest.raises(ValueError):
+        write_plan(plan_reclaim(_mock_graph(_SPNS), [1]), str(tmp_path / "plan"), "xml")
@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+import pytest
+
+from nix_heuristic_gc.prefetch import StatPrefetcher
+
+
+def test_stat_prefetcher():
+    with StatPrefetcher(max_workers=2, max_pending=2) as prefetcher:
+        prefetcher.prefetch("a", lambda x: x * 2, 1)
+        # already pending, so shouldn't be requested again
+        prefetcher.prefetch("a", lambda x: x * 3, 1)
+        prefetcher.prefetch("b", lambda x: x * 2, 2)
+        # should push out "a"
+        prefetcher.prefetch("c", lambda x: x * 2, 3)
+
+        assert "a" not in prefetcher
+        assert prefetcher.take("a") is None
+        assert prefetcher.take("c") == 6
+        assert prefetcher.take("b") == 4
+        # results can only be taken once
+        assert prefetcher.take("b") is None
+
+        assert prefetcher.hits + prefetcher.waits == 2
+        assert prefetcher.misses == 2
+        assert prefetcher.discarded == 1
+        assert prefetcher.hit_rate == pytest.approx(prefetcher.hits / 4)
+
+
+def test_stat_prefetcher_wait():
+    release = Event()
+    with StatPrefetcher(max_workers=1) as prefetcher:
+        prefetcher.prefetch("a", lambda: release.wait() and "done")
+        release.set()
+        assert prefetcher.take("a") == "done"
+        assert prefetcher.take("a") is None
+
+
+def test_stat_prefetcher_exception():
+    def raiser():
+        raise FileNotFoundError()
+
+    with StatPrefetcher(max_workers=1) as prefetcher:
+        prefetcher.prefetch("a", raiser)
+        with pytest.raises(FileNotFoundError):
+            prefetcher.take("a")
+
+
+def test_stat_prefetcher_threads():
+    # e.g. a daemon's reclaim and refresh threads sharing a prefetcher
+    with StatPrefetcher(max_workers=2, max_pending=8) as prefetcher:
+        def user(offset):
+            taken = 0
+            for i in range(offset, offset + 2000):
+                prefetcher.prefetch(i, lambda x: x, i)
+                taken += prefetcher.take(i - 4) is not None
+            return taken
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            taken = sum(executor.map(user, range(0, 8000, 2000)))
+
+        claimed = prefetcher.hits + prefetcher.waits
+        assert claimed == taken
+        assert claimed + prefetcher.misses == 8000
+        assert claimed + prefetcher.discarded + len(prefetcher._pending) == 8000
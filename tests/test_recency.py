@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from nix_heuristic_gc.recency import AccessLogIndex, RecencySource, record_access
+
+_A = "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1"
+_B = "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2"
+
+
+def test_access_log_index(tmp_path):
+    db_path = str(tmp_path / "index.sqlite")
+    log_path = str(tmp_path / "access.log")
+
+    # log needn't exist yet
+    with AccessLogIndex(db_path, log_path, "/nix/store/") as index:
+        assert index.last_used(_A) is None
+
+    record_access(log_path, f"/nix/store/{_A}/bin/a", when=1000)
+    record_access(log_path, _B, when=3000)
+    record_access(log_path, f"/nix/store/{_A}", when=2000)
+    record_access(log_path, f"/nix/store/{_A}/lib/liba.so", when=1500)
+    with open(log_path, "a") as f:
+        # ignored
+        f.write("garbage\n")
+        f.write("4000 /usr/bin/outside-store\n")
+        # partially written - not read until complete
+        f.write(f"5000 /nix/store/{_B}")
+
+    with AccessLogIndex(db_path, log_path, "/nix/store") as index:
+        assert index.last_used(_A) == 2000
+        assert index.last_used(f"/nix/store/{_B}") == 3000
+        assert index.last_used("/usr/bin/outside-store") is None
+
+        with open(log_path, "a") as f:
+            f.write("/bin/b\n")
+        index.update()
+        assert index.last_used(_B) == 5000
+        assert (index.hits, index.misses) == (3, 1)
+
+    # only new entries are read by a new instance
+    record_access(log_path, _A, when=6000)
+    with AccessLogIndex(db_path, log_path, "/nix/store") as index:
+        assert index.last_used(_A) == 6000
+        assert index.last_used(_B) == 5000
+
+    # replaced log is read from the start, earlier entries being kept
+    os.unlink(log_path)
+    record_access(log_path, _B, when=7000)
+    with AccessLogIndex(db_path, log_path, "/nix/store") as index:
+        assert index.last_used(_A) == 6000
+        assert index.last_used(_B) == 7000
+
+
+def test_record_access_default_time(tmp_path):
+    log_path = str(tmp_path / "access.log")
+    record_access(log_path, _A)
+    with open(log_path) as f:
+        timestamp, path = f.read().split()
+    assert path == _A
+    assert float(timestamp) > 1_600_000_000
+
+
+def test_recency_source_abstract():
+    with pytest.raises(TypeError):
+        RecencySource()
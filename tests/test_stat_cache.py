@@ -0,0 +1,90 @@
+import os
+from unittest import mock
+
+from nix_heuristic_gc.stat_cache import StatCache
+
+
+def _make_store(tmp_path):
+    store_dir = tmp_path / "store"
+    pkg = store_dir / "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1"
+    (pkg / "bin").mkdir(parents=True)
+    (pkg / "bin" / "aaa").write_bytes(b"x" * 100)
+    (pkg / "share").mkdir()
+    (pkg / "share" / "doc").write_bytes(b"y" * 10)
+    os.utime(pkg / "bin" / "aaa", (2000, 1))
+    os.utime(pkg / "share" / "doc", (1000, 1))
+    (store_dir / "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2").write_bytes(b"z" * 5)
+    os.utime(store_dir / "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2", (3000, 1))
+    return store_dir
+
+
+def test_stat_cache(tmp_path):
+    store_dir = _make_store(tmp_path)
+    db_path = str(tmp_path / "stat-cache.sqlite")
+
+    with StatCache(db_path, str(store_dir), hot_count=1) as stat_cache:
+        assert stat_cache.path_stat_agg(
+            "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1",
+            1,
+        ) == (2000, 5, 110)
+        assert stat_cache.path_stat_agg(
+            "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2",
+            1,
+        ) == (3000, 1, 5)
+        assert (stat_cache.hits, stat_cache.misses) == (0, 2)
+
+    # accessing the most recently accessed file should be noticed
+    os.utime(store_dir / "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1" / "bin" / "aaa", (4000, 1))
+    os.utime(store_dir / "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2", (5000, 1))
+    # but with a hot_count of 1, other files won't be re-examined
+    os.utime(store_dir / "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1" / "share" / "doc", (6000, 1))
+
+    with StatCache(db_path, str(store_dir), hot_count=1) as stat_cache:
+        with mock.patch("nix_heuristic_gc.stat_cache.path_stat_agg_hot_files") as mock_walk:
+            assert stat_cache.path_stat_agg(
+                "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1",
+                1,
+            ) == (4000, 5, 110)
+            assert stat_cache.path_stat_agg(
+                "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2",
+                1,
+            ) == (5000, 1, 5)
+            assert not mock_walk.called
+        assert (stat_cache.hits, stat_cache.misses) == (2, 0)
+
+        # a re-registered path mustn't be taken from the cache
+        assert stat_cache.path_stat_agg(
+            "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1",
+            2,
+        ) == (6000, 5, 110)
+        assert (stat_cache.hits, stat_cache.misses) == (2, 1)
+
+
+def test_stat_cache_max_age(tmp_path):
+    store_dir = _make_store(tmp_path)
+    db_path = str(tmp_path / "stat-cache.sqlite")
+
+    with StatCache(db_path, str(store_dir)) as stat_cache:
+        stat_cache.path_stat_agg("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1", 1)
+
+    with StatCache(db_path, str(store_dir), max_age=0) as stat_cache:
+        stat_cache.path_stat_agg("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1", 1)
+        assert (stat_cache.hits, stat_cache.misses) == (0, 1)
+
+
+def test_stat_cache_eviction(tmp_path):
+    store_dir = _make_store(tmp_path)
+    db_path = str(tmp_path / "stat-cache.sqlite")
+
+    with StatCache(db_path, str(store_dir)) as stat_cache:
+        stat_cache.path_stat_agg("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1", 1)
+        stat_cache.path_stat_agg("bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2", 1)
+
+    os.unlink(store_dir / "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2")
+
+    with StatCache(db_path, str(store_dir)) as stat_cache:
+        stat_cache.prune()
+        stat_cache.evict(["aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1"])
+
+    with StatCache(db_path, str(store_dir)) as stat_cache:
+        assert stat_cache._entries == {}
@@ -0,0 +1,70 @@
+from unittest import mock
+
+from nix_heuristic_gc import libnixstore_wrapper as libstore
+from nix_heuristic_gc.substitutable_cache import SubstitutableCache
+
+_PATH_A = "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-aaa-1.1.1"
+_PATH_B = "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb-bbb-2.2.2"
+_PATH_C = "cccccccccccccccccccccccccccccccc-ccc-3.3.3"
+
+
+def _mock_query_func():
+    return mock.Mock(side_effect=lambda store_paths: {
+        libstore.StorePath(_PATH_A),
+    } & store_paths)
+
+
+def test_substitutable_cache(tmp_path):
+    db_path = str(tmp_path / "substitutable-cache.sqlite")
+    store_paths = {libstore.StorePath(p) for p in (_PATH_A, _PATH_B)}
+
+    query_func = _mock_query_func()
+    with SubstitutableCache(db_path, context="local") as substitutable_cache:
+        assert substitutable_cache.query_substitutable_paths(
+            store_paths,
+            query_func,
+        ) == {libstore.StorePath(_PATH_A)}
+        assert query_func.call_args_list == [mock.call(store_paths)]
+        assert (substitutable_cache.hits, substitutable_cache.misses) == (0, 2)
+
+    query_func = _mock_query_func()
+    with SubstitutableCache(db_path, context="local") as substitutable_cache:
+        assert substitutable_cache.query_substitutable_paths(
+            store_paths | {libstore.StorePath(_PATH_C)},
+            query_func,
+        ) == {libstore.StorePath(_PATH_A)}
+        # only the uncached path should have been queried
+        assert query_func.call_args_list == [
+            mock.call({libstore.StorePath(_PATH_C)}),
+        ]
+        assert (substitutable_cache.hits, substitutable_cache.misses) == (2, 1)
+
+
+def test_substitutable_cache_context(tmp_path):
+    db_path = str(tmp_path / "substitutable-cache.sqlite")
+    store_paths = {libstore.StorePath(_PATH_A)}
+
+    with SubstitutableCache(db_path, context="local") as substitutable_cache:
+        substitutable_cache.query_substitutable_paths(store_paths, _mock_query_func())
+
+    query_func = _mock_query_func()
+    with SubstitutableCache(db_path, context="daemon") as substitutable_cache:
+        substitutable_cache.query_substitutable_paths(store_paths, query_func)
+        assert query_func.call_args_list == [mock.call(store_paths)]
+
+
+def test_substitutable_cache_ttl(tmp_path):
+    db_path = str(tmp_path / "substitutable-cache.sqlite")
+    store_paths = {libstore.StorePath(_PATH_A)}
+
+    with SubstitutableCache(db_path) as substitutable_cache:
+        substitutable_cache.query_substitutable_paths(store_paths, _mock_query_func())
+
+    query_func = _mock_query_func()
+    with SubstitutableCache(db_path, ttl=0) as substitutable_cache:
+        assert substitutable_cache.query_substitutable_paths(
+            store_paths,
+            query_func,
+        ) == store_paths
+        assert query_func.call_args_list == [mock.call(store_paths)]
+        assert (substitutable_cache.hits, substitutable_cache.misses) == (0, 1)